@@ -1,6 +1,6 @@
 import geopandas as gpd
 import pandas as pd
-from shapely.geometry import Point
+import numpy as np
 import os
 
 # --- PARAMETERS ---
@@ -8,6 +8,7 @@ worksp = 'path/to/workspace/containing/input/folder'
 umkreis = 10000  # buffer in meters, set to same value as in next scripts
 crs = 'EPSG:25832'  # Make sure all files are in or transformed to this CRS
 zensus_crs = 3035
+chunksize = 1000000  # rows of the census csv read at once, peak memory depends on this (None reads the whole file)
 
 # --- FILE INPUTS ---
 municip_path = os.path.join(worksp, 'input', 'municipalites.gpkg')  # here: all municipalities in regions of interest with field `region` indicating municipalities belonging together
@@ -25,18 +26,44 @@ buffer = regions.copy()
 buffer.geometry = regions.buffer(umkreis)
 
 
+## bounding boxes of the buffers in the crs of the census coordinates for prefiltering rows
+buffer_bounds = buffer.to_crs(epsg=zensus_crs).bounds.to_numpy()
+
+
 # zensus points
 
 ## Population data is available in csv with x and y coordinates of centroid of 100m grid -> transform this to point geometries
-zensus_csv = pd.read_csv(zensus_csv_path, sep=";")
-zensus_csv["geometry"] = [Point(xy) for xy in zip(zensus_csv["x_mp_100m"], zensus_csv["y_mp_100m"])]
-zensus_gdf = gpd.GeoDataFrame(zensus_csv, geometry = "geometry")
-# set crs the original coordinates were in and transform to working crs
-zensus_gdf.set_crs(epsg=zensus_crs, inplace=True).to_crs(crs, inplace = True)  
+## csv is read in chunks, only rows within the bounding box of a buffer get a geometry
+if os.path.exists(zensus_out):
+    os.remove(zensus_out)
+
+coord_types = {"x_mp_100m": "int32", "y_mp_100m": "int32"}
+chunks = pd.read_csv(zensus_csv_path, sep=";", dtype=coord_types, chunksize=chunksize) if chunksize \
+    else [pd.read_csv(zensus_csv_path, sep=";", dtype=coord_types)]
+
+n_points = 0
+for zensus_csv in chunks:
+    x = zensus_csv["x_mp_100m"].to_numpy()
+    y = zensus_csv["y_mp_100m"].to_numpy()
+    in_bbox = np.zeros(len(zensus_csv), dtype=bool)
+    for xmin, ymin, xmax, ymax in buffer_bounds:
+        in_bbox |= (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+    if not in_bbox.any():
+        continue
+
+    zensus_csv = zensus_csv[in_bbox]
+    zensus_gdf = gpd.GeoDataFrame(zensus_csv, geometry=gpd.points_from_xy(zensus_csv["x_mp_100m"], zensus_csv["y_mp_100m"]))
+    # set crs the original coordinates were in and transform to working crs
+    zensus_gdf.set_crs(epsg=zensus_crs, inplace=True).to_crs(crs, inplace = True)  
+
+    # clip zensus points to buffer
+    zensus_clip = zensus_gdf.clip(buffer)
+    if zensus_clip.empty:
+        continue
 
-# clip zensus points to buffer
-zensus_clip = zensus_gdf.clip(buffer)
+    # export, append chunks to the same layer
+    zensus_clip.to_file(zensus_out, driver = "GPKG", mode = "a" if n_points else "w")
+    n_points += len(zensus_clip)
 
-# export
-zensus_clip.to_file(zensus_out, driver = "GPKG")
+print(f"{n_points} census points within the buffers")
 
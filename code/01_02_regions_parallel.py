@@ -0,0 +1,298 @@
+# Headless run of scripts 01 and 02 for many regions in parallel (no QGIS needed)
+# Every region runs in its own process: roads from a local OSM extract (osm_extract.py), road points
+# (road_points.py), population (population.py), random sample and matrices (ors_matrix.py or local_routing.py).
+# The outputs have the names and fields of scripts 01 and 02, so script 03 runs on them unchanged.
+# All regions share one limit of concurrent ORS requests, a region that fails is logged and does not stop the
+# others. The duration of every stage per region is written to output/run_summary_{date}.csv.
+# With shared_od_store the grids of all regions are aligned and the sample is taken by location, so neighbouring
+# regions share their road points in the overlapping buffers and every pair is routed only once (od_store.py).
+# With combine_regions the centrality of every region is computed (steps 1-5 of script 03, impedance.py) and all
+# regions are written to one layer with the maximum in overlapping regions.
+# With write_metrics every region records its stages, ORS requests and progress (run_metrics.py) in
+# output/metrics/{date_time}/, a report of the slowest regions and origins is printed at the end.
+
+import os, sys, time, traceback
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+now = datetime.now()
+
+# --- PARAMETERS ---
+worksp = 'path/to/workspace/'
+umkreis = 10000  # buffer in meters, same as in scripts 00-03
+crs = 'EPSG:25832'
+pct = 50
+count_nearest_destinations = f'{pct}perc'
+grid_space = 1000
+ew_field = 'Einwohner'
+region_field = "region"
+zensus_geomtype = "Point"  # 'Point' or 'Raster'
+grid_mode = 'uniform'  # 'uniform' or 'adaptive' quadtree grid refined where the population is dense (see script 01)
+adaptive_min_space = 250
+adaptive_max_space = 4000
+adaptive_budget = None  # road points per region, None: as many as the uniform grid with grid_space
+sample_seed = 1  # seed of the random sample of pct % of the road points (native:randomextract in 02)
+reuse_selection = True  # reuse an existing random sample of the region
+matrix_engine = 'ors'  # 'ors' or 'local' (see script 02)
+matrix_format = 'csv'  # 'csv' or 'arrow' (see script 02)
+shared_od_store = True  # matrix_engine = 'ors': aligned grids, sample by location and one store of routed pairs for all regions
+combine_regions = True  # centrality of all regions in output/centrality_{pct}perc_max_{date}.gpkg, maximum in overlapping regions
+
+# ORS settings for matrix_engine = 'ors'
+ors_url = 'http://localhost:8080/ors'
+ors_profile = 'driving-car'
+ors_max_routes = 2500
+ors_concurrency = 4  # parallel matrix requests per region
+ors_max_requests = 8  # parallel matrix requests of all regions together, protects the ORS instance
+ors_precheck = False  # snap all points once and leave out points that can not be routed before the matrix (see script 02)
+ors_snap_radius = 350  # m
+
+# metrics of the run (run_metrics.py)
+write_metrics = True  # stage durations and peak memory, ORS requests, progress with ETA per region as JSON lines
+metrics_prometheus = False  # also write the totals as Prometheus text (metrics_{region}.prom)
+progress_interval = 60  # seconds between progress summaries in the region logs, None: no summaries
+
+# resources
+region_processes = 4  # regions computed at the same time
+local_processes = None  # cores for matrix_engine = 'local' shared by the regions, None = all cores
+
+# --- FILE INPUTS ---
+municip_path = os.path.join(worksp, 'input', 'municipalites.gpkg')
+zensus = os.path.join(worksp, 'input', 'zensus2022_ew_buffer.gpkg')  # output of script 00 (or population raster)
+osm_extract_path = os.path.join(worksp, 'input', 'OSM', 'nordrhein-westfalen-latest.osm.pbf')  # e.g. from Geofabrik
+
+sys.path.append(os.path.join(worksp, 'code'))
+import osm_extract
+import road_points
+import population
+import matrix_store
+import od_store
+if combine_regions:
+    import impedance
+if matrix_engine == 'ors':
+    import ors_matrix
+if matrix_engine == 'local':
+    import local_routing
+if write_metrics:
+    import run_metrics
+
+
+# same file names as set_outpaths in scripts 01 and 02
+def set_outpaths(region_name):
+    date_tag = now.strftime('%y_%m_%d')
+    output_folder = os.path.join(worksp, f'output/{region_name}_{count_nearest_destinations}_{date_tag}/')
+    matrix_folder = os.path.join(output_folder, 'Matrizen')
+    os.makedirs(matrix_folder, exist_ok=True)
+    os.makedirs(os.path.join(worksp, 'output', 'buffer'), exist_ok=True)
+    return {
+        'output_folder': output_folder,
+        'matrix_folder': matrix_folder,
+        'matrix_store_folder': os.path.join(output_folder, 'matrix'),
+        'buffer_out': os.path.join(worksp, f'output/buffer/buffer_{region_name}.gpkg'),
+        'highways_out': os.path.join(worksp, f'output/highways_{region_name}.gpkg'),
+        'points_out': os.path.join(worksp, f'output/osmpoints_{grid_space}mgrid_{region_name}.gpkg'),
+        'points_out_2': os.path.join(worksp, f'output/osmpoints_mitEWsum_{grid_space}mgrid_{region_name}.gpkg'),
+        'extract_file': os.path.join(output_folder, f'random_extract_{region_name}.gpkg'),
+        'destins_10perc_out': os.path.join(output_folder, f'{region_name}_10perc_ew.gpkg'),
+        'destins_out': os.path.join(output_folder, f'destination_points_{grid_space}mgrid_{region_name}{count_nearest_destinations}.gpkg'),
+        'err_out': os.path.join(output_folder, 'err_points_' + now.strftime('%y_%m_%d') + '.gpkg'),
+        'centrality_out': os.path.join(output_folder, f'centrality_{region_name}_{count_nearest_destinations}_oA.gpkg'),
+    }
+
+
+# population of the census points (or raster cells) in the buffer summed on the nearest point
+def population_sum(points, region_shape):
+    if zensus_geomtype == "Raster":
+        return population.raster_population_sum(population.point_xy(points), zensus, region_shape, crs)
+    ew_xy, ew_values = population.census_population(zensus, region_shape, crs, ew_field)
+    return population.population_sum(population.point_xy(points), ew_xy, ew_values)
+
+
+# --- WORKERS ---
+# semaphore of the ORS requests, handed to every worker process at start
+request_slots = None
+
+
+def init_worker(slots):
+    global request_slots
+    request_slots = slots
+
+
+@contextmanager
+def timed(summary, stage, metrics=None):
+    start = time.perf_counter()
+    logging.info(f"{stage}...")
+    if metrics is not None:
+        metrics.stage(stage)
+    yield
+    if metrics is not None:
+        metrics.end_stage()
+    summary[f'{stage}_s'] = round(time.perf_counter() - start, 1)
+
+
+# metrics_folder: folder of the metrics of the run, None for no metrics
+def run_region(region_name, region_shape, osm_store, metrics_folder=None):
+    summary = {'region': region_name, 'status': 'ok'}
+    error = ''
+    start = time.perf_counter()
+    paths = set_outpaths(region_name)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s [%(levelname)s] {region_name}: %(message)s",
+        handlers=[logging.FileHandler(os.path.join(worksp, f"run_log_{region_name}_{now.strftime('%y_%m_%d_%H%M%S')}.txt"),
+                                      mode='w', encoding='utf-8')],
+        force=True
+    )
+    metrics = run_metrics.RunMetrics(metrics_folder, region_name, prometheus=metrics_prometheus,
+                                     live=progress_interval is not None, interval=progress_interval or 60) \
+        if metrics_folder else None
+    try:
+        buffer_shape = region_shape.buffer(umkreis)
+        gpd.GeoDataFrame({region_field: [region_name]}, geometry=[buffer_shape], crs=crs).to_file(paths['buffer_out'], driver="GPKG")
+
+        # --- script 01 ---
+        with timed(summary, 'roads', metrics):
+            osm_extract.read_region(osm_store, region_shape.bounds, crs).to_file(paths['highways_out'], driver="GPKG")
+
+        with timed(summary, 'road_points', metrics):
+            highways = gpd.read_file(paths['highways_out']).to_crs(crs)
+            buffer = gpd.GeoDataFrame(geometry=[buffer_shape], crs=crs)
+            points = road_points.road_points(highways, buffer, grid_space, extent=region_shape.bounds,
+                                             align=shared_od_store)
+            if grid_mode == 'adaptive':
+                ew_xy, ew_values = population.census_population(zensus, buffer_shape, crs, ew_field, zensus_geomtype)
+                points = road_points.adaptive_road_points(highways, buffer, ew_xy, ew_values, adaptive_min_space,
+                                                          adaptive_max_space, adaptive_budget or len(points),
+                                                          extent=region_shape.bounds, align=shared_od_store)
+            points.to_file(paths['points_out'], driver="GPKG")
+            summary['road_points'] = len(points)
+
+        with timed(summary, 'population', metrics):
+            points[f'{ew_field}_sum'] = population_sum(points, buffer_shape)
+            points['EW_2'] = points[f'{ew_field}_sum'].where(points[f'{ew_field}_sum'] >= 1, 0)
+            points.to_file(paths['points_out_2'], driver="GPKG")
+
+        # --- script 02 ---
+        with timed(summary, 'sample', metrics):
+            if reuse_selection and os.path.exists(paths['extract_file']):
+                sample = gpd.read_file(paths['extract_file'])
+            elif shared_od_store:
+                sample = points[od_store.location_sample(od_store.global_ids(population.point_xy(points)), pct)]
+                sample = sample[~sample.geometry.to_wkb().duplicated()].reset_index(drop=True)
+                sample.to_file(paths['extract_file'], driver="GPKG")
+            else:
+                rng = np.random.default_rng(sample_seed)
+                keep = np.sort(rng.choice(len(points), size=int(round(len(points) * pct / 100)), replace=False))
+                sample = points.iloc[keep]
+                sample = sample[~sample.geometry.to_wkb().duplicated()].reset_index(drop=True)
+                sample.to_file(paths['extract_file'], driver="GPKG")
+
+        with timed(summary, 'sample_population', metrics):
+            sample[f'{ew_field}_sum_2'] = population_sum(sample, buffer_shape)
+            sample['EW_10'] = sample[f'{ew_field}_sum_2'].where(sample[f'{ew_field}_sum_2'] >= 1, 0)
+            sample.to_file(paths['destins_10perc_out'], driver="GPKG")
+            destinations = sample[sample['EW_10'] >= 5]
+            destinations.to_file(paths['destins_out'], driver="GPKG")
+            summary['origins'] = len(sample)
+            summary['destinations'] = len(destinations)
+
+        with timed(summary, 'matrix', metrics):
+            if matrix_format == 'arrow':
+                writer = matrix_store.ArrowMatrixWriter(paths['matrix_store_folder'], region_name)
+            else:
+                writer = matrix_store.CsvMatrixWriter(paths['matrix_folder'], region_name, grid_space)
+            if matrix_engine == 'ors':
+                # regions reuse the pairs of the regions finished before and of the regions running at the same time
+                shared_store = od_store.OdStore(os.path.join(worksp, 'output', 'od_store', ors_profile)) if shared_od_store else None
+                snap_cache = os.path.join(worksp, 'output', 'snap_cache', f'{ors_profile}_{ors_snap_radius}m.csv') if ors_precheck else None
+                err = ors_matrix.run_matrix(paths['destins_10perc_out'], paths['destins_out'], writer, ors_url,
+                                            profile=ors_profile, max_routes=ors_max_routes,
+                                            concurrency=ors_concurrency, request_slots=request_slots,
+                                            shared_store=shared_store, snap_cache=snap_cache, snap_radius=ors_snap_radius,
+                                            routability_report=os.path.join(paths['output_folder'], f'routability_{region_name}.csv'),
+                                            metrics=metrics)
+            else:
+                cores = local_processes or os.cpu_count()
+                err = local_routing.run_matrix(paths['highways_out'], paths['destins_10perc_out'], paths['destins_out'],
+                                               writer, processes=max(1, cores // region_processes), metrics=metrics)
+            summary['failed_origins'] = len(err)
+            if err:
+                sample[sample['id'].isin(err)].to_file(paths['err_out'], driver="GPKG")
+
+        # --- script 03, steps 1-5 ---
+        if combine_regions:
+            with timed(summary, 'centrality', metrics):
+                sweep = impedance.region_sweep(paths['output_folder'], region_name, [impedance.powerexp_paper],
+                                               matrix_format=matrix_format, grid_space=grid_space, pct=pct)
+                sweep = sweep.set_index('FROM_ID')
+                centrality = impedance.centrality_indices(sample, sweep['exp_h_w'], sweep['exp_km_w'],
+                                                          gpd.GeoSeries([region_shape], crs=crs), region_name)
+                centrality['gid'] = od_store.global_ids(population.point_xy(centrality))
+                centrality.to_file(paths['centrality_out'], driver="GPKG")
+    except Exception as e:
+        # one failing region does not stop the others
+        logging.error(traceback.format_exc())
+        summary['status'] = 'failed'
+        error = repr(e)
+    if metrics is not None:
+        metrics.close()
+    summary['total_s'] = round(time.perf_counter() - start, 1)
+    summary['error'] = error
+    logging.info(f"Finished: {summary}")
+    return summary
+
+
+# --- MAIN ---
+if __name__ == '__main__':
+    print("Start:", now.strftime("%H:%M:%S"))
+    municip = gpd.read_file(municip_path).to_crs(crs)
+    regions = municip.dissolve(by=region_field)
+
+    # roads of the extract are stored once for all regions
+    print(datetime.now(), 'Store roads of local OSM extract...')
+    osm_store = osm_extract.build_store(osm_extract_path)
+
+    metrics_folder = os.path.join(worksp, 'output', 'metrics', now.strftime('%y_%m_%d_%H%M%S')) if write_metrics else None
+    summaries = []
+    slots = multiprocessing.Semaphore(ors_max_requests)
+    with ProcessPoolExecutor(region_processes, initializer=init_worker, initargs=(slots,)) as pool:
+        futures = {pool.submit(run_region, region_name, region.geometry, osm_store, metrics_folder): region_name
+                   for region_name, region in regions.iterrows()}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as e:
+                # the worker process itself died (e.g. out of memory)
+                summary = {'region': futures[future], 'status': 'crashed', 'error': repr(e)}
+            summaries.append(summary)
+            print(datetime.now(), f"{summary['region']}: {summary['status']} {summary.get('total_s', '')}")
+
+    if matrix_engine == 'ors' and shared_od_store:
+        # one file instead of the part files of all regions
+        od_store.OdStore(os.path.join(worksp, 'output', 'od_store', ors_profile)).compact()
+
+    if combine_regions:
+        # all regions in one layer, points of overlapping regions with the maximum centrality
+        print(datetime.now(), 'Combine regions...')
+        centralities = [gpd.read_file(set_outpaths(s['region'])['centrality_out']) for s in summaries if s['status'] == 'ok']
+        if centralities:
+            combined = impedance.combine_max(centralities)
+            combined.to_file(os.path.join(worksp, 'output', f"centrality_{count_nearest_destinations}_max_{now.strftime('%y_%m_%d')}.gpkg"),
+                             driver="GPKG")
+            print(datetime.now(), f"{len(combined)} points, {int((combined['n_regions'] > 1).sum())} in more than one region")
+
+    summary = pd.DataFrame(summaries).sort_values('region')
+    summary.to_csv(os.path.join(worksp, 'output', f"run_summary_{now.strftime('%y_%m_%d')}.csv"), index=False)
+    print(summary.to_string(index=False))
+    if write_metrics:
+        print(run_metrics.report_text([metrics_folder]))
+        print(f"Metrics: {metrics_folder}")
+
+    end = datetime.now()
+    print("Ende:", end.strftime("%H:%M:%S"))
@@ -1,4 +1,4 @@
-import os, sys, glob
+import os, sys, glob, time
 from datetime import datetime
 from PyQt5.QtCore import QVariant
 from qgis.core import *
@@ -18,9 +18,33 @@ grid_space = 1000
 ew_field = 'Einwohner'
 region_field = "region"
 zensus_geomtype = "Point"  # 'Point', 'Polygon' or 'Raster'
+grid_engine = 'qgis'  # 'qgis': processing chain creategrid ... deletecolumn, 'geopandas': vectorised snapping of the grid to the roads (road_points.py)
+global_grid = False  # grid_engine = 'geopandas' only: align the grid of all regions to one lattice, so neighbouring regions share road points in overlapping buffers (needed for the shared OD store in script 02)
+grid_mode = 'uniform'  # grid_engine = 'geopandas' only: 'uniform' grid with grid_space, 'adaptive' quadtree cells refined where the census population is dense (road_points.py), the points get their cell side in `cell_m`
+adaptive_min_space = 250  # smallest cell of the adaptive grid in m
+adaptive_max_space = 4000  # largest cell in m, min space times a power of two
+adaptive_budget = None  # maximum number of road points per region with the adaptive grid, None: as many as the uniform grid with grid_space
+population_engine = 'qgis'  # 'qgis': Voronoi polygons + joinbylocationsummary, 'kdtree': population of each point (or raster cell) summed on its nearest road point (population.py)
+osm_extract_path = None  # path of a local OSM extract (.osm.pbf or .osm, e.g. from Geofabrik) read once instead of one Overpass download per region (osm_extract.py), None downloads
+use_cache = False  # reuse outputs of stages whose inputs and parameters did not change, also from runs on other days (stage_cache.py)
+cache_max_gb = 100  # size limit of output/cache, least recently used entries are removed first
+write_metrics = True  # duration and peak memory of every stage per region as JSON lines in output/metrics/{date_time}/ (run_metrics.py)
 
 # also adjust file paths below
 
+# helper modules are placed next to the scripts in the code folder
+sys.path.append(os.path.join(worksp, 'code'))
+if grid_engine == 'geopandas':
+    import road_points
+if population_engine == 'kdtree' or grid_mode == 'adaptive':
+    import population
+if osm_extract_path:
+    import osm_extract
+if use_cache:
+    import stage_cache
+if write_metrics:
+    import run_metrics
+
 # --- FOLDER SETUP ---
 required_folders = [
     'input/OSM',
@@ -61,7 +85,8 @@ def set_outpaths(region_name):
     points_out = os.path.join(worksp, f'output/osmpoints_{grid_space}mgrid_{region_name}.gpkg')
     points_ew_out = os.path.join(worksp, f'output/ew_points_{region_name}.gpkg')
     points_out_2 = os.path.join(worksp, f'output/osmpoints_mitEWsum_{grid_space}mgrid_{region_name}.gpkg')
-    return output_folder, matrix_folder, buffer_out, points_out, points_ew_out, points_out_2
+    highways_out = os.path.join(worksp, f'output/highways_{region_name}.gpkg')  # filtered road network, also used for offline routing in script 02
+    return output_folder, matrix_folder, buffer_out, points_out, points_ew_out, points_out_2, highways_out
 
 
 # function to run for each region to get their bounding box to only extract OSM data for this 
@@ -84,90 +109,146 @@ def run_with_retry(alg, params, retries=5, backoff=2):
             print(f"Overpass timeout, retrying in {sleep}s...")
             time.sleep(sleep)
 
+if use_cache:
+    cache = stage_cache.StageCache(os.path.join(worksp, 'output', 'cache'))
+if write_metrics:
+    metrics_folder = os.path.join(worksp, 'output', 'metrics', now.strftime('%y_%m_%d_%H%M%S'))
+
+# filtered roads of the local extract, stored once in a GeoPackage with spatial index for all regions
+if osm_extract_path:
+    print(datetime.now(), 'Store roads of local OSM extract...')
+    osm_store = osm_extract.build_store(osm_extract_path)
+
 # --- MAIN LOOP ---
 for region_name, region in regions.iterrows():
     print("\n--- Region:", region_name, "---")
     
     # get paths, buffer and bbox for this region
-    output_folder, matrix_folder, buffer_out, points_out, points_ew_out, points_out_2 = set_outpaths(region_name)
+    output_folder, matrix_folder, buffer_out, points_out, points_ew_out, points_out_2, highways_out = set_outpaths(region_name)
+    if write_metrics:
+        metrics = run_metrics.RunMetrics(metrics_folder, region_name, live=False)
+        metrics.stage('roads')
 	
     buffer.loc[[region_name]].to_file(buffer_out, driver="GPKG")
     bbox = get_bbox(region)
     
     
-    print(datetime.now(), 'Download OSM Data...')
-    
-    # send query to overpass API to get road data
-    alg_params = {
-        'EXTENT': bbox,
-        'KEY': 'highway',
-        'SERVER': 'https://lz4.overpass-api.de/api/interpreter',
-        'TIMEOUT': 600,  # 10 minutes
-        'VALUE': ''
-    }
-    query = processing.run('quickosm:buildqueryextent', alg_params)
-    osm_path = os.path.join(worksp, f'input/OSM/{region_name}_roh.osm')
-    file = run_with_retry("native:filedownloader", {'URL': query['OUTPUT_URL'], 'OUTPUT': osm_path})
-    if file is None:
-        print(f"Skipping {region_name}: could not download.")
-        continue  # skip to next region
+    if osm_extract_path:
+        # roads of the region from the store of the local extract (same layer as the filtered download)
+        print(datetime.now(), 'Read roads from local OSM extract...')
+        osm_extract.read_region(osm_store, region.geometry.bounds, crs).to_file(highways_out, driver="GPKG")
+        highways = {'OUTPUT': highways_out}
     else:
-        print(f"Downloaded region {region_name}.")
+        print(datetime.now(), 'Download OSM Data...')
+    
+        # send query to overpass API to get road data
+        alg_params = {
+            'EXTENT': bbox,
+            'KEY': 'highway',
+            'SERVER': 'https://lz4.overpass-api.de/api/interpreter',
+            'TIMEOUT': 600,  # 10 minutes
+            'VALUE': ''
+        }
+        query = processing.run('quickosm:buildqueryextent', alg_params)
+        osm_path = os.path.join(worksp, f'input/OSM/{region_name}_roh.osm')
+        file = run_with_retry("native:filedownloader", {'URL': query['OUTPUT_URL'], 'OUTPUT': osm_path})
+        if file is None:
+            print(f"Skipping {region_name}: could not download.")
+            continue  # skip to next region
+        else:
+            print(f"Downloaded region {region_name}.")
 		
-    vlayer = iface.addVectorLayer(file['OUTPUT'] + '|layername=lines', "highway_OSM", "ogr")
-    vlayer.removeSelection()
-
-    # select only specified road types 
-    print(datetime.now(), 'Filter roads...')
-    processing.run("qgis:selectbyexpression", {
-        'INPUT': vlayer,
-        'EXPRESSION': ''' "highway" IN (
-            'motorway','trunk','primary','secondary','tertiary','unclassified',
-            'residential','motorway_link','trunk_link','primary_link','secondary_link',
-            'tertiary_link','living_street','service') AND "other_tags" NOT LIKE '%"access"=>"private"%' ''',
-        'METHOD': 0
-    })
-
-    highways = processing.run("native:saveselectedfeatures", {'INPUT': vlayer, 'OUTPUT': 'TEMPORARY_OUTPUT'})
+        vlayer = iface.addVectorLayer(file['OUTPUT'] + '|layername=lines', "highway_OSM", "ogr")
+        vlayer.removeSelection()
+
+        # select only specified road types 
+        print(datetime.now(), 'Filter roads...')
+        processing.run("qgis:selectbyexpression", {
+            'INPUT': vlayer,
+            'EXPRESSION': ''' "highway" IN (
+                'motorway','trunk','primary','secondary','tertiary','unclassified',
+                'residential','motorway_link','trunk_link','primary_link','secondary_link',
+                'tertiary_link','living_street','service') AND "other_tags" NOT LIKE '%"access"=>"private"%' ''',
+            'METHOD': 0
+        })
+
+        highways = processing.run("native:saveselectedfeatures", {'INPUT': vlayer, 'OUTPUT': highways_out})
 
     # Create grid with specified width
     print(datetime.now(), 'Raster points for road network...')
-    grid = processing.run("native:creategrid", {
-        'TYPE': 4, 'EXTENT': bbox, 'HSPACING': grid_space, 'VSPACING': grid_space,
-        'HOVERLAY': 0, 'VOVERLAY': 0, 'CRS': QgsCoordinateReferenceSystem(crs), 'OUTPUT': 'TEMPORARY_OUTPUT'
-    })
+    if write_metrics:
+        metrics.stage('road_points')
+    if use_cache:
+        buffer_wkb = buffer.loc[region_name].geometry.wkb_hex
+        grid_key = cache.key('grid', {'grid_space': grid_space, 'crs': crs, 'extent': region.geometry.bounds,
+                                      'buffer': buffer_wkb, 'grid_engine': grid_engine, 'global_grid': global_grid,
+                                      'grid_mode': grid_mode, 'adaptive': (adaptive_min_space, adaptive_max_space, adaptive_budget)},
+                             [highways_out] + ([zensus] if grid_mode == 'adaptive' else []))
+    if use_cache and cache.restore('grid', grid_key, [points_out]):
+        print("> Road points restored from cache.")
+    elif grid_engine == 'geopandas':
+        highways_gdf = gpd.read_file(highways_out).to_crs(crs)
+        points = road_points.road_points(highways_gdf, buffer.loc[[region_name]], grid_space, extent=region.geometry.bounds,
+                                         align=global_grid)
+        if grid_mode == 'adaptive':
+            # fine cells where many people live, coarse cells in sparse areas, at most as many points as the uniform grid
+            ew_xy, ew_values = population.census_population(zensus, buffer.loc[region_name].geometry, crs, ew_field, zensus_geomtype)
+            points = road_points.adaptive_road_points(highways_gdf, buffer.loc[[region_name]], ew_xy, ew_values,
+                                                      adaptive_min_space, adaptive_max_space, adaptive_budget or len(points),
+                                                      extent=region.geometry.bounds, align=global_grid)
+            print(f"> {len(points)} road points, cell sizes: {points['cell_m'].value_counts().sort_index().to_dict()}")
+        points.to_file(points_out, driver="GPKG")
+    else:
+        grid = processing.run("native:creategrid", {
+            'TYPE': 4, 'EXTENT': bbox, 'HSPACING': grid_space, 'VSPACING': grid_space,
+            'HOVERLAY': 0, 'VOVERLAY': 0, 'CRS': QgsCoordinateReferenceSystem(crs), 'OUTPUT': 'TEMPORARY_OUTPUT'
+        })
     
-    # Get centroid of each grid cell
-    points = processing.run("native:centroids", {'INPUT': grid['OUTPUT'], 'ALL_PARTS': False, 'OUTPUT': 'TEMPORARY_OUTPUT'})
-    join = processing.run("native:joinbynearest", {
-        'INPUT': points['OUTPUT'], 'INPUT_2': highways['OUTPUT'],
-        'FIELDS_TO_COPY': [], 'DISCARD_NONMATCHING': False, 'PREFIX': '',
-        'NEIGHBORS': 1, 'MAX_DISTANCE': grid_space / 2, 'OUTPUT': 'TEMPORARY_OUTPUT'
-    })
-
-    # Move centroid to closest point on the road network
-    pointsfromhighways = processing.run("native:geometrybyexpression", {
-        'INPUT': join['OUTPUT'], 'OUTPUT_GEOMETRY': 2, 'WITH_Z': False, 'WITH_M': False,
-        'EXPRESSION': 'make_point("nearest_x", "nearest_y")', 'OUTPUT': 'TEMPORARY_OUTPUT'
-    })
+        # Get centroid of each grid cell
+        points = processing.run("native:centroids", {'INPUT': grid['OUTPUT'], 'ALL_PARTS': False, 'OUTPUT': 'TEMPORARY_OUTPUT'})
+        join = processing.run("native:joinbynearest", {
+            'INPUT': points['OUTPUT'], 'INPUT_2': highways['OUTPUT'],
+            'FIELDS_TO_COPY': [], 'DISCARD_NONMATCHING': False, 'PREFIX': '',
+            'NEIGHBORS': 1, 'MAX_DISTANCE': grid_space / 2, 'OUTPUT': 'TEMPORARY_OUTPUT'
+        })
+
+        # Move centroid to closest point on the road network
+        pointsfromhighways = processing.run("native:geometrybyexpression", {
+            'INPUT': join['OUTPUT'], 'OUTPUT_GEOMETRY': 2, 'WITH_Z': False, 'WITH_M': False,
+            'EXPRESSION': 'make_point("nearest_x", "nearest_y")', 'OUTPUT': 'TEMPORARY_OUTPUT'
+        })
     
-    # Clip points to region buffer
-    c = processing.run("native:clip", {'INPUT': pointsfromhighways['OUTPUT'], 'OVERLAY': buffer_out, 'OUTPUT': 'TEMPORARY_OUTPUT'})
+        # Clip points to region buffer
+        c = processing.run("native:clip", {'INPUT': pointsfromhighways['OUTPUT'], 'OVERLAY': buffer_out, 'OUTPUT': 'TEMPORARY_OUTPUT'})
     
-    # Clean geometries
-    points = processing.run("native:multiparttosingleparts", {'INPUT': c['OUTPUT'], 'OUTPUT': 'TEMPORARY_OUTPUT'})
-    points_single = processing.run("native:deleteduplicategeometries", {'INPUT': points['OUTPUT'], 'OUTPUT': 'TEMPORARY_OUTPUT'})
-    processing.run("native:deletecolumn", {
-        'INPUT': points_single['OUTPUT'],
-        'COLUMN': ['left','top','right','bottom','osm_id','name','highway','waterway','aerialway',
-                   'barrier','man_made','railway','z_order','other_tags','n','distance',
-                   'feature_x','feature_y','nearest_x','nearest_y'],
-        'OUTPUT': points_out
-    })
+        # Clean geometries
+        points = processing.run("native:multiparttosingleparts", {'INPUT': c['OUTPUT'], 'OUTPUT': 'TEMPORARY_OUTPUT'})
+        points_single = processing.run("native:deleteduplicategeometries", {'INPUT': points['OUTPUT'], 'OUTPUT': 'TEMPORARY_OUTPUT'})
+        processing.run("native:deletecolumn", {
+            'INPUT': points_single['OUTPUT'],
+            'COLUMN': ['left','top','right','bottom','osm_id','name','highway','waterway','aerialway',
+                       'barrier','man_made','railway','z_order','other_tags','n','distance',
+                       'feature_x','feature_y','nearest_x','nearest_y'],
+            'OUTPUT': points_out
+        })
+
+    if use_cache:
+        cache.store('grid', grid_key, [points_out])
 
     # Load population data based on geometry type
     print(datetime.now(), 'Add population data to points...')
-    if zensus_geomtype == "Polygon":
+    if write_metrics:
+        metrics.stage('population')
+    population_outputs = [points_out_2] if zensus_geomtype == "Raster" and population_engine == 'kdtree' else [points_ew_out, points_out_2]
+    population_cached = False
+    if use_cache:
+        population_key = cache.key('population', {'ew_field': ew_field, 'zensus_geomtype': zensus_geomtype, 'crs': crs,
+                                                  'buffer': buffer_wkb, 'population_engine': population_engine},
+                                   [points_out, zensus])
+        population_cached = cache.restore('population', population_key, population_outputs)
+    if population_cached:
+        print("> Population of road points restored from cache.")
+    elif zensus_geomtype == "Polygon":
         print("> Zensus as polygons, getting centroids...")
         grid_layer = iface.addVectorLayer(zensus, 'Zensus', 'ogr')
         grid_layer = processing.run("native:reprojectlayer", {
@@ -176,6 +257,8 @@ for region_name, region in regions.iterrows():
 
         grid_clip = processing.run("native:clip", {'INPUT': grid_layer, 'OVERLAY': buffer_out, 'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
         ew_points = processing.run("native:centroids", {'INPUT': grid_clip, 'ALL_PARTS': False, 'OUTPUT': points_ew_out})
+    elif zensus_geomtype == "Raster" and population_engine == 'kdtree':
+        print("> Zensus as raster layer, cells within the buffer are summed on the road points directly.")
     elif zensus_geomtype == "Raster":
         print("> Zensus as raster layer, extracting point grid with spacing 100m...")
         raster_layer = iface.addRasterLayer(zensus,"Zensus")
@@ -194,26 +277,55 @@ for region_name, region in regions.iterrows():
         break
     
     # Create voronoi polygons for road network points and get population sum within 
+    # (or sum the population on the nearest road point, which gives the same result without polygons)
     print(datetime.now(), 'Einwohnerdaten auf Straßenpunkte summieren...')
-    voronoi = processing.run("qgis:voronoipolygons", {'INPUT': points_out, 'BUFFER': 2, 'OUTPUT': 'TEMPORARY_OUTPUT'})
-    voronoi_einw = processing.runAndLoadResults("qgis:joinbylocationsummary", {
-        'INPUT': voronoi['OUTPUT'], 'JOIN': points_ew_out, 'PREDICATE': [1],
-        'JOIN_FIELDS': [], 'SUMMARIES': [5], 'DISCARD_NONMATCHING': False, 'OUTPUT': 'TEMPORARY_OUTPUT'
-    })
+    if population_cached:
+        pass
+    elif population_engine == 'kdtree':
+        road_points_gdf = gpd.read_file(points_out)
+        if zensus_geomtype == "Raster":
+            road_points_gdf[f'{ew_field}_sum'] = population.raster_population_sum(population.point_xy(road_points_gdf), zensus,
+                                                                                  buffer.loc[region_name].geometry, crs)
+        else:
+            ew_points_gdf = gpd.read_file(points_ew_out).to_crs(crs)
+            # only census points within the buffer, the neighbouring regions' points would pile up on the outermost road points
+            ew_points_gdf = ew_points_gdf[ew_points_gdf.intersects(buffer.loc[region_name].geometry)]
+            road_points_gdf[f'{ew_field}_sum'] = population.population_sum(population.point_xy(road_points_gdf),
+                                                                           population.point_xy(ew_points_gdf),
+                                                                           ew_points_gdf[ew_field])
+        # set points with less than 1 inhabitant to 0
+        road_points_gdf['EW_2'] = road_points_gdf[f'{ew_field}_sum'].where(road_points_gdf[f'{ew_field}_sum'] >= 1, 0)
+        road_points_gdf.to_file(points_out_2, driver="GPKG")
+    else:
+        voronoi = processing.run("qgis:voronoipolygons", {'INPUT': points_out, 'BUFFER': 2, 'OUTPUT': 'TEMPORARY_OUTPUT'})
+        voronoi_einw = processing.runAndLoadResults("qgis:joinbylocationsummary", {
+            'INPUT': voronoi['OUTPUT'], 'JOIN': points_ew_out, 'PREDICATE': [1],
+            'JOIN_FIELDS': [], 'SUMMARIES': [5], 'DISCARD_NONMATCHING': False, 'OUTPUT': 'TEMPORARY_OUTPUT'
+        })
     
-    # join summary values to points
-    origin_einw = processing.runAndLoadResults("native:joinattributestable", {
-        'INPUT': points_out, 'FIELD': 'id', 'INPUT_2': voronoi_einw['OUTPUT'],
-        'FIELD_2': 'id', 'FIELDS_TO_COPY': [f'{ew_field}_sum'], 'METHOD': 1,
-        'DISCARD_NONMATCHING': False, 'PREFIX': '', 'OUTPUT': 'TEMPORARY_OUTPUT'
-    })
+        # join summary values to points
+        origin_einw = processing.runAndLoadResults("native:joinattributestable", {
+            'INPUT': points_out, 'FIELD': 'id', 'INPUT_2': voronoi_einw['OUTPUT'],
+            'FIELD_2': 'id', 'FIELDS_TO_COPY': [f'{ew_field}_sum'], 'METHOD': 1,
+            'DISCARD_NONMATCHING': False, 'PREFIX': '', 'OUTPUT': 'TEMPORARY_OUTPUT'
+        })
     
-    # set points with less than 1 inhabitant to 0
-    processing.runAndLoadResults("native:fieldcalculator", {
-        'INPUT': origin_einw['OUTPUT'], 'FIELD_NAME': 'EW_2',
-        'FIELD_TYPE': 0, 'FIELD_LENGTH': 10, 'FIELD_PRECISION': 3,
-        'FORMULA': f' if("{ew_field}_sum" < 1,0, "{ew_field}_sum" )', 'OUTPUT': points_out_2
-    })
+        # set points with less than 1 inhabitant to 0
+        processing.runAndLoadResults("native:fieldcalculator", {
+            'INPUT': origin_einw['OUTPUT'], 'FIELD_NAME': 'EW_2',
+            'FIELD_TYPE': 0, 'FIELD_LENGTH': 10, 'FIELD_PRECISION': 3,
+            'FORMULA': f' if("{ew_field}_sum" < 1,0, "{ew_field}_sum" )', 'OUTPUT': points_out_2
+        })
+
+    if use_cache:
+        cache.store('population', population_key, population_outputs)
+    if write_metrics:
+        metrics.close()
+
+if use_cache:
+    cache.evict(cache_max_gb * 1e9)
+if write_metrics:
+    print(run_metrics.report_text([metrics_folder]))
 
 end = datetime.now()
 print("Ende:", end.strftime("%H:%M:%S"))
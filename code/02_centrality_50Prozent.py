@@ -1,6 +1,6 @@
 # Plugin ORS tools needs to be installed
 
-import sys, os
+import sys, os, time
 import glob
 from PyQt5.QtCore import QVariant
 import processing
@@ -26,6 +26,58 @@ ew_field = 'Einwohner'
 region_field = "region"
 get_matrix = True
 reuse_selection = True  # Set True to reuse previous random selection, False to generate new
+population_engine = 'qgis'  # 'qgis': Voronoi polygons + joinbylocationsummary, 'kdtree': population summed on the nearest road point (population.py), same as in script 01
+zensus_raster = None  # population_engine = 'kdtree' only: path of the population raster if zensus_geomtype = 'Raster' in script 01, read directly instead of ew_points_{region}.gpkg
+matrix_engine = 'qgis'  # 'qgis': one ORS Tools request per origin, 'ors': batched requests to the ORS matrix endpoint (ors_matrix.py), 'local': offline routing on the OSM highways from script 01 (local_routing.py)
+
+# ORS settings for matrix_engine = 'ors'
+ors_url = 'http://localhost:8080/ors'  # local ORS instance
+ors_profile = 'driving-car'
+ors_max_routes = 2500  # matrix.maximum_routes in the ORS config
+ors_concurrency = 4  # number of parallel matrix requests
+ors_precheck = False  # snap all points once and leave out points that can not be routed (no road within ors_snap_radius, isolated part of the graph) before any matrix request (routability.py), cached in output/snap_cache
+ors_snap_radius = 350  # m, search radius for snapping the points to the roads of the profile
+prune_epsilon = None  # e.g. 0.001 or {'h': 0.001, 'km': 0.01}: only route destinations whose decay weight can exceed this value in both modes (pruning.py), None routes all; with the paper's driving parameters this prunes nothing
+prune_max_speed = 130  # km/h, upper bound of the car speed used for pruning
+cluster_theta = None  # e.g. 0.5: route distant destinations via population-weighted cluster representatives (destination_clusters.py), use with pct = 100
+od_store_folder = None  # e.g. os.path.join(worksp, 'output', 'od_store', ors_profile): look up pairs routed for other regions and add new ones (od_store.py), use with global_grid = True in script 01
+
+# output for matrix_engine 'ors' and 'local': 'csv' for one file per origin in Matrizen/, 'arrow' for one columnar store per region in matrix/ (matrix_store.py)
+matrix_format = 'csv'
+
+# settings for matrix_engine = 'local'
+local_processes = None  # worker processes for routing, None = all cores (set to 1 if processes can not be started from the QGIS console)
+
+# reuse outputs of stages whose inputs and parameters did not change, also from runs on other days (stage_cache.py, same cache as script 01)
+use_cache = False
+cache_max_gb = 100  # size limit of output/cache, least recently used entries (mostly old matrices) are removed first
+
+# metrics of the run (run_metrics.py): stage durations and peak memory, matrix requests, progress with ETA per region as JSON lines in output/metrics/{date_time}/, report of the slowest origins at the end of the log
+write_metrics = True
+metrics_prometheus = False  # also write the totals as Prometheus text (metrics_{region}.prom)
+progress_interval = 60  # seconds between progress summaries in the log, None: no summaries
+
+
+# helper modules are placed next to the scripts in the code folder
+sys.path.append(os.path.join(worksp, 'code'))
+if matrix_engine != 'qgis':
+    import matrix_store
+if matrix_engine == 'ors':
+    import ors_matrix
+if od_store_folder:
+    import od_store
+if prune_epsilon:
+    import impedance  # decay parameters of script 03
+    import pruning
+    pruning.mode_epsilon(prune_epsilon)  # refuse an epsilon that leaves a mode unbounded before any routing
+if matrix_engine == 'local':
+    import local_routing
+if population_engine == 'kdtree':
+    import population
+if use_cache:
+    import stage_cache
+if write_metrics:
+    import run_metrics
 
 
 # --- FILE INPUTS ---
@@ -48,6 +100,11 @@ logging.basicConfig(
 
 logging.info("Start: " + now.strftime("%y/%m/%d/%H:%M:%S"))
 
+if use_cache:
+    cache = stage_cache.StageCache(os.path.join(worksp, 'output', 'cache'))
+if write_metrics:
+    metrics_folder = os.path.join(worksp, 'output', 'metrics', now.strftime('%y_%m_%d_%H%M%S'))
+
 # --- READ AND PREPARE DATA ---
 municip = gpd.read_file(municip_path).to_crs(crs)
 regions = municip.dissolve(by=region_field)
@@ -59,6 +116,7 @@ def set_outpaths(region_name):
     output_folder = os.path.join(worksp, f'output/{region_name}_{count_nearest_destinations}_{date_tag}/')
     matrix_folder = os.path.join(output_folder, 'Matrizen')
     os.makedirs(matrix_folder, exist_ok=True)
+    matrix_store_folder = os.path.join(output_folder, 'matrix')
     
     point_path = os.path.join(worksp, f'output/osmpoints_mitEWsum_{grid_space}mgrid_{region_name}.gpkg')
     region_buffer = os.path.join(worksp, f'output/buffer/buffer_{region_name}.gpkg')
@@ -67,16 +125,21 @@ def set_outpaths(region_name):
     extract_file = os.path.join(output_folder, f'random_extract_{region_name}.gpkg')
     destins_10perc_out = os.path.join(output_folder, f'{region_name}_10perc_ew.gpkg')
     destins_out = os.path.join(output_folder, f'destination_points_{grid_space}mgrid_{region_name}{count_nearest_destinations}.gpkg')
+    highways_path = os.path.join(worksp, f'output/highways_{region_name}.gpkg')
     
-    return output_folder, matrix_folder, point_path, region_buffer, points_ew_out_s1, points_ew_out, extract_file, destins_10perc_out, destins_out
+    return output_folder, matrix_folder, matrix_store_folder, point_path, region_buffer, points_ew_out_s1, points_ew_out, extract_file, destins_10perc_out, destins_out, highways_path
 
     
 # --- MAIN LOOP ---
 for region_name, region in regions.iterrows():
-	logging.info(f"\n--- Region: {region_name} ---")
+    logging.info(f"\n--- Region: {region_name} ---")
 
     ## Get paths for this region:
-    output_folder, matrix_folder, point_path, region_buffer, points_ew_out_s1, points_ew_out, extract_file, destins_10perc_out, destins_out = set_outpaths(region_name)
+    output_folder, matrix_folder, matrix_store_folder, point_path, region_buffer, points_ew_out_s1, points_ew_out, extract_file, destins_10perc_out, destins_out, highways_path = set_outpaths(region_name)
+    if write_metrics:
+        metrics = run_metrics.RunMetrics(metrics_folder, region_name, prometheus=metrics_prometheus,
+                                         live=progress_interval is not None, interval=progress_interval or 60)
+        metrics.stage('load')
 
     logging.info("Load population points...")
     ew_points = iface.addVectorLayer(points_ew_out_s1, f'ew_points_{region_name}', "ogr")
@@ -84,9 +147,16 @@ for region_name, region in regions.iterrows():
 
     ## Extract 50% of points (reduce computation time) 
     logging.info(f"Only keep {pct}% of road network points...")
+    if write_metrics:
+        metrics.stage('sample')
+    if use_cache:
+        sample_key = cache.key('sample', {'pct': pct}, [point_path])
     if reuse_selection and os.path.exists(extract_file):
         logging.info(f"> Reusing previous random selection for {region_name}...")
         extract = iface.addVectorLayer(extract_file, f'random_extract_{region_name}', 'ogr')
+    elif reuse_selection and use_cache and cache.restore('sample', sample_key, [extract_file]):
+        logging.info(f"> Reusing random selection of an earlier run for {region_name} from cache...")
+        extract = iface.addVectorLayer(extract_file, f'random_extract_{region_name}', 'ogr')
     else:
         logging.info(f"> Generating new random selection for {region_name}...")
         extract = processing.run("native:randomextract", {
@@ -98,176 +168,262 @@ for region_name, region in regions.iterrows():
         extract = processing.runAndLoadResults("native:deleteduplicategeometries", {'INPUT': extract['OUTPUT'], 'OUTPUT': 'TEMPORARY_OUTPUT'})
         # Save the random selection for later reuse
         extract = processing.run("native:savefeatures", {'INPUT': extract['OUTPUT'], 'OUTPUT': extract_file})['OUTPUT']
+        if use_cache:
+            cache.store('sample', sample_key, [extract_file])
 
     ## Get population points sum and add to road points for reduced road data points 
     ## (process like in script 01 but with 50% of points)
     logging.info("Add population data to points...")
-    logging.info('> voronoipolygons')
-    voronoi = processing.runAndLoadResults("qgis:voronoipolygons", {'INPUT': extract, 'BUFFER': 2, 'OUTPUT': 'TEMPORARY_OUTPUT'})
-    logging.info('> joinbylocationsummary')
-    voronoi_einw = processing.runAndLoadResults("qgis:joinbylocationsummary", {
-        'INPUT': voronoi['OUTPUT'],
-        'PREDICATE': [1],
-        'JOIN': ew_points['OUTPUT'],
-        'JOIN_FIELDS': [ew_field],
-        'SUMMARIES': [5],
-        'DISCARD_NONMATCHING': False,
-        'OUTPUT': 'TEMPORARY_OUTPUT'
-    })
-    logging.info('> joinattributestable')
-    origin_einw = processing.runAndLoadResults("native:joinattributestable", {
-        'INPUT': extract,
-        'FIELD': 'id',
-        'INPUT_2': voronoi_einw['OUTPUT'],
-        'FIELD_2': 'id',
-        'FIELDS_TO_COPY': [f'{ew_field}_sum_2'],
-        'METHOD': 1,
-        'DISCARD_NONMATCHING': False,
-        'PREFIX': '',
-        'OUTPUT': 'TEMPORARY_OUTPUT'
-    })
-    logging.info('> fieldcalculator')
-    points = processing.runAndLoadResults("native:fieldcalculator", {
-        'INPUT': origin_einw['OUTPUT'],
-        'FIELD_NAME': 'EW_10',
-        'FIELD_TYPE': 0,
-        'FIELD_LENGTH': 10,
-        'FIELD_PRECISION': 3,
-        'FORMULA': f' if("{ew_field}_sum_2" < 1,0, "{ew_field}_sum_2" )',
-        'OUTPUT': destins_10perc_out
-    })
-    region_points = QgsProject.instance().mapLayersByName(region_name + '_10perc_ew')[0]
-    region_points = processing.run("native:fixgeometries", {'INPUT': region_points, 'METHOD': 1, 'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-
-    logging.info("select destination points")
-    destinations_all = processing.runAndLoadResults("native:extractbyexpression", {
-        'INPUT': points['OUTPUT'],
-        'EXPRESSION': ' "EW_10" >= 5',
-        'OUTPUT': destins_out
-    })
+    if write_metrics:
+        metrics.stage('population')
+    population_cached = False
+    if use_cache:
+        population_key = cache.key('population', {'ew_field': ew_field, 'crs': crs, 'population_engine': population_engine},
+                                   [extract_file, zensus_raster or points_ew_out_s1])
+        population_cached = cache.restore('population', population_key, [destins_10perc_out, destins_out])
+    if population_cached:
+        logging.info('> restored from cache')
+        region_points = processing.run("native:fixgeometries", {'INPUT': destins_10perc_out, 'METHOD': 1, 'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
+        destinations_all = {'OUTPUT': destins_out}
+    elif population_engine == 'kdtree':
+        logging.info('> nearest road point')
+        sample = gpd.read_file(extract_file)
+        region_shape = gpd.read_file(region_buffer).to_crs(crs).geometry.iloc[0]
+        if zensus_raster:
+            sample[f'{ew_field}_sum_2'] = population.raster_population_sum(population.point_xy(sample), zensus_raster, region_shape, crs)
+        else:
+            ew_points_gdf = gpd.read_file(points_ew_out_s1).to_crs(crs)
+            ew_points_gdf = ew_points_gdf[ew_points_gdf.intersects(region_shape)]  # only census points within the buffer
+            sample[f'{ew_field}_sum_2'] = population.population_sum(population.point_xy(sample), population.point_xy(ew_points_gdf),
+                                                                    ew_points_gdf[ew_field])
+        sample['EW_10'] = sample[f'{ew_field}_sum_2'].where(sample[f'{ew_field}_sum_2'] >= 1, 0)
+        sample.to_file(destins_10perc_out, driver="GPKG")
+        region_points = processing.run("native:fixgeometries", {'INPUT': destins_10perc_out, 'METHOD': 1, 'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
+
+        logging.info("select destination points")
+        sample[sample['EW_10'] >= 5].to_file(destins_out, driver="GPKG")
+        destinations_all = {'OUTPUT': destins_out}
+    else:
+        logging.info('> voronoipolygons')
+        voronoi = processing.runAndLoadResults("qgis:voronoipolygons", {'INPUT': extract, 'BUFFER': 2, 'OUTPUT': 'TEMPORARY_OUTPUT'})
+        logging.info('> joinbylocationsummary')
+        voronoi_einw = processing.runAndLoadResults("qgis:joinbylocationsummary", {
+            'INPUT': voronoi['OUTPUT'],
+            'PREDICATE': [1],
+            'JOIN': ew_points['OUTPUT'],
+            'JOIN_FIELDS': [ew_field],
+            'SUMMARIES': [5],
+            'DISCARD_NONMATCHING': False,
+            'OUTPUT': 'TEMPORARY_OUTPUT'
+        })
+        logging.info('> joinattributestable')
+        origin_einw = processing.runAndLoadResults("native:joinattributestable", {
+            'INPUT': extract,
+            'FIELD': 'id',
+            'INPUT_2': voronoi_einw['OUTPUT'],
+            'FIELD_2': 'id',
+            'FIELDS_TO_COPY': [f'{ew_field}_sum_2'],
+            'METHOD': 1,
+            'DISCARD_NONMATCHING': False,
+            'PREFIX': '',
+            'OUTPUT': 'TEMPORARY_OUTPUT'
+        })
+        logging.info('> fieldcalculator')
+        points = processing.runAndLoadResults("native:fieldcalculator", {
+            'INPUT': origin_einw['OUTPUT'],
+            'FIELD_NAME': 'EW_10',
+            'FIELD_TYPE': 0,
+            'FIELD_LENGTH': 10,
+            'FIELD_PRECISION': 3,
+            'FORMULA': f' if("{ew_field}_sum_2" < 1,0, "{ew_field}_sum_2" )',
+            'OUTPUT': destins_10perc_out
+        })
+        region_points = QgsProject.instance().mapLayersByName(region_name + '_10perc_ew')[0]
+        region_points = processing.run("native:fixgeometries", {'INPUT': region_points, 'METHOD': 1, 'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
+
+        logging.info("select destination points")
+        destinations_all = processing.runAndLoadResults("native:extractbyexpression", {
+            'INPUT': points['OUTPUT'],
+            'EXPRESSION': ' "EW_10" >= 5',
+            'OUTPUT': destins_out
+        })
     
+    if use_cache:
+        cache.store('population', population_key, [destins_10perc_out, destins_out])
+
     if get_matrix:
         logging.info('Matrix calculation')
-        err = []
-        
-		# for checking single points: (here point that is not accessible by car that does not get a matrix calculated)
-        #point_id_to_run = 8366
-        
-        for point in region_points.getFeatures():
-            point_id = int(point['id'])
+        if write_metrics:
+            metrics.stage('matrix')
+        # matrices of an earlier run with the same points and settings are copied into this folder, all engines
+        # then skip the existing origins
+        matrix_output = matrix_store_folder if matrix_engine != 'qgis' and matrix_format == 'arrow' else matrix_folder
+        if use_cache:
+            matrix_key = cache.key('matrix', {'region': region_name, 'grid_space': grid_space, 'matrix_engine': matrix_engine,
+                                              'ors_profile': ors_profile, 'prune_epsilon': prune_epsilon,
+                                              'prune_max_speed': prune_max_speed, 'cluster_theta': cluster_theta,
+                                              'matrix_format': matrix_format, 'ors_precheck': ors_precheck,
+                                              'ors_snap_radius': ors_snap_radius},
+                                   [destins_10perc_out, destins_out, highways_path if matrix_engine == 'local' else None])
+            if cache.restore('matrix', matrix_key, [matrix_output]):
+                logging.info('> Matrices restored from cache')
+
+        if matrix_engine != 'qgis' and matrix_format == 'arrow':
+            writer = matrix_store.ArrowMatrixWriter(matrix_store_folder, region_name)
+        elif matrix_engine != 'qgis':
+            writer = matrix_store.CsvMatrixWriter(matrix_folder, region_name, grid_space)
+
+        if matrix_engine == 'ors':
+            # batched requests to the ORS matrix endpoint, see ors_matrix.py
+            shared_store = od_store.OdStore(od_store_folder) if od_store_folder else None
+            snap_cache = os.path.join(worksp, 'output', 'snap_cache', f'{ors_profile}_{ors_snap_radius}m.csv') if ors_precheck else None
+            err = ors_matrix.run_matrix(destins_10perc_out, destins_out, writer, ors_url, profile=ors_profile,
+                                        max_routes=ors_max_routes, concurrency=ors_concurrency,
+                                        prune_epsilon=prune_epsilon,
+                                        variant=impedance.powerexp_paper if prune_epsilon else None,
+                                        max_speed=prune_max_speed,
+                                        prune_report=os.path.join(output_folder, f'pruning_error_{region_name}.csv'),
+                                        cluster_theta=cluster_theta, shared_store=shared_store,
+                                        snap_cache=snap_cache, snap_radius=ors_snap_radius,
+                                        routability_report=os.path.join(output_folder, f'routability_{region_name}.csv'),
+                                        metrics=metrics if write_metrics else None)
+        elif matrix_engine == 'local':
+            # offline routing on the road graph of the filtered OSM highways, see local_routing.py
+            err = local_routing.run_matrix(highways_path, destins_10perc_out, destins_out, writer, processes=local_processes,
+                                           metrics=metrics if write_metrics else None)
+        else:
+            err = []
+
+            # for checking single points: (here point that is not accessible by car that does not get a matrix calculated)
+            #point_id_to_run = 8366
+
+            n_points = region_points.featureCount()
+            for i, point in enumerate(region_points.getFeatures()):
+                point_id = int(point['id'])
             
-            #if point_id != point_id_to_run:
-            #        continue
+                #if point_id != point_id_to_run:
+                #        continue
             
-            logging.info(point_id)
+                logging.info(point_id)
 
-            matrix_out = os.path.join(matrix_folder, f'matrix_{region_name}_{grid_space}mgrid_{point_id}.csv')
+                matrix_out = os.path.join(matrix_folder, f'matrix_{region_name}_{grid_space}mgrid_{point_id}.csv')
             
-            # skip existing files if they are not empty (minimum size)
-            if (os.path.isfile(matrix_out)) and (os.stat(matrix_out).st_size > 100):
-                logging.info(f"Matrix for point {point_id} already exists. Skipping...")
-                continue
+                # skip existing files if they are not empty (minimum size)
+                if (os.path.isfile(matrix_out)) and (os.stat(matrix_out).st_size > 100):
+                    logging.info(f"Matrix for point {point_id} already exists. Skipping...")
+                    continue
             
-            # Select this specific point as origin
-            processing.run("qgis:selectbyattribute", {'INPUT': region_points, 'FIELD': 'id', 'OPERATOR': 0, 'VALUE': point_id, 'METHOD': 0})
-            origin = processing.run("native:saveselectedfeatures", {'INPUT': region_points, 'OUTPUT': 'TEMPORARY_OUTPUT'})
-
-            # --- Error handling: ---
-            # common error: GenericServerError: 500 ({"error":{"code":6020,"message":"Unable to compute a distance/duration matrix: Search exceeds the limit of visited nodes."}
-            # -> journeys through dense city centers are too long and complex 
-            # -> split destination points in two layers 
-            # simple retries always failed on all attempts 
-            # (sometimes the points worked when restarting the script but never with a retry loop directly after fail)
-
-            try:
-                matrix_firsttry = processing.run("ORS Tools:matrix_from_layers", {
-                    'INPUT_PROVIDER': 1,
-                    'INPUT_PROFILE': 0,
-                    'INPUT_START_LAYER': origin['OUTPUT'],
-                    'INPUT_START_FIELD': 'id',
-                    'INPUT_END_LAYER': destinations_all['OUTPUT'],
-                    'INPUT_END_FIELD': 'id',
-                    'OUTPUT': 'TEMPORARY_OUTPUT'
-                })
-                
-                # QGIS sometimes overwrites merged split files again with an empty file from before 
-                # first write Output to temporary file, then save as csv file 
-                processing.run("native:savefeatures", {'INPUT':matrix_firsttry['OUTPUT'],'OUTPUT':matrix_out})
-
-                
-            except Exception as e:
-                logging.info(str(e))
-                logging.info("ORS failed, attempting split-mode...")
-
-                #  SPLIT DESTINATION POINTS INTO 2 SUBSETS
-                dest_layer = QgsVectorLayer(destinations_all['OUTPUT'], "destsplit", "ogr")
-                all_feats = list(dest_layer.getFeatures())
-                mid = len(all_feats) // 2
-                
-                subset1 = QgsVectorLayer("Point?crs="+dest_layer.crs().authid(), "subset1", "memory")
-                pr1 = subset1.dataProvider()
-                pr1.addAttributes(dest_layer.fields())
-                subset1.updateFields()
-
-                subset2 = QgsVectorLayer("Point?crs="+dest_layer.crs().authid(), "subset2", "memory")
-                pr2 = subset2.dataProvider()
-                pr2.addAttributes(dest_layer.fields())
-                subset2.updateFields()
+                point_start = time.perf_counter()
+                split = 0
 
-                # fill both subsets
-                for f in all_feats[:mid]:
-                    pr1.addFeature(f)
-                for f in all_feats[mid:]:
-                    pr2.addFeature(f)
+                # Select this specific point as origin
+                processing.run("qgis:selectbyattribute", {'INPUT': region_points, 'FIELD': 'id', 'OPERATOR': 0, 'VALUE': point_id, 'METHOD': 0})
+                origin = processing.run("native:saveselectedfeatures", {'INPUT': region_points, 'OUTPUT': 'TEMPORARY_OUTPUT'})
 
-                subset1.updateExtents()
-                subset2.updateExtents()
-
-                # temp file outputs
-                temp1 = os.path.join(matrix_folder, f"tmp_{point_id}_A.csv")
-                temp2 = os.path.join(matrix_folder, f"tmp_{point_id}_B.csv")
+                # --- Error handling: ---
+                # common error: GenericServerError: 500 ({"error":{"code":6020,"message":"Unable to compute a distance/duration matrix: Search exceeds the limit of visited nodes."}
+                # -> journeys through dense city centers are too long and complex 
+                # -> split destination points in two layers 
+                # simple retries always failed on all attempts 
+                # (sometimes the points worked when restarting the script but never with a retry loop directly after fail)
 
                 try:
-                    #  TRY MATRIX CALC FOR SUBSET 1
-                    processing.run("ORS Tools:matrix_from_layers", {
-                        'INPUT_PROVIDER': 1,
-                        'INPUT_PROFILE': 0,
-                        'INPUT_START_LAYER': origin['OUTPUT'],
-                        'INPUT_START_FIELD': 'id',
-                        'INPUT_END_LAYER': subset1,
-                        'INPUT_END_FIELD': 'id',
-                        'OUTPUT': temp1
-                    })
-
-                    #  TRY MATRIX CALC FOR SUBSET 2
-                    processing.run("ORS Tools:matrix_from_layers", {
+                    matrix_firsttry = processing.run("ORS Tools:matrix_from_layers", {
                         'INPUT_PROVIDER': 1,
                         'INPUT_PROFILE': 0,
                         'INPUT_START_LAYER': origin['OUTPUT'],
                         'INPUT_START_FIELD': 'id',
-                        'INPUT_END_LAYER': subset2,
+                        'INPUT_END_LAYER': destinations_all['OUTPUT'],
                         'INPUT_END_FIELD': 'id',
-                        'OUTPUT': temp2
+                        'OUTPUT': 'TEMPORARY_OUTPUT'
                     })
+                
+                    # QGIS sometimes overwrites merged split files again with an empty file from before 
+                    # first write Output to temporary file, then save as csv file 
+                    processing.run("native:savefeatures", {'INPUT':matrix_firsttry['OUTPUT'],'OUTPUT':matrix_out})
 
-                    #  MERGE BOTH SUBMATRICES → FINAL FILE
-
-                    df1 = pd.read_csv(temp1)
-                    df2 = pd.read_csv(temp2)
-                    df = pd.concat([df1, df2], ignore_index=True)
-
-                    df.to_csv(matrix_out, index=False)
-                    
-                    # delete temp files
-                    for tmp_file in [temp1, temp2]:
-                        if os.path.exists(tmp_file):
-                            os.remove(tmp_file)
-                    
+                
                 except Exception as e:
-                    # If still failing after all attempts → log ID
                     logging.info(str(e))
-                    logging.info(f"Split mode failed. Adding {point_id} to error list")
-                    err.append(point_id)
+                    logging.info("ORS failed, attempting split-mode...")
+                    split = 1
+
+                    #  SPLIT DESTINATION POINTS INTO 2 SUBSETS
+                    dest_layer = QgsVectorLayer(destinations_all['OUTPUT'], "destsplit", "ogr")
+                    all_feats = list(dest_layer.getFeatures())
+                    mid = len(all_feats) // 2
+                    if write_metrics:
+                        metrics.split('6020' if '6020' in str(e) else 'error', 1, len(all_feats))
+                
+                    subset1 = QgsVectorLayer("Point?crs="+dest_layer.crs().authid(), "subset1", "memory")
+                    pr1 = subset1.dataProvider()
+                    pr1.addAttributes(dest_layer.fields())
+                    subset1.updateFields()
+
+                    subset2 = QgsVectorLayer("Point?crs="+dest_layer.crs().authid(), "subset2", "memory")
+                    pr2 = subset2.dataProvider()
+                    pr2.addAttributes(dest_layer.fields())
+                    subset2.updateFields()
+
+                    # fill both subsets
+                    for f in all_feats[:mid]:
+                        pr1.addFeature(f)
+                    for f in all_feats[mid:]:
+                        pr2.addFeature(f)
+
+                    subset1.updateExtents()
+                    subset2.updateExtents()
+
+                    # temp file outputs
+                    temp1 = os.path.join(matrix_folder, f"tmp_{point_id}_A.csv")
+                    temp2 = os.path.join(matrix_folder, f"tmp_{point_id}_B.csv")
+
+                    try:
+                        #  TRY MATRIX CALC FOR SUBSET 1
+                        processing.run("ORS Tools:matrix_from_layers", {
+                            'INPUT_PROVIDER': 1,
+                            'INPUT_PROFILE': 0,
+                            'INPUT_START_LAYER': origin['OUTPUT'],
+                            'INPUT_START_FIELD': 'id',
+                            'INPUT_END_LAYER': subset1,
+                            'INPUT_END_FIELD': 'id',
+                            'OUTPUT': temp1
+                        })
+
+                        #  TRY MATRIX CALC FOR SUBSET 2
+                        processing.run("ORS Tools:matrix_from_layers", {
+                            'INPUT_PROVIDER': 1,
+                            'INPUT_PROFILE': 0,
+                            'INPUT_START_LAYER': origin['OUTPUT'],
+                            'INPUT_START_FIELD': 'id',
+                            'INPUT_END_LAYER': subset2,
+                            'INPUT_END_FIELD': 'id',
+                            'OUTPUT': temp2
+                        })
+
+                        #  MERGE BOTH SUBMATRICES → FINAL FILE
+
+                        df1 = pd.read_csv(temp1)
+                        df2 = pd.read_csv(temp2)
+                        df = pd.concat([df1, df2], ignore_index=True)
+
+                        df.to_csv(matrix_out, index=False)
+                    
+                        # delete temp files
+                        for tmp_file in [temp1, temp2]:
+                            if os.path.exists(tmp_file):
+                                os.remove(tmp_file)
+                    
+                    except Exception as e:
+                        # If still failing after all attempts → log ID
+                        logging.info(str(e))
+                        logging.info(f"Split mode failed. Adding {point_id} to error list")
+                        err.append(point_id)
+
+                if write_metrics:
+                    metrics.origins([point_id], time.perf_counter() - point_start, requests=1 + 2 * split, splits=split,
+                                    failed=int(point_id in err))
+                    metrics.progress(i + 1, n_points)
 
 
         logging.info("Building err_points layer...")
@@ -306,9 +462,26 @@ for region_name, region in regions.iterrows():
 
         else:
             logging.info("> No ORS errors detected. No err_points layer created.")
+
+        # only complete matrices are cached; the key is also read by script 03 to detect changed matrices
+        if use_cache and len(err) == 0:
+            cache.store('matrix', matrix_key, [matrix_output])
+            with open(os.path.join(output_folder, 'matrix.key'), 'w') as f:
+                f.write(matrix_key)
     else:
         logging.info("Keine Matrizenberechnung.")
+    if write_metrics:
+        metrics.close()
     
+if use_cache:
+    cache.evict(cache_max_gb * 1e9)
+if od_store_folder:
+    # one file instead of the part files of all regions
+    od_store.OdStore(od_store_folder).compact()
+if write_metrics:
+    logging.info(run_metrics.report_text([metrics_folder]))
+    logging.info(f"Metrics: {metrics_folder}")
+
 end = datetime.now()
 logging.info('End of script.')
 logging.info(f'Runtime: {end - now}')
\ No newline at end of file
@@ -0,0 +1,49 @@
+# Validation of the destination clusters (cluster_theta in script 02) against an exact matrix
+# Run script 02 once without clusters for a test region (e.g. Aachen), then compare the clustered result for
+# several values of theta: share of routed pairs and errors of exp_h_w, exp_km_w and CC_mean
+
+import os, sys
+from datetime import datetime
+import geopandas as gpd
+import pandas as pd
+
+now = datetime.now()
+print("Start:", now.strftime("%H:%M:%S"))
+
+# --- PARAMETERS ---
+worksp = 'path/to/workspace/'
+region_name = 'Aachen'
+date = now.strftime('%y_%m_%d')  # date tag of the output folder with the exact matrix, e.g. '25_08_04'
+pct = 100
+grid_space = 1000
+crs = 'EPSG:25832'
+region_field = "region"
+matrix_format = 'csv'  # same as in script 02
+thetas = [0.25, 0.5, 0.75, 1.0]
+
+sys.path.append(os.path.join(worksp, 'code'))
+import impedance
+import destination_clusters
+import population
+
+# --- MAIN ---
+folder = os.path.join(worksp, 'output', f'{region_name}_{pct}perc_{date}')
+points = gpd.read_file(os.path.join(folder, f'{region_name}_10perc_ew.gpkg')).to_crs(crs)
+destins = gpd.read_file(os.path.join(folder, f'destination_points_{grid_space}mgrid_{region_name}{pct}perc.gpkg')).to_crs(crs)
+municip = gpd.read_file(os.path.join(worksp, 'input', 'municipalites.gpkg')).to_crs(crs)
+region_shape = municip[municip[region_field] == region_name]
+
+print(datetime.now(), 'Load exact matrix...')
+exact = pd.concat([pd.DataFrame(chunk) for chunk in impedance.iter_matrix_chunks(folder, region_name, matrix_format)],
+                  ignore_index=True)
+
+print(datetime.now(), 'Compare clusters...')
+report = destination_clusters.validate(exact, points['id'].astype('int64').to_numpy(), population.point_xy(points),
+                                       destins['id'].astype('int64').to_numpy(), population.point_xy(destins),
+                                       destins['EW_10'].fillna(0),
+                                       thetas, impedance.powerexp_paper, points, region_shape, region_name)
+print(report.to_string(index=False))
+report.to_csv(os.path.join(folder, f'cluster_validation_{region_name}.csv'), index=False)
+
+end = datetime.now()
+print("Ende:", end.strftime("%H:%M:%S"))
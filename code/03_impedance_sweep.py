@@ -0,0 +1,42 @@
+# Sensitivity analysis of the impedance functions in script 03:
+# evaluates several decay parameter sets in one pass over the matrices of each region (see impedance.py)
+# and writes exp_h_w / exp_km_w per origin and parameter set
+
+import os, sys
+from datetime import datetime
+import geopandas as gpd
+
+now = datetime.now()
+print("Start:", now.strftime("%H:%M:%S"))
+
+# --- PARAMETERS ---
+worksp = 'path/to/workspace/'
+date = now.strftime('%y_%m_%d')  # date tag of the output folders from script 02, e.g. '25_08_04'
+pct = 50
+grid_space = 1000
+region_field = "region"
+matrix_format = 'csv'  # same as in script 02
+
+sys.path.append(os.path.join(worksp, 'code'))
+import impedance
+
+# parameter sets to compare: 'h' decay on driving time, 'km' decay on distance (mean of all functions given)
+variants = [
+    impedance.powerexp_paper,
+    impedance.negexp_paper,
+    # e.g. slower decay for cycling:
+    # {'name': 'bike_slow', 'h': [(0.019, 1.340)], 'km': [(1.174, 0.749), (0.2, 0.871)]},
+]
+
+# --- MAIN LOOP ---
+municip = gpd.read_file(os.path.join(worksp, 'input', 'municipalites.gpkg'))
+for region_name in municip[region_field].unique():
+    print("\n--- Region:", region_name, "---")
+    folder = os.path.join(worksp, 'output', f'{region_name}_{pct}perc_{date}')
+    sweep = impedance.region_sweep(folder, region_name, variants, matrix_format=matrix_format,
+                                   grid_space=grid_space, pct=pct)
+    sweep.to_csv(os.path.join(folder, f'centrality_sweep_{region_name}.csv'), index=False)
+    print(datetime.now(), f"{len(variants)} parameter sets for {sweep['FROM_ID'].nunique()} points")
+
+end = datetime.now()
+print("Ende:", end.strftime("%H:%M:%S"))
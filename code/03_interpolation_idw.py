@@ -0,0 +1,60 @@
+# Interpolation of the centrality points to rasters (step 7 of script 03 without gstat, see idw_raster.py)
+# Reads centrality_{region}_50perc_oA.gpkg of step 5 and writes interpolation_{region}_idp4.tif for CC_mean,
+# CC_mean_car and CC_mean_shortdist in one pass into output/interpolation/{field}/, the folders used by step 8
+# of script 03. Set `interpolation <- FALSE` in script 03 when the rasters are computed here.
+
+import os, sys, glob, re
+from datetime import datetime
+import geopandas as gpd
+
+now = datetime.now()
+
+# --- PARAMETERS ---
+worksp = 'path/to/workspace/'
+date = None  # None: newest output folder of each region (like date <- NA in script 03), or e.g. '25_08_04'
+region_field = "region"
+crs = 'EPSG:25832'
+fields = ['CC_mean', 'CC_mean_car', 'CC_mean_shortdist']
+resolution = 500  # cell size in m (500 in script 03)
+nmax = 7  # nearest points per cell (gstat nmax)
+idp = 4  # power of the inverse distance (gstat idp)
+processes = None  # None = all cores
+tile_size = 512  # cells per tile side
+
+sys.path.append(os.path.join(worksp, 'code'))
+import idw_raster
+
+
+# output folder of script 02 for the region, the newest one if no date is given
+def region_folder(region_name):
+    if date:
+        return os.path.join(worksp, 'output', f'{region_name}_50perc_{date}')
+    pattern = re.compile(rf'^{re.escape(region_name)}_50perc_\d{{2}}_\d{{2}}_\d{{2}}$')
+    folders = [f for f in glob.glob(os.path.join(worksp, 'output', f'{region_name}_50perc_*')) if pattern.match(os.path.basename(f))]
+    return sorted(folders)[-1] if folders else None
+
+
+# --- MAIN LOOP ---
+# (guarded, the worker processes import this script on Windows)
+if __name__ == '__main__':
+    print("Start:", now.strftime("%H:%M:%S"))
+    municip = gpd.read_file(os.path.join(worksp, 'input', 'municipalites.gpkg')).to_crs(crs)
+    for region_name in municip[region_field].unique():
+        print("\n--- Region:", region_name, "---")
+        folder = region_folder(region_name)
+        centrality_path = os.path.join(folder, f'centrality_{region_name}_50perc_oA.gpkg') if folder else None
+        if centrality_path is None or not os.path.exists(centrality_path):
+            print("> No centrality points (step 5 of script 03), skipping...")
+            continue
+
+        points = gpd.read_file(centrality_path).to_crs(crs)
+        region_shape = municip[municip[region_field] == region_name]
+        outpaths = [os.path.join(worksp, 'output', 'interpolation', field, f'interpolation_{region_name}_idp4.tif')
+                    for field in fields]
+        width, height = idw_raster.interpolate(
+            points.get_coordinates().to_numpy(), points[fields].to_numpy(dtype=float), region_shape.geometry, region_shape.total_bounds,
+            crs, outpaths, resolution=resolution, nmax=nmax, idp=idp, tile_size=tile_size, processes=processes)
+        print(datetime.now(), f"{width} x {height} cells written for {', '.join(fields)}")
+
+    end = datetime.now()
+    print("Ende:", end.strftime("%H:%M:%S"))
@@ -0,0 +1,57 @@
+# Join of urban structure polygons to the centrality points (step 6 of script 03 for large polygon layers)
+# Reads centrality_{region}_50perc_oA.gpkg of step 5 and streams the polygons of each region from the layer
+# (see shape_join.py) into output/{shapes_name}/{shapes_name}_accessibility_{region}.gpkg, the files merged in
+# step 8 of script 03. Set `join_shapes <- FALSE` in script 03 when the polygons are joined here.
+
+import os, sys, glob, re
+from datetime import datetime
+import geopandas as gpd
+
+now = datetime.now()
+print("Start:", now.strftime("%H:%M:%S"))
+
+# --- PARAMETERS ---
+worksp = 'path/to/workspace/'
+date = None  # None: newest output folder of each region (like date <- NA in script 03), or e.g. '25_08_04'
+region_field = "region"
+crs = 'EPSG:25832'
+shapes_name = "vacant_lots"
+layer_name = "vacant_lots"
+shapes_path = os.path.join(worksp, 'input', f'{shapes_name}.gpkg')  # GeoPackage (with spatial index) of the whole area, no need to filter it to the regions first
+id_col = "id_vl"  # written as OBJECTID
+area_col = "area_m2"  # written as Shape_Area
+tile_size = 5000  # side of the tiles read at once, in units of the layer CRS; smaller tiles for dense layers (e.g. building footprints) need less memory
+
+sys.path.append(os.path.join(worksp, 'code'))
+import shape_join
+
+
+# output folder of script 02 for the region, the newest one if no date is given
+def region_folder(region_name):
+    if date:
+        return os.path.join(worksp, 'output', f'{region_name}_50perc_{date}')
+    pattern = re.compile(rf'^{re.escape(region_name)}_50perc_\d{{2}}_\d{{2}}_\d{{2}}$')
+    folders = [f for f in glob.glob(os.path.join(worksp, 'output', f'{region_name}_50perc_*')) if pattern.match(os.path.basename(f))]
+    return sorted(folders)[-1] if folders else None
+
+
+# --- MAIN LOOP ---
+municip = gpd.read_file(os.path.join(worksp, 'input', 'municipalites.gpkg')).to_crs(crs)
+os.makedirs(os.path.join(worksp, 'output', shapes_name), exist_ok=True)
+for region_name in municip[region_field].unique():
+    print("\n--- Region:", region_name, "---")
+    folder = region_folder(region_name)
+    centrality_path = os.path.join(folder, f'centrality_{region_name}_50perc_oA.gpkg') if folder else None
+    if centrality_path is None or not os.path.exists(centrality_path):
+        print("> No centrality points (step 5 of script 03), skipping...")
+        continue
+
+    points = gpd.read_file(centrality_path)
+    region_shape = municip[municip[region_field] == region_name].geometry.union_all()
+    outname = os.path.join(worksp, 'output', shapes_name, f'{shapes_name}_accessibility_{region_name}.gpkg')
+    n_shapes = shape_join.join_region(shapes_path, layer_name, points, region_shape, crs, outname,
+                                      id_col=id_col, area_col=area_col, tile_size=tile_size)
+    print(datetime.now(), f"{n_shapes} polygons written to {outname}")
+
+end = datetime.now()
+print("Ende:", end.strftime("%H:%M:%S"))
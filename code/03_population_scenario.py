@@ -0,0 +1,66 @@
+# Centrality for a new population scenario without recomputing matrices
+# Uses the sparse decay-weight operators per region (impedance.py): the new population is assigned to the road
+# points, multiplied with the operators and scaled, cropped and rescaled as in script 03
+
+import os, sys
+from datetime import datetime
+import geopandas as gpd
+import pandas as pd
+
+now = datetime.now()
+print("Start:", now.strftime("%H:%M:%S"))
+
+# --- PARAMETERS ---
+worksp = 'path/to/workspace/'
+date = now.strftime('%y_%m_%d')  # date tag of the output folders from script 02, e.g. '25_08_04'
+pct = 50
+grid_space = 1000
+crs = 'EPSG:25832'
+region_field = "region"
+matrix_format = 'csv'  # same as in script 02
+
+scenario_name = 'zensus2022'
+ew_field = 'Einwohner'  # population field of the scenario points
+
+# --- FILE INPUTS ---
+municip_path = os.path.join(worksp, 'input', 'municipalites.gpkg')
+population_path = os.path.join(worksp, 'input', 'zensus2022_ew_buffer.gpkg')  # population points of the scenario
+
+sys.path.append(os.path.join(worksp, 'code'))
+import impedance
+import population
+
+# decay parameters as in script 03
+variant = impedance.powerexp_paper
+
+# --- MAIN LOOP ---
+municip = gpd.read_file(municip_path).to_crs(crs)
+population_points = gpd.read_file(population_path).to_crs(crs)
+
+for region_name, region_shape in municip.groupby(region_field):
+    print("\n--- Region:", region_name, "---")
+    folder = os.path.join(worksp, 'output', f'{region_name}_{pct}perc_{date}')
+
+    # operators are built from the matrix once and reused for every scenario
+    print(datetime.now(), 'Load decay operators...')
+    operators = impedance.region_operators(folder, region_name, variant, matrix_format=matrix_format,
+                                           grid_space=grid_space, pct=pct)
+
+    # population of the scenario on the road points (as EW_10 in script 02), only scenario points within the
+    # buffer of the region, otherwise the population outside piles up on the outermost road points
+    print(datetime.now(), 'Assign population...')
+    points = gpd.read_file(os.path.join(folder, f'{region_name}_10perc_ew.gpkg')).to_crs(crs)
+    buffer_shape = gpd.read_file(os.path.join(worksp, 'output', 'buffer', f'buffer_{region_name}.gpkg')).to_crs(crs).geometry.iloc[0]
+    region_population = population_points[population_points.intersects(buffer_shape)]
+    points['EW_10'] = population.assign_population(population.point_xy(points), population.point_xy(region_population),
+                                                   region_population[ew_field])
+    ew = pd.Series(points['EW_10'].to_numpy(), index=points['id'].astype('int64'))
+
+    print(datetime.now(), 'Calculate centrality...')
+    exp_h_w = impedance.apply_operator(*operators['h'], ew)
+    exp_km_w = impedance.apply_operator(*operators['km'], ew)
+    cropped = impedance.centrality_indices(points, exp_h_w, exp_km_w, region_shape, region_name)
+    cropped.to_file(os.path.join(folder, f'centrality_{region_name}_{pct}perc_oA_{scenario_name}.gpkg'), driver='GPKG')
+
+end = datetime.now()
+print("Ende:", end.strftime("%H:%M:%S"))
@@ -0,0 +1,314 @@
+# Benchmarks of all stages of the workflow on synthetic regions (synthetic_region.py) against a local ORS stand-in
+# (mock_ors.py), so changes to the hot paths can be measured offline and without the Aachen data.
+# Every stage runs in a fresh process per region size: the inputs are prepared first (not timed), then the stage
+# itself is timed. Reported per stage and size: items processed, seconds, throughput, resident memory (RSS) before
+# the timed part and its peak during it (and the peak of worker processes); the exponent of seconds ~ items^k over
+# the sizes shows how a stage scales. Results are written to benchmark_{date}_{time}.csv and can be compared with an
+# earlier run (compare_with), slower stages or stages with more memory are flagged.
+#
+# Stages and the code they time:
+#   zensus        00_prepare_zensuspoints.py on the census csv (rows read)
+#   grid          road_points.road_points: hexagon grid snapped to the roads (grid cells)
+#   population    population.population_sum: census points summed on the nearest road point (census points)
+#   matrix        ors_matrix.run_matrix against mock_ors.py (origin-destination pairs)
+#   impedance     impedance.accessibility_sweep over an Arrow matrix store (matrix rows)
+#   join          shape_join.join_region: vacant lots joined to the nearest centrality point (polygons)
+#   interpolation idw_raster.interpolate: IDW raster of the three CC fields (raster cells), once per processes value
+
+import os, sys, re, json, time
+import multiprocessing
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+now = datetime.now()
+
+# --- PARAMETERS ---
+worksp = 'path/to/workspace/'
+bench_folder = os.path.join(worksp, 'output', 'benchmark')  # synthetic regions and results
+sizes_km = [10, 20, 40]  # side of the square synthetic regions
+stages = ['zensus', 'grid', 'population', 'matrix', 'impedance', 'join', 'interpolation']
+network = 'lattice'  # 'lattice' or 'random' road network (synthetic_region.py)
+umkreis = 10000  # buffer in m as in scripts 00-02
+grid_space = 1000
+origin_share = 0.1  # share of the road points used as origins (matrix stage)
+destination_share = 0.5  # pct = 50 in script 02
+repeat = 1  # runs per stage and size, the fastest is reported
+compare_with = None  # csv of an earlier run, e.g. os.path.join(bench_folder, 'benchmark_25_08_04_1030.csv')
+
+# matrix stage
+max_routes = 2500
+concurrency = 4
+ors_precheck = False  # snap and check the points first (routability.py)
+mock_settings = {'latency_ms': 20, 'route_us': 5, 'workers': 4, 'fail_rate': 0.02, 'unroutable_share': 0.002}
+mock_port = 8085
+
+# interpolation stage
+resolution = 100
+processes = [1, None]  # None = all cores
+
+sys.path.append(os.path.join(worksp, 'code'))
+import run_metrics  # memory of the stages
+crs = 'EPSG:25832'
+region_name = 'Synth'
+
+
+# --- HELPERS ---
+# run a flat script of the workflow with other values for the parameters of its PARAMETERS block
+def run_script(path, **params):
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    for name, value in params.items():
+        source, n = re.subn(rf'^{name} = .*$', lambda m: f'{name} = {value!r}', source, count=1, flags=re.M)
+        if n == 0:
+            raise ValueError(f"Parameter {name} not found in {path}")
+    exec(compile(source, path, 'exec'), {'__name__': '__main__', '__file__': path})
+
+
+def region_folder(size_km):
+    return os.path.join(bench_folder, f'{network}_{size_km}km_{umkreis}m')
+
+
+# inputs of a region size shared by the stages: synthetic region, road points with population and random
+# centrality values (the values do not matter for the timings)
+def prepare(size_km):
+    import geopandas as gpd
+    import synthetic_region, road_points, population
+    folder = region_folder(size_km)
+    points_path = os.path.join(folder, 'bench', f'road_points_{grid_space}m.gpkg')
+    if os.path.exists(points_path):
+        return
+    print(datetime.now(), f"Synthetic region of {size_km} km...")
+    paths = synthetic_region.make_region(folder, size_km, network, buffer=umkreis, region_name=region_name)
+    municip = gpd.read_file(paths['municipalities'])
+    buffer = municip.dissolve(by='region')
+    buffer.geometry = buffer.buffer(umkreis)
+    highways = gpd.read_file(paths['highways'])
+    points = road_points.road_points(highways, buffer, grid_space, extent=municip.total_bounds)
+
+    census = census_points(paths['zensus_csv'])
+    points['EW_10'] = population.assign_population(population.point_xy(points), population.point_xy(census),
+                                                   census['Einwohner'])
+    rng = np.random.default_rng(0)
+    for field in ['CC_mean', 'CC_mean_car', 'CC_mean_shortdist']:
+        points[field] = rng.random(len(points))
+    points['Gem_layer'] = region_name
+    os.makedirs(os.path.dirname(points_path), exist_ok=True)
+    points.to_file(points_path + '.tmp.gpkg', driver="GPKG")
+    os.replace(points_path + '.tmp.gpkg', points_path)
+
+
+def census_points(zensus_csv):
+    import geopandas as gpd
+    census = pd.read_csv(zensus_csv, sep=';')
+    return gpd.GeoDataFrame(census, geometry=gpd.points_from_xy(census['x_mp_100m'], census['y_mp_100m']),
+                            crs='EPSG:3035').to_crs(crs)
+
+
+# --- STAGES ---
+# each stage prepares its inputs, then calls timed(); returns (items, unit, extra values for the report)
+def stage_zensus(folder, timed, options):
+    zensus_csv = os.path.join(folder, 'input', 'Zensus2022_Bevoelkerungszahl_100m-Gitter.csv')
+    with open(zensus_csv, 'rb') as f:
+        rows = sum(1 for _ in f) - 1
+    timed(lambda: run_script(os.path.join(worksp, 'code', '00_prepare_zensuspoints.py'),
+                             worksp=folder, umkreis=umkreis, crs=crs))
+    return rows, 'rows', {}
+
+
+def stage_grid(folder, timed, options):
+    import geopandas as gpd
+    import road_points
+    municip = gpd.read_file(os.path.join(folder, 'input', 'municipalites.gpkg'))
+    buffer = municip.dissolve(by='region')
+    buffer.geometry = buffer.buffer(umkreis)
+    highways = gpd.read_file(os.path.join(folder, 'input', f'highways_{region_name}.gpkg'))
+    points = timed(lambda: road_points.road_points(highways, buffer, grid_space, extent=municip.total_bounds))
+    cells = len(road_points.grid_centroids(municip.total_bounds, grid_space)[0])
+    return cells, 'cells', {'road_points': len(points), 'roads': len(highways)}
+
+
+def stage_population(folder, timed, options):
+    import geopandas as gpd
+    import population
+    points = gpd.read_file(os.path.join(folder, 'bench', f'road_points_{grid_space}m.gpkg'))
+    census = census_points(os.path.join(folder, 'input', 'Zensus2022_Bevoelkerungszahl_100m-Gitter.csv'))
+    road_xy, census_xy = population.point_xy(points), population.point_xy(census)
+    timed(lambda: population.population_sum(road_xy, census_xy, census['Einwohner']))
+    return len(census), 'points', {'road_points': len(points)}
+
+
+def stage_matrix(folder, timed, options):
+    import shutil
+    import geopandas as gpd
+    import ors_matrix, matrix_store, mock_ors
+    points = gpd.read_file(os.path.join(folder, 'bench', f'road_points_{grid_space}m.gpkg'))
+    rng = np.random.default_rng(1)
+    origins_path = os.path.join(folder, 'bench', 'origins.gpkg')
+    destinations_path = os.path.join(folder, 'bench', 'destinations.gpkg')
+    points.sample(frac=origin_share, random_state=rng)[['id', 'geometry']].to_file(origins_path, driver="GPKG")
+    points.sample(frac=destination_share, random_state=rng)[['id', 'EW_10', 'geometry']].to_file(destinations_path, driver="GPKG")
+    store = os.path.join(folder, 'bench', 'matrix')
+    shutil.rmtree(store, ignore_errors=True)
+    snap_cache = os.path.join(folder, 'bench', 'snap_cache.csv') if ors_precheck else None
+    if snap_cache and os.path.exists(snap_cache):
+        os.remove(snap_cache)
+
+    before = mock_ors.stats(options['url'])
+    failed = timed(lambda: ors_matrix.run_matrix(origins_path, destinations_path,
+                                                 matrix_store.ArrowMatrixWriter(store, region_name), options['url'],
+                                                 max_routes=max_routes, concurrency=concurrency, snap_cache=snap_cache))
+    after = mock_ors.stats(options['url'])
+    server = {name: after[name] - before[name] for name in after if name != 'max_waiting'}
+    n_origins = len(gpd.read_file(origins_path, ignore_geometry=True))
+    n_destinations = len(gpd.read_file(destinations_path, ignore_geometry=True))
+    return n_origins * n_destinations, 'pairs', {'origins': n_origins, 'failed': len(failed), **server}
+
+
+def stage_impedance(folder, timed, options):
+    import shutil
+    import geopandas as gpd
+    import impedance, matrix_store
+    # full matrix of all road points to the destination sample from straight-line distances (not timed)
+    points = gpd.read_file(os.path.join(folder, 'bench', f'road_points_{grid_space}m.gpkg'))
+    destins = points.sample(frac=destination_share, random_state=np.random.default_rng(2))
+    store = os.path.join(folder, 'bench', 'matrix_full')
+    shutil.rmtree(store, ignore_errors=True)
+    writer = matrix_store.ArrowMatrixWriter(store, region_name)
+    origin_xy, dest_xy = points.get_coordinates().to_numpy(), destins.get_coordinates().to_numpy()
+    for start in range(0, len(points), 100):
+        distance = np.hypot(*(origin_xy[start:start + 100, None, :] - dest_xy[None, :, :]).transpose(2, 0, 1)) * 1.3 / 1000
+        writer.write(points['id'].to_numpy()[start:start + 100], destins['id'].to_numpy(), distance / 50, distance)
+    writer.close()
+
+    chunks = lambda: ({name: batch.column(name).to_numpy(zero_copy_only=False) for name in batch.schema.names}
+                      for batch in matrix_store.iter_batches(store, region_name))
+    timed(lambda: impedance.accessibility_sweep(chunks(), points['id'].to_numpy(), destins['id'].to_numpy(),
+                                                destins['EW_10'], [impedance.powerexp_paper, impedance.negexp_paper]))
+    return len(points) * len(destins), 'rows', {'variants': 2}
+
+
+def stage_join(folder, timed, options):
+    import geopandas as gpd
+    import shape_join
+    points = gpd.read_file(os.path.join(folder, 'bench', f'road_points_{grid_space}m.gpkg'))
+    municip = gpd.read_file(os.path.join(folder, 'input', 'municipalites.gpkg'))
+    outname = os.path.join(folder, 'bench', 'vacant_lots_accessibility.gpkg')
+    n = timed(lambda: shape_join.join_region(os.path.join(folder, 'input', 'vacant_lots.gpkg'), 'vacant_lots', points,
+                                             municip.geometry.union_all(), crs, outname))
+    return n, 'polygons', {'points': len(points)}
+
+
+def stage_interpolation(folder, timed, options):
+    import geopandas as gpd
+    import idw_raster
+    points = gpd.read_file(os.path.join(folder, 'bench', f'road_points_{grid_space}m.gpkg'))
+    municip = gpd.read_file(os.path.join(folder, 'input', 'municipalites.gpkg'))
+    fields = ['CC_mean', 'CC_mean_car', 'CC_mean_shortdist']
+    outpaths = [os.path.join(folder, 'bench', f'interpolation_{field}.tif') for field in fields]
+    width, height = timed(lambda: idw_raster.interpolate(points.get_coordinates().to_numpy(), points[fields].to_numpy(),
+                                                         municip.geometry, municip.total_bounds, crs, outpaths,
+                                                         resolution=resolution, processes=options['processes']))
+    return width * height, 'cells', {'processes': options['processes'] or os.cpu_count()}
+
+
+# runs in a fresh process: prepare, time the stage, send the result back
+def run_stage(stage, size_km, options, connection):
+    folder = region_folder(size_km)
+    times = {}
+
+    def timed(function):
+        times['setup_rss_mb'] = run_metrics.rss_mb('VmRSS')
+        run_metrics.reset_peak()
+        start = time.perf_counter()
+        result = function()
+        times['seconds'] = time.perf_counter() - start
+        times['peak_rss_mb'] = run_metrics.rss_mb()
+        times['workers_peak_rss_mb'] = run_metrics.children_peak_mb()
+        return result
+    try:
+        items, unit, extra = globals()[f'stage_{stage}'](folder, timed, options)
+        connection.send({'items': items, 'unit': unit, **times, 'extra': json.dumps(extra)})
+    except Exception as e:
+        connection.send({'error': repr(e)})
+        raise
+
+
+def measure(stage, size_km, options):
+    context = multiprocessing.get_context('spawn')
+    receive, send = context.Pipe(duplex=False)
+    process = context.Process(target=run_stage, args=(stage, size_km, options, send))
+    process.start()
+    result = receive.recv() if receive.poll(24 * 3600) else {'error': 'no result'}
+    process.join()
+    return result
+
+
+# exponent k of seconds ~ items^k between the sizes (1 = linear)
+def scaling(results):
+    rows = []
+    for (stage, variant), group in results.dropna(subset=['seconds']).groupby(['stage', 'variant'], dropna=False):
+        group = group[(group['items'] > 0) & (group['seconds'] > 0)]
+        k = np.polyfit(np.log(group['items']), np.log(group['seconds']), 1)[0] if group['items'].nunique() > 1 else np.nan
+        rows.append({'stage': stage, 'variant': variant, 'exponent': round(k, 2)})
+    return pd.DataFrame(rows)
+
+
+# --- MAIN ---
+if __name__ == '__main__':
+    print("Start:", now.strftime("%H:%M:%S"))
+    import mock_ors
+    for size_km in sizes_km:
+        prepare(size_km)
+
+    server = None
+    if 'matrix' in stages:
+        server, url = mock_ors.start(mock_port, **mock_settings)
+    rows = []
+    try:
+        for stage in stages:
+            variants = [{'processes': p} for p in processes] if stage == 'interpolation' else [{}]
+            for options in variants:
+                if stage == 'matrix':
+                    options = {'url': url}
+                variant = ', '.join(f'{k}={v}' for k, v in options.items() if k != 'url')
+                for size_km in sizes_km:
+                    runs = [measure(stage, size_km, options) for _ in range(repeat)]
+                    errors = [r['error'] for r in runs if 'error' in r]
+                    if errors:
+                        print(datetime.now(), f"{stage} {size_km} km failed: {errors[0]}")
+                        rows.append({'stage': stage, 'variant': variant, 'size_km': size_km, 'error': errors[0]})
+                        continue
+                    best = min(runs, key=lambda r: r['seconds'])
+                    best['peak_rss_mb'] = max(r['peak_rss_mb'] for r in runs)
+                    row = {'stage': stage, 'variant': variant, 'size_km': size_km, **best,
+                           'throughput': best['items'] / best['seconds']}
+                    rows.append(row)
+                    print(datetime.now(), f"{stage:<13} {variant:<13} {size_km:>4} km: {row['items']:>11,} {row['unit']:<8} "
+                                          f"{row['seconds']:9.2f} s {row['throughput']:>13,.0f}/s "
+                                          f"peak {row['peak_rss_mb']:7.0f} MB {row['extra']}")
+    finally:
+        if server is not None:
+            server.terminate()
+
+    results = pd.DataFrame(rows)
+    results['variant'] = results['variant'].fillna('')
+    outname = os.path.join(bench_folder, f"benchmark_{now.strftime('%y_%m_%d_%H%M')}.csv")
+    results.to_csv(outname, index=False)
+    print("\nScaling (seconds ~ items^k):")
+    print(scaling(results).to_string(index=False))
+
+    if compare_with:
+        earlier = pd.read_csv(compare_with, keep_default_na=False, na_values=[''])
+        earlier['variant'] = earlier['variant'].fillna('')
+        compared = results.merge(earlier, on=['stage', 'variant', 'size_km'], suffixes=('', '_before'))
+        compared['speedup'] = compared['seconds_before'] / compared['seconds']
+        compared['memory_ratio'] = compared['peak_rss_mb'] / compared['peak_rss_mb_before']
+        print(f"\nCompared with {compare_with} (speedup < 0.9 or memory ratio > 1.1 flagged):")
+        compared['flag'] = np.where((compared['speedup'] < 0.9) | (compared['memory_ratio'] > 1.1), 'regression', '')
+        print(compared[['stage', 'variant', 'size_km', 'seconds_before', 'seconds', 'speedup', 'memory_ratio', 'flag']]
+              .round(2).to_string(index=False))
+    print(f"\nResults: {outname}")
+
+    end = datetime.now()
+    print("Ende:", end.strftime("%H:%M:%S"))
@@ -0,0 +1,163 @@
+# Hierarchical aggregation of destinations for sub-quadratic matrices (alternative to the random pct sample)
+# Destinations are organised in a quadtree. Seen from an origin, a quadtree cell that is small compared to its
+# distance (cell size < theta x distance to the cell, as in Barnes-Hut) is represented by one destination point
+# close to its population-weighted centroid; only the representatives are routed and all members of the cell
+# get the travel time and distance of their representative. Near destinations stay exact. Smaller theta means
+# more exact pairs, theta = 0 routes all pairs.
+
+import logging
+import numpy as np
+import pandas as pd
+
+
+class DestinationTree:
+    def __init__(self, xy, population, min_size=1.0):
+        self.xy = np.asarray(xy, dtype=float)
+        self.population = np.nan_to_num(np.asarray(population, dtype=float))
+        self.bounds = []     # xmin, ymin, xmax, ymax of the cell
+        self.members = []    # destination indices in the cell
+        self.children = []
+        self.representative = []
+        size = max(np.ptp(self.xy[:, 0]), np.ptp(self.xy[:, 1]), min_size)
+        x0, y0 = self.xy.min(axis=0)
+        self._build(np.arange(len(self.xy)), x0, y0, size, min_size)
+
+    def _build(self, members, x0, y0, size, min_size):
+        node = len(self.members)
+        self.bounds.append((x0, y0, x0 + size, y0 + size))
+        self.members.append(members)
+        self.children.append([])
+
+        # representative: member closest to the population-weighted centroid
+        weights = self.population[members] + 1e-9
+        centroid = (self.xy[members] * weights[:, None]).sum(axis=0) / weights.sum()
+        self.representative.append(members[np.argmin(np.hypot(*(self.xy[members] - centroid).T))])
+
+        if len(members) > 1 and size > min_size:
+            half = size / 2
+            right = self.xy[members, 0] >= x0 + half
+            top = self.xy[members, 1] >= y0 + half
+            children = []
+            for r in (False, True):
+                for t in (False, True):
+                    part = members[(right == r) & (top == t)]
+                    if len(part):
+                        children.append(self._build(part, x0 + half * r, y0 + half * t, half, min_size))
+            self.children[node] = children
+        return node
+
+    # groups (representative, members) of the destinations seen from one origin
+    def groups(self, origin_xy, theta):
+        groups = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            xmin, ymin, xmax, ymax = self.bounds[node]
+            distance = np.hypot(max(xmin - origin_xy[0], 0, origin_xy[0] - xmax),
+                                max(ymin - origin_xy[1], 0, origin_xy[1] - ymax))
+            if len(self.members[node]) == 1 or (xmax - xmin) < theta * distance:
+                groups.append((self.representative[node], self.members[node]))
+            elif self.children[node]:
+                stack.extend(self.children[node])
+            else:
+                # cell that can not be split any further (identical points) close to the origin: all exact
+                groups.extend((m, self.members[node][i:i + 1]) for i, m in enumerate(self.members[node]))
+        return groups
+
+    # destination index -> index of its representative for one origin
+    @staticmethod
+    def representative_of(groups, n_destinations):
+        rep = np.empty(n_destinations, dtype='int64')
+        for representative, members in groups:
+            rep[members] = representative
+        return rep
+
+
+# groups per origin and the destinations to route per origin (candidates as in pruning.py)
+def origin_groups(tree, origin_xy, theta):
+    groups = [tree.groups(xy, theta) for xy in origin_xy]
+    candidates = [np.unique([r for r, _ in g]) for g in groups]
+    pairs = sum(len(c) for c in candidates) / max(1, len(origin_xy) * len(tree.xy))
+    logging.info(f"Destination clusters (theta = {theta}): {pairs:.1%} of origin-destination pairs are routed")
+    return groups, candidates
+
+
+# writes the matrix of all destinations: every destination gets the values of its representative
+class ClusterWriter:
+    def __init__(self, writer, groups_by_origin, dest_ids):
+        self.writer = writer
+        self.groups_by_origin = groups_by_origin
+        self.dest_ids = dest_ids
+        self.dest_index = pd.Series(np.arange(len(dest_ids)), index=dest_ids)
+
+    def exists(self, point_id):
+        return self.writer.exists(point_id)
+
+    def write(self, from_ids, to_ids, duration_h, dist_km):
+        column = np.full(len(self.dest_ids), -1)
+        column[self.dest_index[to_ids].to_numpy()] = np.arange(len(to_ids))
+        full_duration = np.empty((len(from_ids), len(self.dest_ids)))
+        full_dist = np.empty((len(from_ids), len(self.dest_ids)))
+        for i, from_id in enumerate(from_ids):
+            rep_column = column[DestinationTree.representative_of(self.groups_by_origin[from_id], len(self.dest_ids))]
+            full_duration[i] = np.where(rep_column >= 0, duration_h[i][rep_column], np.nan)
+            full_dist[i] = np.where(rep_column >= 0, dist_km[i][rep_column], np.nan)
+        self.writer.write(from_ids, self.dest_ids, full_duration, full_dist)
+
+    def close(self):
+        self.writer.close()
+
+
+# --- VALIDATION ---
+# Compares the clustered with the exact result from an existing (exact) matrix of a test region: as the
+# representatives are routed exactly, the clustered matrix is the exact matrix with every destination replaced
+# by its representative. Returns one row per theta with the share of routed pairs and the errors of
+# exp_h_w/exp_km_w and of the final CC values.
+def validate(exact, origin_ids, origin_xy, dest_ids, dest_xy, dest_population, thetas, variant, points=None,
+             region_shape=None, region_name=None):
+    import impedance
+    tree = DestinationTree(dest_xy, dest_population)
+    origin_index = pd.Series(np.arange(len(origin_ids)), index=origin_ids)
+    dest_index = pd.Series(np.arange(len(dest_ids)), index=dest_ids)
+    duration = np.full((len(origin_ids), len(dest_ids)), np.nan)
+    distance = np.full((len(origin_ids), len(dest_ids)), np.nan)
+    rows = origin_index.reindex(exact['FROM_ID']).to_numpy()
+    cols = dest_index.reindex(exact['TO_ID']).to_numpy()
+    known = ~np.isnan(rows) & ~np.isnan(cols)
+    duration[rows[known].astype(int), cols[known].astype(int)] = exact['DURATION_H'].to_numpy()[known]
+    distance[rows[known].astype(int), cols[known].astype(int)] = exact['DIST_KM'].to_numpy()[known]
+
+    def accessibility(duration, distance):
+        o, d = np.nonzero(~np.isnan(duration) & (duration != 0))
+        chunk = {'FROM_ID': origin_ids[o], 'TO_ID': dest_ids[d],
+                 'DURATION_H': duration[o, d], 'DIST_KM': distance[o, d]}
+        h, km = impedance.accessibility_sweep([chunk], origin_ids, dest_ids, dest_population, [variant])
+        return h[0], km[0]
+
+    exact_h, exact_km = accessibility(duration, distance)
+    exact_cc = None
+    if points is not None:
+        exact_cc = impedance.centrality_indices(points, pd.Series(exact_h, index=origin_ids),
+                                                pd.Series(exact_km, index=origin_ids), region_shape, region_name)
+    report = []
+    for theta in thetas:
+        groups, candidates = origin_groups(tree, origin_xy, theta)
+        rep = np.vstack([DestinationTree.representative_of(g, len(dest_ids)) for g in groups])
+        approx_h, approx_km = accessibility(np.take_along_axis(duration, rep, axis=1),
+                                            np.take_along_axis(distance, rep, axis=1))
+        row = {
+            'theta': theta,
+            'routed_pairs': sum(len(c) for c in candidates) / (len(origin_ids) * len(dest_ids)),
+            'max_rel_error_exp_h_w': np.nanmax(np.abs(approx_h - exact_h) / exact_h),
+            'mean_rel_error_exp_h_w': np.nanmean(np.abs(approx_h - exact_h) / exact_h),
+            'max_rel_error_exp_km_w': np.nanmax(np.abs(approx_km - exact_km) / exact_km),
+            'mean_rel_error_exp_km_w': np.nanmean(np.abs(approx_km - exact_km) / exact_km),
+        }
+        if exact_cc is not None:
+            approx_cc = impedance.centrality_indices(points, pd.Series(approx_h, index=origin_ids),
+                                                     pd.Series(approx_km, index=origin_ids), region_shape, region_name)
+            diff = (approx_cc.set_index('id')['CC_mean'] - exact_cc.set_index('id')['CC_mean']).abs()
+            row['max_abs_error_CC_mean'] = diff.max()
+            row['mean_abs_error_CC_mean'] = diff.mean()
+        report.append(row)
+    return pd.DataFrame(report)
@@ -0,0 +1,112 @@
+# Inverse distance weighting of the centrality points to a raster (alternative to step 7 of script 03)
+# Same model as gstat(nmax = 7, idp = 4) on the raster of terra::rast(ext(region_shape), resolution): every cell
+# centre gets the weighted mean of its nmax nearest points with weights 1 / distance^idp (the value of the point
+# itself if a point lies on the centre), cells with their centre outside the region are NA as after terra::mask.
+# The raster is computed in tiles by a pool of processes with one KD-tree query per tile for all fields, and
+# every tile is written into tiled, compressed GeoTIFFs (one per field) as soon as it is done.
+
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from scipy.spatial import cKDTree
+
+
+# raster of terra::rast(ext, resolution = res): xmin and ymin are kept, columns and rows are rounded and
+# xmax/ymax moved to fit
+def raster_grid(bounds, resolution):
+    xmin, ymin, xmax, ymax = bounds
+    width = max(1, int(round((xmax - xmin) / resolution)))
+    height = max(1, int(round((ymax - ymin) / resolution)))
+    return from_origin(xmin, ymin + height * resolution, resolution, resolution), width, height
+
+
+def tiles(width, height, tile_size):
+    for row in range(0, height, tile_size):
+        for col in range(0, width, tile_size):
+            yield Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+
+
+# --- WORKERS ---
+# KD-tree and values of the points, built once per process
+_tree = None
+_values = None
+_shapes = None
+
+
+def _init_worker(points_xy, values, shapes):
+    global _tree, _values, _shapes
+    _tree = cKDTree(points_xy)
+    _values = values
+    _shapes = shapes
+
+
+# interpolated values (fields x rows x cols) of one window, NaN outside the region
+def idw_window(window, transform, nmax, idp):
+    tile_transform = rasterio.windows.transform(window, transform)
+    inside = ~geometry_mask(_shapes, out_shape=(window.height, window.width), transform=tile_transform)
+    result = np.full((_values.shape[1], window.height, window.width), np.nan, dtype='float32')
+    rows, cols = np.nonzero(inside)
+    if len(rows) == 0:
+        return window, result
+    x = tile_transform.c + (cols + 0.5) * tile_transform.a
+    y = tile_transform.f + (rows + 0.5) * tile_transform.e
+
+    k = min(nmax, len(_values))
+    distance, index = _tree.query(np.column_stack([x, y]), k=k)
+    if k == 1:
+        distance, index = distance[:, None], index[:, None]
+    with np.errstate(divide='ignore'):
+        weight = 1 / distance ** idp
+    # a point on the cell centre gets its own value
+    exact = distance[:, 0] == 0
+    weight[exact] = 0
+    weight[exact, 0] = 1
+
+    neighbours = _values[index]  # cells x k x fields
+    values = np.einsum('ck,ckf->cf', weight, neighbours) / weight.sum(axis=1)[:, None]
+    result[:, rows, cols] = values.T
+    return window, result
+
+
+# interpolate the columns of values (points x fields) and write one GeoTIFF per field
+# shapes: region polygons in the CRS of the points, bounds: extent of the raster (bounds of the region)
+def interpolate(points_xy, values, shapes, bounds, crs, outpaths, resolution=500, nmax=7, idp=4,
+                tile_size=512, processes=None):
+    values = np.asarray(values, dtype=float).reshape(len(points_xy), -1)
+    transform, width, height = raster_grid(bounds, resolution)
+    profile = {
+        'driver': 'GTiff', 'dtype': 'float32', 'count': 1, 'width': width, 'height': height, 'crs': crs,
+        'transform': transform, 'nodata': np.nan, 'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+        'compress': 'deflate', 'predictor': 3, 'BIGTIFF': 'IF_SAFER',
+    }
+    for path in outpaths:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    outputs = [rasterio.open(path + '.tmp.tif', 'w', **profile) for path in outpaths]
+
+    def write(done):
+        for future in done:
+            window, result = future.result()
+            for output, band in zip(outputs, result):
+                output.write(band, 1, window=window)
+
+    # at most two tiles per process are computed or waiting to be written at any time
+    processes = processes or os.cpu_count()
+    try:
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(points_xy, values, list(shapes))) as pool:
+            running = set()
+            for window in tiles(width, height, tile_size):
+                running.add(pool.submit(idw_window, window, transform, nmax, idp))
+                if len(running) >= 2 * processes:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    write(done)
+            write(wait(running)[0])
+    finally:
+        for output in outputs:
+            output.close()
+    for path in outpaths:
+        os.replace(path + '.tmp.tif', path)
+    return width, height
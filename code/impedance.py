@@ -0,0 +1,248 @@
+# Vectorised impedance functions and population weighting (steps 2-3 of 03_impedance+weighting_50perc.R)
+# The OD matrix is streamed in chunks once and any number of decay parameter sets is evaluated per chunk with
+# broadcasting; decay-weighted population is summed per origin with np.bincount instead of a join + group_by.
+
+import glob
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy import sparse
+
+# --- DECAY PARAMETERS ---
+# values from https://doi.org/10.1016/j.jtrangeo.2024.104061, as in script 03
+# every decay function is written as power exponential exp(-b1 * x^b2), negative exponential exp(-a * x) is b2 = 1
+powerexp_paper = {
+    'name': 'powerexp',
+    'h': [(0.019, 1.340)],                    # drive (h)
+    'km': [(1.174, 0.749), (0.333, 0.871)],   # walk, bike (km) -> mean for short distance weighting
+}
+negexp_paper = {
+    'name': 'negexp',
+    'h': [(0.055, 1)],
+    'km': [(1.080, 1), (0.276, 1)],
+}
+
+
+def powerexp(b1, b2, x):
+    return np.exp(-b1 * x ** b2)
+
+
+# decay functions of all variants stacked for broadcasting: parameters (F,) and averaging matrix (K, F) that
+# turns the function values into the mean per variant (e.g. mean of walking and cycling)
+def stack_functions(variants, key):
+    params = [p for v in variants for p in v[key]]
+    average = np.zeros((len(variants), len(params)))
+    f = 0
+    for k, v in enumerate(variants):
+        average[k, f:f + len(v[key])] = 1 / len(v[key])
+        f += len(v[key])
+    b1, b2 = np.array(params, dtype=float).T
+    return b1[:, None], b2[:, None], average
+
+
+# lookup array id -> value, so matrix ids are mapped without a join (ids missing in the table get `fill`)
+def id_lookup(ids, values, max_id, fill=0):
+    lookup = np.full(max(max_id, int(ids.max(initial=0))) + 1, fill, dtype=np.asarray(values).dtype)
+    lookup[ids] = values
+    return lookup
+
+
+# --- MATRIX CHUNKS ---
+# chunks with the columns FROM_ID, TO_ID, DURATION_H, DIST_KM from the matrix store or the csv files in Matrizen/
+def iter_matrix_chunks(folder, region_name, matrix_format='csv', files_per_chunk=500):
+    if matrix_format == 'arrow':
+        import matrix_store
+        for batch in matrix_store.iter_batches(os.path.join(folder, 'matrix'), region_name):
+            yield {name: batch.column(name).to_numpy(zero_copy_only=False) for name in batch.schema.names}
+        return
+    dtypes = {'FROM_ID': 'int32', 'TO_ID': 'int32', 'DURATION_H': 'float32', 'DIST_KM': 'float32'}
+    merged = os.path.join(folder, 'matrizen_merge.csv')
+    if os.path.exists(merged):
+        for df in pd.read_csv(merged, usecols=list(dtypes), dtype=dtypes, chunksize=5_000_000):
+            yield {name: df[name].to_numpy() for name in dtypes}
+        return
+    files = sorted(glob.glob(os.path.join(folder, 'Matrizen', 'matrix_*.csv')))
+    for start in range(0, len(files), files_per_chunk):
+        df = pd.concat([pd.read_csv(f, usecols=list(dtypes), dtype=dtypes) for f in files[start:start + files_per_chunk]],
+                       ignore_index=True)
+        yield {name: df[name].to_numpy() for name in dtypes}
+
+
+# --- SWEEP ---
+# decay-weighted reachable population per origin for K variants in one pass over the matrix
+# returns arrays exp_h_w and exp_km_w with shape K x origins (in the order of origin_ids)
+def accessibility_sweep(chunks, origin_ids, dest_ids, dest_population, variants):
+    b1_h, b2_h, average_h = stack_functions(variants, 'h')
+    b1_km, b2_km, average_km = stack_functions(variants, 'km')
+    n_origins, n_variants = len(origin_ids), len(variants)
+    exp_h_w = np.zeros(n_variants * n_origins)
+    exp_km_w = np.zeros(n_variants * n_origins)
+    rows = np.zeros(n_origins)
+    origin_index = None
+
+    for chunk in chunks:
+        if origin_index is None:
+            max_id = int(max(origin_ids.max(), dest_ids.max()))
+            origin_index = id_lookup(origin_ids, np.arange(n_origins), max_id, fill=-1)
+            population = id_lookup(dest_ids, np.asarray(dest_population, dtype=float), max_id)
+
+        from_id, to_id = chunk['FROM_ID'], chunk['TO_ID']
+        duration, distance = chunk['DURATION_H'].astype(float), chunk['DIST_KM'].astype(float)
+        # same rows as in script 03: no pairs with duration 0 (origin itself) or without route
+        keep = (duration != 0) & ~np.isnan(duration) & (from_id < len(origin_index)) & (to_id < len(population))
+        keep[keep] = origin_index[from_id[keep]] >= 0
+        o = origin_index[from_id[keep]]
+        ew = population[to_id[keep]]
+        duration, distance = duration[keep], distance[keep]
+
+        # K x rows weights, mean over the functions of each variant
+        weight_h = average_h @ powerexp(b1_h, b2_h, duration[None, :]) * ew
+        weight_km = average_km @ powerexp(b1_km, b2_km, distance[None, :]) * ew
+        weight_km[np.isnan(weight_km)] = 0
+
+        # scatter-add into the flat K x origins result
+        rows += np.bincount(o, minlength=n_origins)
+        index = (np.arange(n_variants)[:, None] * n_origins + o[None, :]).ravel()
+        exp_h_w += np.bincount(index, weights=weight_h.ravel(), minlength=n_variants * n_origins)
+        exp_km_w += np.bincount(index, weights=weight_km.ravel(), minlength=n_variants * n_origins)
+
+    # origins without any matrix row get no value, like in the group_by of script 03
+    exp_h_w, exp_km_w = exp_h_w.reshape(n_variants, n_origins), exp_km_w.reshape(n_variants, n_origins)
+    exp_h_w[:, rows == 0] = np.nan
+    exp_km_w[:, rows == 0] = np.nan
+    return exp_h_w, exp_km_w
+
+
+# sweep for one region folder of script 02, returns a long table FROM_ID, variant, exp_h_w, exp_km_w
+def region_sweep(folder, region_name, variants, matrix_format='csv', grid_space=1000, pct=50):
+    origins = gpd.read_file(os.path.join(folder, f'{region_name}_10perc_ew.gpkg'), ignore_geometry=True)
+    destins = gpd.read_file(os.path.join(folder, f'destination_points_{grid_space}mgrid_{region_name}{pct}perc.gpkg'),
+                            ignore_geometry=True)
+    origin_ids = origins['id'].astype('int64').to_numpy()
+    exp_h_w, exp_km_w = accessibility_sweep(iter_matrix_chunks(folder, region_name, matrix_format), origin_ids,
+                                            destins['id'].astype('int64').to_numpy(), destins['EW_10'].fillna(0),
+                                            variants)
+    return pd.DataFrame({
+        'FROM_ID': np.tile(origin_ids, len(variants)),
+        'variant': np.repeat([v['name'] for v in variants], len(origin_ids)),
+        'exp_h_w': exp_h_w.ravel(),
+        'exp_km_w': exp_km_w.ravel(),
+    })
+
+
+# --- DECAY OPERATOR ---
+# The decay weights do not depend on population: with the sparse origins x destinations matrix W of weights,
+# the reachable population for any population vector p of the destinations is W @ p.
+# Note: only points routed as destinations (EW_10 >= 5 in script 02) can carry population.
+
+# sparse decay weights of one parameter set per mode ('h' for driving time, 'km' for distance)
+def build_operator(chunks, origin_ids, dest_ids, variant):
+    b1_h, b2_h, average_h = stack_functions([variant], 'h')
+    b1_km, b2_km, average_km = stack_functions([variant], 'km')
+    parts = {'h': [], 'km': []}
+    origin_index = dest_index = None
+    for chunk in chunks:
+        if origin_index is None:
+            max_id = int(max(origin_ids.max(), dest_ids.max()))
+            origin_index = id_lookup(origin_ids, np.arange(len(origin_ids)), max_id, fill=-1)
+            dest_index = id_lookup(dest_ids, np.arange(len(dest_ids)), max_id, fill=-1)
+
+        from_id, to_id = chunk['FROM_ID'], chunk['TO_ID']
+        duration, distance = chunk['DURATION_H'].astype(float), chunk['DIST_KM'].astype(float)
+        keep = (duration != 0) & ~np.isnan(duration) & (from_id < len(origin_index)) & (to_id < len(dest_index))
+        keep[keep] = (origin_index[from_id[keep]] >= 0) & (dest_index[to_id[keep]] >= 0)
+        o, d = origin_index[from_id[keep]], dest_index[to_id[keep]]
+        parts['h'].append((o, d, (average_h @ powerexp(b1_h, b2_h, duration[keep][None, :]))[0]))
+        parts['km'].append((o, d, np.nan_to_num((average_km @ powerexp(b1_km, b2_km, distance[keep][None, :]))[0])))
+
+    shape = (len(origin_ids), len(dest_ids))
+    operators = {}
+    for mode, mode_parts in parts.items():
+        o, d, w = (np.concatenate(x) for x in zip(*mode_parts)) if mode_parts else ([], [], [])
+        operators[mode] = sparse.csr_matrix((np.asarray(w, dtype='float32'), (o, d)), shape=shape)
+    return operators
+
+
+def operator_path(folder, region_name, mode):
+    return os.path.join(folder, f'decay_{mode}_{region_name}.npz')
+
+
+def save_operator(path, operator, origin_ids, dest_ids):
+    np.savez(path, data=operator.data, indices=operator.indices, indptr=operator.indptr, shape=operator.shape,
+             origin_ids=origin_ids, dest_ids=dest_ids)
+
+
+def load_operator(path):
+    with np.load(path) as f:
+        operator = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+        return operator, f['origin_ids'], f['dest_ids']
+
+
+# build the operators of a region once from its matrix and keep them in the region folder
+def region_operators(folder, region_name, variant, matrix_format='csv', grid_space=1000, pct=50):
+    paths = {mode: operator_path(folder, region_name, mode) for mode in ('h', 'km')}
+    if not all(os.path.exists(p) for p in paths.values()):
+        origins = gpd.read_file(os.path.join(folder, f'{region_name}_10perc_ew.gpkg'), ignore_geometry=True)
+        destins = gpd.read_file(os.path.join(folder, f'destination_points_{grid_space}mgrid_{region_name}{pct}perc.gpkg'),
+                                ignore_geometry=True)
+        origin_ids = origins['id'].astype('int64').to_numpy()
+        dest_ids = destins['id'].astype('int64').to_numpy()
+        operators = build_operator(iter_matrix_chunks(folder, region_name, matrix_format), origin_ids, dest_ids, variant)
+        for mode, path in paths.items():
+            save_operator(path, operators[mode], origin_ids, dest_ids)
+    return {mode: load_operator(path) for mode, path in paths.items()}
+
+
+# reachable population per origin for a population given per destination id (pandas Series id -> EW_10)
+def apply_operator(operator, origin_ids, dest_ids, population):
+    p = population.reindex(dest_ids).fillna(0).to_numpy(dtype=float)
+    values = operator @ p
+    # origins without any routed destination get no value, like in the group_by of script 03
+    values[np.diff(operator.indptr) == 0] = np.nan
+    return pd.Series(values, index=origin_ids)
+
+
+# --- CENTRALITY INDICES ---
+# steps 3-5 of script 03: standardise in the buffer, crop to the region, rescale to 0-1 and average
+# with weights (cell area of an adaptive grid, see road_points.py) the mean and standard deviation are weighted,
+# equal weights give the same values as without
+def scale(x, weights=None):
+    if weights is None:
+        return (x - np.nanmean(x)) / np.nanstd(x, ddof=1)
+    valid = ~np.isnan(x) & ~np.isnan(weights)
+    w, v = weights[valid], x[valid]
+    mean = np.sum(w * v) / np.sum(w)
+    var = np.sum(w * (v - mean) ** 2) / np.sum(w) * valid.sum() / (valid.sum() - 1)
+    return (x - mean) / np.sqrt(var)
+
+
+def rescale(x):
+    return (x - np.nanmin(x)) / (np.nanmax(x) - np.nanmin(x))
+
+
+def centrality_indices(points, exp_h_w, exp_km_w, region_shape, region_name):
+    points = points.copy()
+    weights = points['cell_m'].to_numpy(dtype=float) ** 2 if 'cell_m' in points else None
+    points['exp_h_w_s'] = scale(points['id'].map(exp_h_w).to_numpy(dtype=float), weights)
+    points['exp_km_w_s'] = scale(points['id'].map(exp_km_w).to_numpy(dtype=float), weights)
+    cropped = points[points.intersects(region_shape.to_crs(points.crs).union_all())].copy()
+    cropped['CC_mean_car'] = rescale(cropped['exp_h_w_s'])
+    cropped['CC_mean_shortdist'] = rescale(cropped['exp_km_w_s'])
+    cropped['CC_mean'] = rescale((cropped['CC_mean_car'] + cropped['CC_mean_shortdist']) / 2)
+    cropped['Gem_layer'] = region_name
+    cropped = cropped.dropna(subset=['CC_mean'])
+    return cropped[['id', 'EW_10', 'CC_mean', 'CC_mean_car', 'CC_mean_shortdist', 'Gem_layer', 'geometry']]
+
+
+# centrality of several regions in one layer (README: maximum in overlapping areas); a point in more than one
+# region (same global id `key`, see od_store.py) gets the maximum of every index and the region with the highest
+# CC_mean as Gem_layer, n_regions counts the regions of the point
+def combine_max(centralities, key='gid'):
+    indices = ['CC_mean', 'CC_mean_car', 'CC_mean_shortdist']
+    points = pd.concat(centralities, ignore_index=True)
+    combined = points.sort_values('CC_mean', ascending=False, kind='stable').drop_duplicates(key)
+    combined = combined.drop(columns=indices).join(points.groupby(key)[indices].max(), on=key)
+    combined['n_regions'] = combined[key].map(points[key].value_counts())
+    combined = combined.sort_index()[list(points.columns) + ['n_regions']]
+    return gpd.GeoDataFrame(combined, geometry='geometry', crs=centralities[0].crs)
@@ -0,0 +1,254 @@
+# Offline routing on the filtered OSM highways of script 01 as alternative to ORS
+# Compiles the road lines into a CSR graph with car travel time and length per edge, snaps the grid points to
+# graph nodes and computes the origin x destination matrix with Dijkstra on all cores
+# (used by 02_centrality_50Prozent.py with matrix_engine = 'local')
+
+import os
+import re
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import geopandas as gpd
+import shapely
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra, connected_components
+from scipy.spatial import cKDTree
+
+# --- CAR SPEEDS ---
+# km/h per road type if the way has no usable maxspeed tag (similar to the ORS driving-car defaults)
+default_speed = {
+    'motorway': 100, 'motorway_link': 60,
+    'trunk': 85, 'trunk_link': 60,
+    'primary': 65, 'primary_link': 50,
+    'secondary': 60, 'secondary_link': 50,
+    'tertiary': 50, 'tertiary_link': 40,
+    'unclassified': 30, 'residential': 30,
+    'living_street': 10, 'service': 15,
+}
+# implicit maxspeed values, e.g. "maxspeed"=>"DE:urban"
+implicit_speed = {'urban': 50, 'rural': 100, 'motorway': 130, 'living_street': 7, 'walk': 7, 'none': 130}
+
+
+# value of a key in the other_tags field of the OSM lines layer, e.g. "access"=>"private"
+def get_tag(other_tags, key):
+    if not isinstance(other_tags, str):
+        return None
+    match = re.search(rf'"{key}"=>"([^"]*)"', other_tags)
+    return match.group(1) if match else None
+
+
+def parse_speed(highway, maxspeed):
+    speed = default_speed.get(highway, 30)
+    if maxspeed:
+        number = re.match(r'\s*(\d+(?:\.\d+)?)\s*(mph)?', maxspeed)
+        if number:
+            speed = float(number.group(1)) * (1.609 if number.group(2) else 1)
+        else:
+            speed = implicit_speed.get(maxspeed.split(':')[-1], speed)
+    return max(speed, 5)
+
+
+# 1 = only in digitising direction, -1 = only against it, 0 = both directions
+def parse_oneway(highway, other_tags):
+    oneway = get_tag(other_tags, 'oneway')
+    if oneway in ('yes', 'true', '1'):
+        return 1
+    if oneway == '-1':
+        return -1
+    if oneway == 'no':
+        return 0
+    if highway in ('motorway', 'motorway_link') or get_tag(other_tags, 'junction') == 'roundabout':
+        return 1
+    return 0
+
+
+# --- GRAPH ---
+# road graph in CSR form: edge u -> v is graph[u, v] = travel time (h), lengths are stored in the same order
+class RoadGraph:
+    def __init__(self, node_xy, indptr, indices, time_h, length_km):
+        self.node_xy = node_xy
+        self.indptr = indptr
+        self.indices = indices
+        self.time_h = time_h
+        self.length_km = length_km
+
+    @property
+    def n_nodes(self):
+        return len(self.node_xy)
+
+    def csr(self):
+        return csr_matrix((self.time_h, self.indices, self.indptr), shape=(self.n_nodes, self.n_nodes))
+
+    # sorted edge keys u * n + v for vectorised lookup of edge lengths
+    def edge_keys(self):
+        rows = np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+        return rows * self.n_nodes + self.indices
+
+    def save(self, path):
+        np.savez(path, node_xy=self.node_xy, indptr=self.indptr, indices=self.indices,
+                 time_h=self.time_h, length_km=self.length_km)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f['node_xy'], f['indptr'], f['indices'], f['time_h'], f['length_km'])
+
+
+# build the graph from the highway lines (metric CRS); line vertices become nodes, shared vertices connect ways
+def build_graph(highways):
+    highways = highways[highways.geometry.notna()].explode(index_parts=False)
+    coords, line = shapely.get_coordinates(highways.geometry.values, return_index=True)
+
+    # consecutive vertices of the same line form an edge
+    same_line = line[1:] == line[:-1]
+    start, end = coords[:-1][same_line], coords[1:][same_line]
+    way = line[:-1][same_line]
+
+    node_xy, node = np.unique(np.round(coords, 3), axis=0, return_inverse=True)
+    node = node.ravel()
+    u, v = node[:-1][same_line], node[1:][same_line]
+
+    highway = highways['highway'].to_numpy()
+    other_tags = highways['other_tags'].to_numpy() if 'other_tags' in highways else np.full(len(highways), None)
+    speed = np.array([parse_speed(h, get_tag(t, 'maxspeed')) for h, t in zip(highway, other_tags)])
+    oneway = np.array([parse_oneway(h, t) for h, t in zip(highway, other_tags)])
+
+    length_km = np.hypot(*(end - start).T) / 1000
+    time_h = length_km / speed[way]
+    forward = oneway[way] >= 0
+    backward = oneway[way] <= 0
+    u, v, time_h, length_km = (np.concatenate([u[forward], v[backward]]), np.concatenate([v[forward], u[backward]]),
+                               np.concatenate([time_h[forward], time_h[backward]]),
+                               np.concatenate([length_km[forward], length_km[backward]]))
+
+    # drop loops of duplicated vertices and keep the fastest of parallel edges
+    keep = u != v
+    u, v, time_h, length_km = u[keep], v[keep], time_h[keep], length_km[keep]
+    n = len(node_xy)
+    key = u * n + v
+    order = np.lexsort((time_h, key))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = key[order][1:] != key[order][:-1]
+    order = order[first]
+    u, v, time_h, length_km = u[order], v[order], time_h[order], length_km[order]
+
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(u, minlength=n))])
+    # scipy drops explicit zeros, so every edge gets a minimal travel time
+    return RoadGraph(node_xy, indptr, v.astype('int64'), np.maximum(time_h, 1e-9), length_km)
+
+
+# load compiled graph or build it from the highway layer (OSM data in EPSG:4326) in the metric working CRS
+def load_graph(highways_path, crs):
+    graph_path = os.path.splitext(highways_path)[0] + f'_graph_{crs.to_epsg()}.npz'
+    if os.path.exists(graph_path) and os.path.getmtime(graph_path) >= os.path.getmtime(highways_path):
+        return RoadGraph.load(graph_path)
+    logging.info("Compile road graph...")
+    graph = build_graph(gpd.read_file(highways_path).to_crs(crs))
+    graph.save(graph_path)
+    return graph
+
+
+# snap points to the nearest node of the largest strongly connected part of the network, so every snapped point
+# can reach every other one; returns node index and snap distance (m)
+def snap_points(graph, xy):
+    _, component = connected_components(graph.csr(), directed=True, connection='strong')
+    main = np.flatnonzero(component == np.bincount(component).argmax())
+    snap_distance, nearest = cKDTree(graph.node_xy[main]).query(xy)
+    return main[nearest], snap_distance
+
+
+# --- DIJKSTRA ---
+_graph = {}
+
+
+def _init_worker(graph, dest_nodes):
+    _graph['csr'] = graph.csr()
+    _graph['keys'] = graph.edge_keys()
+    _graph['length_km'] = graph.length_km
+    _graph['n'] = graph.n_nodes
+    _graph['dest_nodes'] = dest_nodes
+
+
+# length of the fastest path to every node, summed along the predecessor tree by pointer jumping
+def _tree_length(pred):
+    n = _graph['n']
+    nodes = np.arange(n)
+    reached = pred >= 0
+    length = np.zeros(n)
+    edge = np.searchsorted(_graph['keys'], pred[reached] * n + nodes[reached])
+    length[reached] = _graph['length_km'][edge]
+    parent = np.where(reached, pred, nodes)
+    while True:
+        grandparent = parent[parent]
+        if (grandparent == parent).all():
+            return length
+        length = length + length[parent] * (parent != nodes)
+        parent = grandparent
+
+
+def _route_chunk(origin_nodes):
+    time_h, pred = dijkstra(_graph['csr'], directed=True, indices=origin_nodes, return_predecessors=True)
+    dest_nodes = _graph['dest_nodes']
+    duration_h = time_h[:, dest_nodes]
+    dist_km = np.vstack([_tree_length(p)[dest_nodes] for p in pred])
+    dist_km[np.isinf(duration_h)] = np.nan
+    duration_h[np.isinf(duration_h)] = np.nan
+    return duration_h, dist_km
+
+
+def _write_results(results, chunks, origin_ids, dest_ids, reachable, writer, metrics=None):
+    if metrics is not None:
+        metrics.progress(0, len(origin_ids), force=True)
+    for i, (c, (duration_h, dist_km)) in enumerate(zip(chunks, results)):
+        duration_h[:, ~reachable] = np.nan
+        dist_km[:, ~reachable] = np.nan
+        writer.write(origin_ids[c], dest_ids, duration_h, dist_km)
+        if (i + 1) % 50 == 0 or i + 1 == len(chunks):
+            logging.info(f"> {min(c.stop, len(origin_ids))}/{len(origin_ids)} origins")
+        if metrics is not None:
+            metrics.progress(min(c.stop, len(origin_ids)), len(origin_ids))
+
+
+def read_points(path, id_field='id'):
+    points = gpd.read_file(path)
+    points = points.set_geometry(points.geometry.representative_point())
+    return points[id_field].astype('int64').to_numpy(), np.column_stack([points.geometry.x, points.geometry.y]), points.crs
+
+
+# compute matrices from all origins to all destinations and return ids of origins that failed
+# processes = None uses all cores; set to 1 where worker processes can not be started (e.g. QGIS console on Windows);
+# with metrics (run_metrics.RunMetrics) the progress and ETA are recorded
+def run_matrix(highways_path, origins_path, destinations_path, writer, max_snap=350, processes=None, chunk_size=8,
+               metrics=None):
+    origin_ids, origin_xy, crs = read_points(origins_path)
+    dest_ids, dest_xy, _ = read_points(destinations_path)
+    graph = load_graph(highways_path, crs)
+    logging.info(f"Road graph with {graph.n_nodes} nodes and {len(graph.indices)} edges")
+
+    nodes, snap = snap_points(graph, np.concatenate([origin_xy, dest_xy]))
+    origin_nodes, dest_nodes = nodes[:len(origin_ids)], nodes[len(origin_ids):]
+    origin_snap, dest_snap = snap[:len(origin_ids)], snap[len(origin_ids):]
+
+    # points too far from the routable network are not routed (like the ORS snapping radius)
+    err = origin_ids[origin_snap > max_snap].tolist()
+    todo = (origin_snap <= max_snap) & np.array([not writer.exists(i) for i in origin_ids], dtype=bool)
+    origin_ids, origin_nodes = origin_ids[todo], origin_nodes[todo]
+    dest_nodes = np.where(dest_snap <= max_snap, dest_nodes, -1)
+    if (dest_nodes < 0).any():
+        logging.info(f"{int((dest_nodes < 0).sum())} destinations further than {max_snap} m from the road network")
+
+    chunks = [slice(i, i + chunk_size) for i in range(0, len(origin_ids), chunk_size)]
+    logging.info(f"{len(origin_ids)} origins x {len(dest_ids)} destinations in {len(chunks)} chunks")
+
+    reachable = dest_nodes >= 0
+    initargs = (graph, np.where(reachable, dest_nodes, 0))
+    if processes == 1:
+        _init_worker(*initargs)
+        _write_results(map(_route_chunk, [origin_nodes[c] for c in chunks]), chunks, origin_ids, dest_ids, reachable, writer,
+                       metrics)
+    else:
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=initargs) as pool:
+            results = pool.map(_route_chunk, [origin_nodes[c] for c in chunks])
+            _write_results(results, chunks, origin_ids, dest_ids, reachable, writer, metrics)
+    writer.close()
+    return err
@@ -0,0 +1,159 @@
+# Output of distance/duration matrices in the FROM_ID/TO_ID/DURATION_H/DIST_KM format read by script 03
+# Writers are shared by the matrix engines in ors_matrix.py and local_routing.py:
+# - CsvMatrixWriter: one csv per origin in Matrizen/ (as written by ORS Tools)
+# - ArrowMatrixWriter: columnar store with one partition per region (int32 ids, float32 duration/distance),
+#   stored as uncompressed Arrow IPC files that are memory-mapped by the readers in Python and R
+
+import os
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+matrix_schema = pa.schema([
+    ('FROM_ID', pa.int32()),
+    ('TO_ID', pa.int32()),
+    ('DURATION_H', pa.float32()),
+    ('DIST_KM', pa.float32()),
+])
+
+
+# writes one csv per origin into Matrizen/ in the format of ORS Tools, so script 03 reads them unchanged
+class CsvMatrixWriter:
+    def __init__(self, matrix_folder, region_name, grid_space):
+        self.matrix_folder = matrix_folder
+        self.region_name = region_name
+        self.grid_space = grid_space
+
+    def path(self, point_id):
+        return os.path.join(self.matrix_folder, f'matrix_{self.region_name}_{self.grid_space}mgrid_{point_id}.csv')
+
+    # same check as in the ORS Tools loop: skip existing files if they are not empty (minimum size)
+    def exists(self, point_id):
+        path = self.path(point_id)
+        return os.path.isfile(path) and os.stat(path).st_size > 100
+
+    def write(self, from_ids, to_ids, duration_h, dist_km):
+        for i, from_id in enumerate(from_ids):
+            matrix_out = self.path(from_id)
+            df = pd.DataFrame({
+                'FROM_ID': from_id,
+                'TO_ID': to_ids,
+                'DURATION_H': duration_h[i],
+                'DIST_KM': dist_km[i],
+            })
+            # write to temporary file first so an interrupted run never leaves a half written matrix
+            df.to_csv(matrix_out + '.tmp', index=False)
+            os.replace(matrix_out + '.tmp', matrix_out)
+
+    def close(self):
+        pass
+
+
+# folder of one region in the store, e.g. output/Aachen_50perc_25_08_04/matrix/region=Aachen
+def partition_path(store, region_name):
+    return os.path.join(store, f'region={region_name}')
+
+
+def part_files(store, region_name):
+    return sorted(glob.glob(os.path.join(partition_path(store, region_name), 'part-*.arrow')))
+
+
+# appends the rows of whole origins to the region partition; rows are buffered and written as a new part file
+# every `batch_rows` rows, so an interrupted run loses at most the origins of the last unwritten batch
+class ArrowMatrixWriter:
+    def __init__(self, store, region_name, batch_rows=5_000_000):
+        self.folder = partition_path(store, region_name)
+        os.makedirs(self.folder, exist_ok=True)
+        self.batch_rows = batch_rows
+        self.batches = []
+        self.rows = 0
+        self.n_parts = len(part_files(store, region_name))
+        self.done = set()
+        for path in part_files(store, region_name):
+            with pa.memory_map(path) as source:
+                from_id = pa.ipc.open_file(source).read_all().column('FROM_ID').to_numpy()
+                self.done.update(np.unique(from_id).tolist())
+
+    def exists(self, point_id):
+        return int(point_id) in self.done
+
+    def write(self, from_ids, to_ids, duration_h, dist_km):
+        if len(from_ids) == 0:
+            return
+        duration_h = np.asarray(duration_h, dtype='float32').ravel()
+        dist_km = np.asarray(dist_km, dtype='float32').ravel()
+        # unreachable pairs are stored as null (NA in R)
+        self.batches.append(pa.record_batch([
+            pa.array(np.repeat(np.asarray(from_ids, dtype='int32'), len(to_ids))),
+            pa.array(np.tile(np.asarray(to_ids, dtype='int32'), len(from_ids))),
+            pa.array(duration_h, mask=np.isnan(duration_h)),
+            pa.array(dist_km, mask=np.isnan(dist_km)),
+        ], schema=matrix_schema))
+        self.rows += len(duration_h)
+        if self.rows >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.batches:
+            return
+        path = os.path.join(self.folder, f'part-{self.n_parts:05d}.arrow')
+        with pa.OSFile(path + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, matrix_schema) as ipc:
+                for batch in self.batches:
+                    ipc.write_batch(batch)
+        os.replace(path + '.tmp', path)
+        for batch in self.batches:
+            self.done.update(np.unique(batch.column('FROM_ID').to_numpy()).tolist())
+        self.n_parts += 1
+        self.batches = []
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+
+
+# --- READERS ---
+# record batches of a region partition, memory-mapped without copying
+def iter_batches(store, region_name):
+    for path in part_files(store, region_name):
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+
+
+# whole matrix of a region as arrow table (to_pandas() for a data frame)
+def read_matrix(store, region_name):
+    batches = list(iter_batches(store, region_name))
+    return pa.Table.from_batches(batches, schema=matrix_schema)
+
+# In R the store is read with the arrow package (see 03_impedance+weighting_50perc.R):
+#   arrow::open_dataset(file.path(folder, "matrix"), format = "arrow") %>% filter(region == !!region)
+
+
+# --- CONVERTER ---
+# one-shot conversion of an existing Matrizen/ folder with one csv per origin into the store
+def convert_csv_folder(matrix_folder, store, region_name, files_per_batch=500):
+    writer = ArrowMatrixWriter(store, region_name)
+    files = sorted(glob.glob(os.path.join(matrix_folder, 'matrix_*.csv')))
+    dtypes = {'FROM_ID': 'int32', 'TO_ID': 'int32', 'DURATION_H': 'float32', 'DIST_KM': 'float32'}
+    for start in range(0, len(files), files_per_batch):
+        df = pd.concat([pd.read_csv(f, usecols=list(dtypes), dtype=dtypes) for f in files[start:start + files_per_batch]],
+                       ignore_index=True)
+        df = df[~df['FROM_ID'].isin(writer.done)]
+        for from_id, rows in df.groupby('FROM_ID', sort=False):
+            writer.write([from_id], rows['TO_ID'].to_numpy(), rows['DURATION_H'].to_numpy(), rows['DIST_KM'].to_numpy())
+        print(f"Converted {min(start + files_per_batch, len(files))}/{len(files)} files")
+    writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert a Matrizen/ folder of per-origin csv files into the matrix store")
+    parser.add_argument('matrix_folder', help="folder with matrix_*.csv files, e.g. output/Aachen_50perc_25_08_04/Matrizen")
+    parser.add_argument('region', help="region name of the partition")
+    parser.add_argument('--store', help="store folder, default: folder 'matrix' next to matrix_folder")
+    args = parser.parse_args()
+    store = args.store or os.path.join(os.path.dirname(os.path.normpath(args.matrix_folder)), 'matrix')
+    convert_csv_folder(args.matrix_folder, store, args.region)
@@ -0,0 +1,177 @@
+# Local stand-in for the ORS matrix and snap endpoints (benchmarks, tests of the request scheduling without ORS)
+# Answers /v2/matrix/{profile} with straight-line distances times a detour factor and durations at a fixed speed.
+# Latency grows with the number of routes of a request, at most `workers` requests are answered at the same time
+# (the thread pool of ORS), further requests wait. Failures of a real instance are injected:
+# - 6020 "Search exceeds the limit of visited nodes" for requests above `visited_limit` routes that span more than
+#   `visited_span_km`, and at random with `fail_rate` for requests with more than one route
+# - 2010 "Could not find routable point" for a fixed share of the locations (`unroutable_share`)
+# - 2004 "Request parameters exceed the server configuration limits" above `maximum_routes` routes
+# - dropped connections (no answer at all) for matrix requests with an origin out of a fixed share (`drop_share`)
+# /v2/status reports `graph_build_date` for the usual profiles like ORS 8 (key of the routability cache).
+# /stats returns the number of requests, routes, errors and bytes received and sent since the start.
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+import urllib.request
+import numpy as np
+from aiohttp import web
+
+options = {
+    'latency_ms': 20.0,  # per request
+    'route_us': 5.0,  # per origin-destination pair
+    'workers': 4,
+    'visited_limit': 2500,
+    'visited_span_km': 30.0,
+    'maximum_routes': 0,  # matrix.maximum_routes of the server, 0: no limit
+    'drop_share': 0.0,
+    'fail_rate': 0.0,
+    'unroutable_share': 0.0,
+    'speed_kmh': 50.0,
+    'detour': 1.3,
+    'seed': 0,
+    'graph_build_date': '2025-08-01T12:00:00Z',
+}
+
+
+# locations ORS can not snap: the same locations in every request (hash of the rounded coordinates)
+def unroutable(lonlat, share, salt=0):
+    if share <= 0:
+        return np.zeros(len(lonlat), dtype=bool)
+    key = np.round(np.asarray(lonlat) * 1e5).astype('int64')
+    h = (key[:, 0] * 0x9E3779B1 + key[:, 1] * 0x85EBCA77 + salt) & 0xFFFFFFFF
+    return h % 10000 < share * 10000
+
+
+# origins whose requests are dropped, independent of the unroutable ones
+def dropped(lonlat, share):
+    return unroutable(lonlat, share, salt=0x27D4EB2F)
+
+
+def distance_m(a, b):
+    lat0 = np.radians(np.concatenate([a, b])[:, 1].mean())
+    dx = (a[:, None, 0] - b[None, :, 0]) * np.cos(lat0) * 111320
+    dy = (a[:, None, 1] - b[None, :, 1]) * 110540
+    return np.hypot(dx, dy)
+
+
+def error(status, code, message):
+    return web.json_response({'error': {'code': code, 'message': message}}, status=status)
+
+
+def make_app(**settings):
+    settings = {**options, **settings}
+    rng = np.random.default_rng(settings['seed'])
+    stats = {'requests': 0, 'routes': 0, 'errors_6020': 0, 'errors_2010': 0, 'errors_2004': 0, 'dropped': 0,
+             'snap_requests': 0, 'bytes_in': 0, 'bytes_out': 0, 'max_waiting': 0, 'busy_s': 0.0}
+    state = {'slots': None, 'waiting': 0}
+
+    async def answer(request, compute):
+        if state['slots'] is None:
+            state['slots'] = asyncio.Semaphore(settings['workers'])
+        body = await request.read()
+        stats['bytes_in'] += len(body)
+        state['waiting'] += 1
+        stats['max_waiting'] = max(stats['max_waiting'], state['waiting'])
+        async with state['slots']:
+            state['waiting'] -= 1
+            start = time.perf_counter()
+            response, delay = compute(json.loads(body))
+            await asyncio.sleep(delay)
+            stats['busy_s'] += time.perf_counter() - start
+        if response is None:
+            # connection lost, e.g. the instance restarted
+            request.transport.close()
+            return web.Response()
+        stats['bytes_out'] += len(response.body)
+        return response
+
+    def matrix(body):
+        locations = np.array(body['locations'], dtype=float)
+        sources = locations[body.get('sources', range(len(locations)))]
+        destinations = locations[body.get('destinations', range(len(locations)))]
+        routes = len(sources) * len(destinations)
+        stats['requests'] += 1
+        delay = settings['latency_ms'] / 1000
+        if dropped(sources, settings['drop_share']).any():
+            stats['dropped'] += 1
+            return None, delay
+        if 0 < settings['maximum_routes'] < routes:
+            stats['errors_2004'] += 1
+            return error(400, 2004, f"Request parameters exceed the server configuration limits. Only a total of "
+                                    f"{settings['maximum_routes']} routes are allowed."), delay
+        bad = np.flatnonzero(unroutable(locations, settings['unroutable_share']))
+        if len(bad):
+            stats['errors_2010'] += 1
+            return error(404, 2010, f"Could not find routable point within a radius of 350.0 meters of specified "
+                                    f"coordinate {bad[0]}: {locations[bad[0], 0]} {locations[bad[0], 1]}."), delay
+        span = distance_m(locations.min(axis=0)[None], locations.max(axis=0)[None])[0, 0] / 1000
+        if routes > 1 and ((routes > settings['visited_limit'] and span > settings['visited_span_km'])
+                           or rng.random() < settings['fail_rate']):
+            stats['errors_6020'] += 1
+            return error(500, 6020, "Search exceeds the limit of visited nodes."), delay
+
+        stats['routes'] += routes
+        distances = distance_m(sources, destinations) * settings['detour']
+        durations = distances / (settings['speed_kmh'] / 3.6)
+        result = {'durations': np.round(durations, 2).tolist(), 'distances': np.round(distances, 2).tolist()}
+        return web.json_response(result), delay + routes * settings['route_us'] / 1e6
+
+    def snap(body):
+        locations = np.array(body['locations'], dtype=float)
+        stats['snap_requests'] += 1
+        bad = unroutable(locations, settings['unroutable_share'])
+        result = [None if b else {'location': loc.tolist(), 'snapped_distance': 0.0} for loc, b in zip(locations, bad)]
+        return web.json_response({'locations': result}), settings['latency_ms'] / 1000
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    async def get_status(request):
+        profiles = {name: {'encoder_name': name, 'graph_build_date': settings['graph_build_date']}
+                    for name in ('driving-car', 'cycling-regular', 'foot-walking')}
+        return web.json_response({'engine': {'version': 'mock'}, 'profiles': profiles})
+
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_post('/v2/matrix/{profile}', lambda request: answer(request, matrix))
+    app.router.add_post('/v2/snap/{profile}', lambda request: answer(request, snap))
+    app.router.add_get('/v2/status', get_status)
+    app.router.add_get('/stats', get_stats)
+    return app
+
+
+def serve(port, settings):
+    web.run_app(make_app(**settings), host='127.0.0.1', port=port, print=None)
+
+
+# start the server in its own process, returns the process and the url to use as ors_url
+def start(port=8085, **settings):
+    process = multiprocessing.get_context('spawn').Process(target=serve, args=(port, settings), daemon=True)
+    process.start()
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            stats(url)
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"Mock ORS server did not start on port {port}")
+
+
+def stats(url):
+    with urllib.request.urlopen(f'{url}/stats', timeout=5) as response:
+        return json.loads(response.read())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for the ORS matrix endpoint")
+    parser.add_argument('--port', type=int, default=8085)
+    for name, default in options.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = vars(parser.parse_args())
+    port = args.pop('port')
+    print(f"Mock ORS on http://127.0.0.1:{port}, e.g. ors_url = 'http://127.0.0.1:{port}'")
+    serve(port, args)
@@ -0,0 +1,251 @@
+# Origin-destination pairs shared between regions (matrix_engine = 'ors' in script 02 and 01_02_regions_parallel.py)
+# Neighbouring regions with umkreis buffers share many road points. Every point gets a global id derived from its
+# snapped coordinates, so the same road point has the same global id in every region (the region `id` is only
+# unique within a region). Routed pairs are appended to one store keyed by global ids; the matrix job of a region
+# looks up the pairs that are already in the store and only routes the missing ones. The matrices of the regions
+# keep the region ids and the usual FROM_ID/TO_ID/DURATION_H/DIST_KM format, so script 03 is unchanged.
+# Road points of neighbouring regions only coincide if their grids do (road_points.py with align=True).
+# The store is only valid for one ORS instance and profile (one folder per profile).
+
+import os
+import glob
+import time
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+od_schema = pa.schema([
+    ('FROM_GID', pa.int64()),
+    ('TO_GID', pa.int64()),
+    ('DURATION_H', pa.float32()),
+    ('DIST_KM', pa.float32()),
+])
+
+
+# global ids from metric coordinates: x and y rounded to `resolution` (m) packed into one int64
+def global_ids(xy, resolution=0.1):
+    cells = np.round(np.asarray(xy, dtype=float) / resolution).astype('int64')
+    return (cells[:, 0] << 32) | (cells[:, 1] & 0xFFFFFFFF)
+
+
+# deterministic sample of pct % of the points by global id: a point that lies in several regions is either in
+# the sample of all of them or of none (a random sample per region would route different points in the overlap)
+def location_sample(gids, pct):
+    # multiplicative hash (Fibonacci hashing) spreads neighbouring ids evenly
+    hashed = (np.asarray(gids).astype('uint64') * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(40)
+    return hashed % np.uint64(10000) < np.uint64(round(pct * 100))
+
+
+# store of routed pairs in Arrow IPC files; every writer (region, process) adds its own part files, so regions
+# running in parallel never write to the same file. New pairs are written at least every flush_seconds, so
+# regions running at the same time find each other's pairs (SharedWriter.update before every block).
+class OdStore:
+    def __init__(self, folder, batch_rows=2_000_000, flush_seconds=30):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.batches = []
+        self.rows = 0
+        self.flushed = time.monotonic()
+        self.written = set()  # part files flushed by this store, SharedWriter does not read its own pairs back
+
+    def part_files(self):
+        return sorted(glob.glob(os.path.join(self.folder, 'part-*.arrow')))
+
+    # known pairs between the given origins and destinations (global ids) as DataFrame, from all part files or
+    # the given ones; the files are filtered batch by batch while reading, only the matching pairs are kept
+    def lookup(self, from_gids, to_gids, files=None):
+        from_set, to_set = pa.array(np.unique(from_gids)), pa.array(np.unique(to_gids))
+        tables = []
+        for path in self.part_files() if files is None else files:
+            try:
+                source = pa.memory_map(path)
+            except FileNotFoundError:
+                continue  # merged by compact, the pairs are in the new part file
+            with source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    batch = reader.get_batch(i)
+                    batch = batch.filter(pc.is_in(batch['FROM_GID'], value_set=from_set))
+                    batch = batch.filter(pc.is_in(batch['TO_GID'], value_set=to_set))
+                    if batch.num_rows:
+                        tables.append(pa.Table.from_batches([batch]))
+        if not tables:
+            return od_schema.empty_table().to_pandas()
+        # pairs routed by two regions at the same time are in the store twice
+        return pa.concat_tables(tables).to_pandas().drop_duplicates(['FROM_GID', 'TO_GID'])
+
+    # pairs without a route (NaN, e.g. destination ORS could not snap) are not stored, they are routed again
+    def append(self, from_gids, to_gids, duration_h, dist_km):
+        duration_h = np.asarray(duration_h, dtype='float32')
+        dist_km = np.asarray(dist_km, dtype='float32')
+        routed = ~np.isnan(duration_h) & ~np.isnan(dist_km)
+        if routed.any():
+            self.batches.append(pa.record_batch([
+                pa.array(np.asarray(from_gids, dtype='int64')[routed]),
+                pa.array(np.asarray(to_gids, dtype='int64')[routed]),
+                pa.array(duration_h[routed]),
+                pa.array(dist_km[routed]),
+            ], schema=od_schema))
+            self.rows += int(routed.sum())
+        if self.rows >= self.batch_rows or time.monotonic() - self.flushed >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self.flushed = time.monotonic()
+        if not self.batches:
+            return
+        path = os.path.join(self.folder, f'part-{os.getpid()}-{time.time_ns()}.arrow')
+        with pa.OSFile(path + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, od_schema) as ipc:
+                for batch in self.batches:
+                    ipc.write_batch(batch)
+        os.replace(path + '.tmp', path)
+        self.written.add(path)
+        self.batches = []
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+
+    # merge all part files into one, batch by batch; only when no region is writing or reading the store
+    # (end of script 02 and of 01_02_regions_parallel.py)
+    def compact(self):
+        files = self.part_files()
+        if len(files) < 2:
+            return
+        path = os.path.join(self.folder, f'part-{os.getpid()}-{time.time_ns()}.arrow')
+        with pa.OSFile(path + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, od_schema) as ipc:
+                for part in files:
+                    with pa.memory_map(part) as source:
+                        reader = pa.ipc.open_file(source)
+                        for i in range(reader.num_record_batches):
+                            ipc.write_batch(reader.get_batch(i))
+        os.replace(path + '.tmp', path)
+        for part in files:
+            os.remove(part)
+
+
+# matrix writer (see matrix_store.py) that completes the routed pairs of a region with the pairs from the store
+# and adds the newly routed pairs to the store. Only the pairs found in the store are kept, per origin row as
+# destination columns and values, until the origin is written; `complete` are the origins whose pairs are all in the
+# store. Before every block the part files written by other regions since the last look are read, and only the
+# destinations still missing for the block are routed (pending).
+class SharedWriter:
+    def __init__(self, writer, store, origin_ids, origin_gids, dest_ids, dest_gids):
+        self.writer = writer
+        self.store = store
+        self.dest_ids = dest_ids
+        self.dest_gids = dest_gids
+        self.origin_gids = np.asarray(origin_gids)
+        self.row = {o: i for i, o in enumerate(origin_ids.tolist())}
+        self.dest_index = pd.Series(np.arange(len(dest_ids)), index=dest_ids)
+        # first row / column of every global id
+        self.gid_rows = pd.Series(np.arange(len(origin_gids)), index=origin_gids).groupby(level=0).first()
+        self.gid_cols = pd.Series(np.arange(len(dest_gids)), index=dest_gids).groupby(level=0).first()
+        self.known = {}  # origin row -> (destination columns, duration_h, dist_km), until the origin is written
+        self.done = set()  # origin rows written
+        self.seen = set()
+        self.earlier = set(store.written)  # part files of the store written before this region, e.g. another region
+        self.update()
+
+        n_known = np.array([len(self.known[r][0]) if r in self.known else 0 for r in range(len(origin_ids))])
+        self.complete = n_known == len(dest_ids)
+        logging.info(f"> {int(n_known.sum())} of {len(origin_ids) * len(dest_ids)} pairs found in the shared OD store, "
+                     f"{int(self.complete.sum())} origins complete")
+
+    # add the pairs of part files not read yet, except the ones of this region (its own pairs are written already)
+    def update(self):
+        own = self.store.written - self.earlier
+        files = [f for f in self.store.part_files() if f not in self.seen and f not in own]
+        if not files:
+            return
+        self.seen.update(files)
+        found = self.store.lookup(self.gid_rows.index.to_numpy(), self.gid_cols.index.to_numpy(), files)
+        if len(found) == 0:
+            return
+        rows = self.gid_rows.reindex(found['FROM_GID']).to_numpy()
+        cols = self.gid_cols.reindex(found['TO_GID']).to_numpy()
+        duration_h = found['DURATION_H'].to_numpy(dtype='float32')
+        dist_km = found['DIST_KM'].to_numpy(dtype='float32')
+        order = np.argsort(rows, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(rows[order]) != 0])
+        for part in np.split(order, starts[1:]):
+            row = int(rows[part[0]])
+            if row in self.done:
+                continue
+            new = (cols[part], duration_h[part], dist_km[part])
+            if row in self.known:
+                new = tuple(np.concatenate([old, add]) for old, add in zip(self.known[row], new))
+            _, first = np.unique(new[0], return_index=True)
+            self.known[row] = tuple(values[first] for values in new)
+
+    def known_rows(self, rows):
+        duration_h = np.full((len(rows), len(self.dest_ids)), np.nan, dtype='float32')
+        dist_km = np.full((len(rows), len(self.dest_ids)), np.nan, dtype='float32')
+        for i, row in enumerate(rows):
+            if row in self.known:
+                cols, duration, dist = self.known[row]
+                duration_h[i, cols] = duration
+                dist_km[i, cols] = dist
+        return duration_h, dist_km
+
+    # destinations (positions) of a block still missing for at least one of its origins (positions in
+    # origin_ids) after reading the latest part files
+    def pending(self, origin_ids, d):
+        self.update()
+        missing = np.zeros(len(self.dest_ids), dtype=bool)
+        for o in origin_ids.tolist():
+            row = self.row[o]
+            missing_row = np.ones(len(self.dest_ids), dtype=bool)
+            if row in self.known:
+                missing_row[self.known[row][0]] = False
+            missing |= missing_row
+        return d[missing[d]]
+
+    def exists(self, point_id):
+        return self.writer.exists(point_id)
+
+    # known pairs of written origins are not needed any more
+    def forget(self, rows):
+        for row in rows:
+            self.known.pop(row, None)
+            self.done.add(row)
+
+    # write the origins that need no routing at all
+    def write_known(self, origin_ids):
+        rows = [self.row[o] for o in origin_ids.tolist()]
+        if rows:
+            self.writer.write(origin_ids, self.dest_ids, *self.known_rows(rows))
+            self.forget(rows)
+
+    def write(self, from_ids, to_ids, duration_h, dist_km):
+        if len(from_ids) == 0:
+            return
+        rows = [self.row[o] for o in from_ids.tolist()]
+        cols = self.dest_index[to_ids].to_numpy()
+        full_duration, full_dist = (values.astype(float) for values in self.known_rows(rows))
+
+        # newly routed pairs go to the store; known pairs that were routed again as part of the block are not added
+        new = np.ones((len(rows), len(cols)), dtype=bool)
+        position = np.full(len(self.dest_ids), -1)
+        position[cols] = np.arange(len(cols))
+        for i, row in enumerate(rows):
+            if row in self.known:
+                known = position[self.known[row][0]]
+                new[i, known[known >= 0]] = False
+        o, d = np.nonzero(new)
+        self.store.append(self.origin_gids[np.array(rows)[o]], self.dest_gids[cols[d]], duration_h[o, d], dist_km[o, d])
+
+        full_duration[:, cols] = duration_h
+        full_dist[:, cols] = dist_km
+        self.writer.write(from_ids, self.dest_ids, full_duration, full_dist)
+        self.forget(rows)
+
+    def close(self):
+        self.store.flush()
+        self.writer.close()
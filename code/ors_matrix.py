@@ -0,0 +1,445 @@
+# Headless distance/duration matrix from a local ORS instance
+# Sends batched requests directly to the ORS /v2/matrix endpoint instead of one
+# ORS Tools:matrix_from_layers run per origin (used by 02_centrality_50Prozent.py with matrix_engine = 'ors')
+
+import asyncio
+import json
+import logging
+import re
+import time
+import aiohttp
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+
+# ORS error returned as JSON, e.g. {"error":{"code":6020,"message":"... limit of visited nodes."}}
+class OrsError(Exception):
+    def __init__(self, status, code, message):
+        super().__init__(f"{status} ({code}): {message}")
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+# read point layer (metric CRS) and return ids, lon/lat coordinates as required by ORS and metric coordinates
+def read_points(path, id_field='id'):
+    points = gpd.read_file(path)
+    points = points.set_geometry(points.geometry.representative_point())
+    ids = points[id_field].astype('int64').to_numpy()
+    lonlat = points.geometry.to_crs(epsg=4326)
+    return ids, np.column_stack([lonlat.x, lonlat.y]), np.column_stack([points.geometry.x, points.geometry.y])
+
+
+# pack origins into blocks so that origins x destinations of one request stay within matrix.maximum_routes;
+# if there are more destinations than routes allowed, every origin is its own block and its destinations
+# are chunked by the scheduler. With candidates (destination indices per origin, see pruning.py) a block
+# routes the union of the candidates of its origins.
+def plan_blocks(n_origins, n_destinations, max_routes, candidates=None):
+    if candidates is None:
+        all_destinations = np.arange(n_destinations)
+        origins_per_block = max(1, max_routes // max(1, n_destinations))
+        return [(np.arange(o, min(o + origins_per_block, n_origins)), all_destinations)
+                for o in range(0, n_origins, origins_per_block)]
+
+    blocks = []
+    origins, destinations = [], np.array([], dtype='int64')
+    for o in range(n_origins):
+        union = np.union1d(destinations, candidates[o])
+        if origins and (len(origins) + 1) * len(union) > max_routes:
+            blocks.append((np.array(origins), destinations))
+            origins, union = [], candidates[o]
+        origins.append(o)
+        destinations = union
+    if origins:
+        blocks.append((np.array(origins), destinations))
+    return blocks
+
+
+# approximate metric coordinates from lon/lat (equirectangular around the mean latitude), good enough for
+# grouping points by distance within a region
+def local_metres(coords, lat0):
+    x = coords[:, 0] * np.cos(np.radians(lat0)) * 111320
+    y = coords[:, 1] * 110540
+    return np.column_stack([x, y])
+
+
+# one matrix request, returns duration (h) and distance (km) with shape origins x destinations
+# gateway and connection errors are retried with exponential backoff, ORS errors are raised as OrsError;
+# with metrics (run_metrics.RunMetrics) latency, payload sizes, retries and the outcome are recorded
+async def request_matrix(session, url, profile, origins, destinations, retries=5, backoff=2, metrics=None):
+    body = {
+        'locations': np.round(np.concatenate([origins, destinations]), 6).tolist(),
+        'sources': list(range(len(origins))),
+        'destinations': list(range(len(origins), len(origins) + len(destinations))),
+        'metrics': ['duration', 'distance'],
+    }
+    payload = json.dumps(body).encode()
+    start = time.perf_counter()
+
+    def record(status, code=None, text=''):
+        if metrics is not None:
+            metrics.request(time.perf_counter() - start, len(origins), len(destinations), len(payload) * attempt,
+                            len(text), attempt, status, code)
+
+    for attempt in range(1, retries + 1):
+        try:
+            async with session.post(f'{url}/v2/matrix/{profile}', data=payload,
+                                    headers={'Content-Type': 'application/json'}) as response:
+                text = await response.text()
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == retries:
+                record(None, type(e).__name__)
+                raise
+            logging.info(f"ORS request failed ({e!r}), retrying in {backoff ** attempt}s...")
+            await asyncio.sleep(backoff ** attempt)
+            continue
+
+        if status in (502, 503, 504) and attempt < retries:
+            logging.info(f"ORS returned {status}, retrying in {backoff ** attempt}s...")
+            await asyncio.sleep(backoff ** attempt)
+            continue
+        try:
+            result = json.loads(text)
+        except ValueError:
+            record(status, None, text)
+            raise OrsError(status, None, text[:200])
+        if status != 200:
+            error = result.get('error', result)
+            if isinstance(error, dict):
+                record(status, error.get('code'), text)
+                raise OrsError(status, error.get('code'), error.get('message'))
+            record(status, None, text)
+            raise OrsError(status, None, str(error))
+        record(status, None, text)
+        break
+
+    # unreachable pairs are returned as null -> NaN
+    durations = np.array(result['durations'], dtype=float) / 3600
+    distances = np.array(result['distances'], dtype=float) / 1000
+    return durations, distances
+
+
+# ORS error codes that mean the request was too large for the server and has to be split
+VISITED_NODES = 6020  # Search exceeds the limit of visited nodes
+PARAMETER_LIMITS = 2004  # Request parameters exceed the server configuration limits
+
+
+# index of the location ORS could not snap, e.g. "Could not find routable point ... of specified coordinate 3: ..."
+def coordinate_index(error):
+    match = re.search(r'coordinate (\d+)', error.message or '')
+    return int(match.group(1)) if match else None
+
+
+# matrix of one origin block, filled part by part by the scheduler
+class BlockResult:
+    def __init__(self, origins, destinations):
+        self.origins = origins
+        self.destinations = destinations
+        self.rows = {o: i for i, o in enumerate(origins)}
+        self.columns = {d: i for i, d in enumerate(destinations)}
+        self.duration_h = np.full((len(origins), len(destinations)), np.nan)
+        self.dist_km = np.full((len(origins), len(destinations)), np.nan)
+        self.failed = []
+        self.unrouted = 0
+        self.requests = 0
+        self.splits = 0
+
+    def set(self, o, d, duration_h, dist_km):
+        rows = [self.rows[i] for i in o]
+        columns = [self.columns[i] for i in d]
+        self.duration_h[np.ix_(rows, columns)] = duration_h
+        self.dist_km[np.ix_(rows, columns)] = dist_km
+
+
+# Adaptive splitting of matrix requests:
+# requests that fail with "Search exceeds the limit of visited nodes" (6020) are split recursively, blocks of
+# several origins into single origins and the destinations of a single origin into groups by distance from the
+# origin, until every part succeeds. Per origin neighbourhood (grid cell of `neighbourhood` m) and distance band
+# (the visited nodes grow with the distances routed, not with the number of routes alone) the smallest request
+# that failed and the largest that worked are remembered, so later origins there start with a size known to work
+# and requests known to fail are not sent again. Failures of requests below min_failed routes (single long routes,
+# sporadic errors) are not remembered, and after probe_after requests of at least half the cap have worked the
+# cap is doubled, so one failure does not limit a neighbourhood for the rest of the run.
+# Points ORS cannot snap are dropped instead of failing the origin.
+class MatrixScheduler:
+    def __init__(self, session, url, profile, origin_xy, dest_xy, max_routes, neighbourhood=5000, request_slots=None,
+                 metrics=None, min_failed=50, probe_after=4):
+        self.session = session
+        self.request_slots = request_slots
+        self.metrics = metrics
+        self.url = url
+        self.profile = profile
+        self.origin_xy = origin_xy
+        self.dest_xy = dest_xy
+        self.max_routes = max_routes
+
+        lat0 = np.concatenate([origin_xy, dest_xy])[:, 1].mean()
+        self.origin_m = local_metres(origin_xy, lat0)
+        self.dest_m = local_metres(dest_xy, lat0)
+        self.cells = [tuple(c) for c in np.floor(self.origin_m / neighbourhood).astype('int64')]
+
+        self.min_failed = min_failed
+        self.probe_after = probe_after
+        self.failed_size = {}  # (neighbourhood, band) -> smallest number of routes that failed
+        self.worked_size = {}  # (neighbourhood, band) -> largest number of routes that worked
+        self.at_cap = {}  # (neighbourhood, band) -> requests at the cap that worked since the last failure
+        self.bad_destinations = set()
+        self.requests = 0
+        self.splits = 0
+
+    # distance band of a request: log2 of the extent (km) spanned by its origins and destinations
+    def band(self, o, d):
+        points = np.concatenate([self.origin_m[o], self.dest_m[d]])
+        return int(np.log2(max(np.hypot(*(points.max(axis=0) - points.min(axis=0))) / 1000, 1)))
+
+    def keys(self, o, d):
+        band = self.band(o, d)
+        return {(self.cells[i], band) for i in o}
+
+    # largest request allowed for these origins and destinations
+    def limit(self, o, d):
+        limit = self.max_routes
+        for key in self.keys(o, d):
+            if key in self.failed_size:
+                limit = min(limit, self.failed_size[key] - 1)
+        return max(limit, 1)
+
+    def remember(self, o, d, worked):
+        routes = len(o) * len(d)
+        for key in self.keys(o, d):
+            if worked and routes < self.failed_size.get(key, np.inf):
+                self.worked_size[key] = max(self.worked_size.get(key, 0), routes)
+                if 2 * routes >= self.failed_size.get(key, np.inf):
+                    self.at_cap[key] = self.at_cap.get(key, 0) + 1
+                    if self.at_cap[key] >= self.probe_after:
+                        # probe larger requests again
+                        self.failed_size[key] *= 2
+                        self.at_cap[key] = 0
+                        if self.failed_size[key] > self.max_routes:
+                            del self.failed_size[key]
+            elif not worked and routes >= self.min_failed:
+                self.failed_size[key] = min(self.failed_size.get(key, np.inf), routes)
+                self.at_cap[key] = 0
+
+    async def solve(self, o, d, result):
+        if self.bad_destinations:
+            d = d[~np.isin(d, list(self.bad_destinations))]
+        if len(o) == 0 or len(d) == 0:
+            return
+        limit = self.limit(o, d)
+        if len(o) * len(d) > limit:
+            return await self.split(o, d, result, limit, 'limit')
+
+        try:
+            self.requests += 1
+            result.requests += 1
+            duration_h, dist_km = await self.request(o, d)
+        except OrsError as e:
+            if e.code in (VISITED_NODES, PARAMETER_LIMITS):
+                self.remember(o, d, worked=False)
+                return await self.split(o, d, result, len(o) * len(d) - 1, str(e.code))
+
+            index = coordinate_index(e)
+            if index is not None and index >= len(o):
+                # destination without routable point nearby: exclude it from all further requests
+                logging.info(f"{e} -> excluding destination")
+                self.bad_destinations.add(d[index - len(o)])
+                return await self.solve(o, d, result)
+            if index is not None:
+                logging.info(f"{e} -> adding origin to error list")
+                result.failed.append(o[index])
+                return await self.solve(np.delete(o, index), d, result)
+            if len(o) > 1:
+                return await self.split(o, d, result, 1, 'error')
+            logging.info(str(e))
+            result.failed.append(o[0])
+            return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # no answer after all retries (connection lost, timeout): the origins of the request fail, the other
+            # blocks go on like the origins of the QGIS loop
+            logging.info(f"ORS request failed after retries ({e!r}) -> adding {len(o)} origins to error list")
+            result.failed.extend(o.tolist())
+            return
+
+        self.remember(o, d, worked=True)
+        result.set(o, d, duration_h, dist_km)
+
+    # request_slots: semaphore shared with other processes (regions) that caps the requests sent to the server
+    async def request(self, o, d):
+        if self.request_slots is None:
+            return await request_matrix(self.session, self.url, self.profile, self.origin_xy[o], self.dest_xy[d],
+                                        metrics=self.metrics)
+        await asyncio.get_running_loop().run_in_executor(None, self.request_slots.acquire)
+        try:
+            return await request_matrix(self.session, self.url, self.profile, self.origin_xy[o], self.dest_xy[d],
+                                        metrics=self.metrics)
+        finally:
+            self.request_slots.release()
+
+    # reason: 'limit' (larger than known to work), ORS error code or 'error', recorded in the metrics
+    async def split(self, o, d, result, limit, reason):
+        self.splits += 1
+        result.splits += 1
+        if self.metrics is not None:
+            self.metrics.split(reason, len(o), len(d))
+        if len(o) > 1:
+            # origins are sorted spatially, so both halves stay compact
+            half = len(o) // 2
+            await self.solve(o[:half], d, result)
+            await self.solve(o[half:], d, result)
+        elif len(d) > 1:
+            # group destinations by distance from the origin, start with the largest size known to work
+            d = d[np.argsort(np.hypot(*(self.dest_m[d] - self.origin_m[o[0]]).T))]
+            key = (self.cells[o[0]], self.band(o, d))
+            size = min(self.worked_size.get(key, limit), limit) if key in self.failed_size else limit
+            for part in np.array_split(d, max(2, -(-len(d) // size))):
+                await self.solve(o, part, result)
+        else:
+            # a single origin-destination pair exceeding the limit stays empty
+            result.unrouted += 1
+
+
+async def _run_blocks(blocks, origin_ids, origin_xy, dest_ids, dest_xy, writer, url, profile,
+                      max_routes, concurrency, timeout, request_slots=None, bad_destinations=(), metrics=None,
+                      shared=None):
+    queue = asyncio.Queue()
+    for block in blocks:
+        queue.put_nowait(block)
+    failed = []
+    done = 0
+
+    # keep-alive connection pool with at most `concurrency` open connections
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        scheduler = MatrixScheduler(session, url, profile, origin_xy, dest_xy, max_routes, request_slots=request_slots,
+                                    metrics=metrics)
+        scheduler.bad_destinations.update(bad_destinations)
+        if metrics is not None:
+            metrics.progress(0, len(origin_ids), force=True)
+
+        async def worker():
+            nonlocal done
+            while not queue.empty():
+                o, d = queue.get_nowait()
+                if shared is not None:
+                    # pairs routed meanwhile by other regions (or blocks) are not routed again
+                    d = shared.pending(origin_ids[o], d)
+                    if len(d) == 0:
+                        shared.write_known(origin_ids[o])
+                        done += len(o)
+                        continue
+                result = BlockResult(o, d)
+                start = time.perf_counter()
+                await scheduler.solve(o, d, result)
+
+                # origins without a single routed destination count as failed
+                routed = ~np.isnan(result.duration_h).all(axis=1)
+                routed[[result.rows[i] for i in result.failed]] = False
+                failed.extend(origin_ids[o[~routed]].tolist())
+                if result.unrouted:
+                    logging.info(f"> {result.unrouted} origin-destination pairs exceed the visited nodes limit")
+                writer.write(origin_ids[o[routed]], dest_ids[d], result.duration_h[routed], result.dist_km[routed])
+                done += len(o)
+                logging.info(f"> {done}/{len(origin_ids)} origins, {scheduler.requests} requests, {scheduler.splits} splits")
+                if metrics is not None:
+                    metrics.origins(origin_ids[o], time.perf_counter() - start, result.requests, result.splits,
+                                    failed=int((~routed).sum()))
+                    metrics.progress(done, len(origin_ids))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    if scheduler.bad_destinations:
+        logging.info(f"Destinations without routable point: {sorted(dest_ids[list(scheduler.bad_destinations)].tolist())}")
+    return failed
+
+
+# compute matrices from all origins to all destinations and return ids of origins that failed
+# with prune_epsilon (both modes, and the decay parameters in `variant`, see impedance.py) only destinations that can
+# weigh more than prune_epsilon are routed per origin, the error bounds of both modes are written to prune_report;
+# with cluster_theta distant destinations are routed via cluster representatives (destination_clusters.py);
+# request_slots: multiprocessing semaphore to share one request limit between regions run in parallel;
+# with shared_store (od_store.OdStore) only pairs that are not in the store yet are routed, see od_store.py;
+# with snap_cache all points are snapped once and checked before the matrix (routability.py): origins that can
+# not be routed are returned as failed without a matrix request, such destinations are left out of all requests;
+# with metrics (run_metrics.RunMetrics) every request, split and block of origins is recorded with the progress
+def run_matrix(origins_path, destinations_path, writer, url, profile='driving-car',
+               max_routes=2500, concurrency=4, timeout=600,
+               prune_epsilon=None, variant=None, max_speed=130, prune_report=None, cluster_theta=None,
+               request_slots=None, shared_store=None, snap_cache=None, snap_radius=350, routability_report=None,
+               metrics=None):
+    origin_ids, origin_xy, origin_m = read_points(origins_path)
+    dest_ids, dest_xy, dest_m = read_points(destinations_path)
+    if len(dest_ids) == 0:
+        logging.info("No destination points, no matrices calculated.")
+        return []
+
+    todo = np.array([not writer.exists(i) for i in origin_ids], dtype=bool)
+    if not todo.all():
+        logging.info(f"Matrix for {int((~todo).sum())} points already exists. Skipping...")
+    origin_ids, origin_xy, origin_m = origin_ids[todo], origin_xy[todo], origin_m[todo]
+
+    # sort origins spatially (rows of 1 km), so blocks and their neighbourhoods are compact
+    order = np.lexsort((origin_m[:, 0], np.floor(origin_m[:, 1] / 1000)))
+    origin_ids, origin_xy, origin_m = origin_ids[order], origin_xy[order], origin_m[order]
+
+    failed, bad_destinations = [], []
+    if snap_cache:
+        import od_store
+        import routability
+        n = len(origin_ids)
+        checked = routability.check_points(np.concatenate([od_store.global_ids(origin_m), od_store.global_ids(dest_m)]),
+                                           np.concatenate([origin_xy, dest_xy]), snap_cache, url, profile,
+                                           radius=snap_radius, max_routes=max_routes, timeout=timeout,
+                                           request_slots=request_slots)
+        if routability_report:
+            report = checked[['snap_dist_m', 'status']].reset_index(drop=True)
+            report.insert(0, 'id', np.concatenate([origin_ids, dest_ids]))
+            report.drop_duplicates('id').to_csv(routability_report, index=False)
+        # requests are sent with the snapped locations
+        routable = (checked['status'] == 'ok').to_numpy()
+        snapped = checked[['snapped_lon', 'snapped_lat']].to_numpy(dtype=float)
+        origin_xy = np.where(routable[:n, None], snapped[:n], origin_xy)
+        dest_xy = np.where(routable[n:, None], snapped[n:], dest_xy)
+        failed = origin_ids[~routable[:n]].tolist()
+        bad_destinations = np.flatnonzero(~routable[n:]).tolist()
+        origin_ids, origin_xy, origin_m = origin_ids[routable[:n]], origin_xy[routable[:n]], origin_m[routable[:n]]
+        logging.info(f"> {len(failed)} origins and {len(bad_destinations)} destinations not routable, "
+                     f"excluded before the matrix")
+
+    candidates = None
+    if shared_store is not None:
+        import od_store
+        writer = od_store.SharedWriter(writer, shared_store, origin_ids, od_store.global_ids(origin_m),
+                                       dest_ids, od_store.global_ids(dest_m))
+        complete = writer.complete
+        writer.write_known(origin_ids[complete])
+        origin_ids, origin_xy, origin_m = origin_ids[~complete], origin_xy[~complete], origin_m[~complete]
+        if cluster_theta or prune_epsilon:
+            logging.info("Shared OD store in use, cluster_theta and prune_epsilon are ignored.")
+    elif cluster_theta:
+        import destination_clusters
+        population = gpd.read_file(destinations_path, ignore_geometry=True)['EW_10']
+        tree = destination_clusters.DestinationTree(dest_m, population)
+        groups, candidates = destination_clusters.origin_groups(tree, origin_m, cluster_theta)
+        writer = destination_clusters.ClusterWriter(writer, dict(zip(origin_ids, groups)), dest_ids)
+    elif prune_epsilon:
+        import pruning
+        radius = pruning.pruning_radius(variant, prune_epsilon, max_speed)
+        candidates = pruning.candidate_destinations(origin_m, dest_m, radius)
+        if candidates is None:
+            logging.info("Decay functions do not drop below prune_epsilon, all destinations are routed.")
+        else:
+            population = gpd.read_file(destinations_path, ignore_geometry=True)['EW_10']
+            report = pruning.error_bound(origin_ids, candidates, population,
+                                         pruning.max_weights(variant, radius, max_speed))
+            if prune_report:
+                report.to_csv(prune_report, index=False)
+
+    blocks = plan_blocks(len(origin_ids), len(dest_ids), max_routes, candidates)
+    logging.info(f"{len(origin_ids)} origins x {len(dest_ids)} destinations in {len(blocks)} blocks")
+    failed += asyncio.run(_run_blocks(blocks, origin_ids, origin_xy, dest_ids, dest_xy, writer,
+                                      url, profile, max_routes, concurrency, timeout, request_slots, bad_destinations,
+                                      metrics, writer if shared_store is not None else None))
+    writer.close()
+    return failed
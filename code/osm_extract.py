@@ -0,0 +1,68 @@
+# Road network from one local OSM extract instead of one Overpass download per region (script 01)
+# The extract (.osm.pbf or .osm, e.g. from Geofabrik) is read once with the OSM driver of GDAL, which gives the
+# same 'lines' layer as the Overpass download loaded in QGIS (osm_id, name, highway, ..., other_tags). The road
+# filter of script 01 is applied while reading and the roads are stored in a GeoPackage with spatial index, from
+# which the roads of each region are read with a bounding box query. Works offline.
+
+import os
+import argparse
+import pyogrio
+import geopandas as gpd
+from shapely.geometry import box
+
+# road types kept in script 01
+road_types = ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'unclassified',
+              'residential', 'motorway_link', 'trunk_link', 'primary_link', 'secondary_link',
+              'tertiary_link', 'living_street', 'service']
+road_filter = ("highway IN ({}) AND (other_tags IS NULL OR other_tags NOT LIKE '%\"access\"=>\"private\"%')"
+               .format(','.join(f"'{t}'" for t in road_types)))
+layer_name = 'highways'
+
+
+# GeoPackage next to the extract, e.g. input/OSM/nordrhein-westfalen-latest_highways.gpkg
+def store_path(osm_path):
+    name = os.path.basename(osm_path)
+    for ext in ('.osm.pbf', '.osm'):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return os.path.join(os.path.dirname(osm_path), f'{name}_highways.gpkg')
+
+
+# filtered roads of the whole extract, written batch by batch so the extract never has to fit into memory
+# an existing store is reused unless the extract is newer
+def build_store(osm_path, store=None, batch_size=65536):
+    store = store or store_path(osm_path)
+    if os.path.exists(store) and os.path.getmtime(store) >= os.path.getmtime(osm_path):
+        return store
+    tmp = store + '.tmp.gpkg'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    n_roads = 0
+    with pyogrio.open_arrow(osm_path, layer='lines', where=road_filter, batch_size=batch_size,
+                           use_pyarrow=True) as (meta, reader):
+        for batch in reader:
+            if batch.num_rows == 0:
+                continue
+            pyogrio.write_arrow(batch, tmp, layer=layer_name, driver='GPKG', append=n_roads > 0,
+                                geometry_name=meta['geometry_name'] or 'wkb_geometry', geometry_type='LineString',
+                                crs=meta['crs'], layer_options={'SPATIAL_INDEX': 'YES'})
+            n_roads += batch.num_rows
+    if n_roads == 0:
+        raise ValueError(f"No roads found in {osm_path}")
+    os.replace(tmp, store)
+    print(f"{n_roads} roads of {osm_path} stored in {store}")
+    return store
+
+
+# roads intersecting the extent (xmin, ymin, xmax, ymax in crs), in the CRS of the store (EPSG:4326) like the download
+def read_region(store, bounds, crs):
+    extent = gpd.GeoSeries([box(*bounds)], crs=crs)
+    return gpd.read_file(store, layer=layer_name, bbox=extent)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Store the filtered roads of a local OSM extract in a GeoPackage")
+    parser.add_argument('osm_path', help="OSM extract, e.g. input/OSM/nordrhein-westfalen-latest.osm.pbf")
+    parser.add_argument('--store', help="output GeoPackage, default: <extract>_highways.gpkg next to the extract")
+    args = parser.parse_args()
+    build_store(args.osm_path, args.store)
@@ -0,0 +1,74 @@
+# Population of road network points
+# Every population point is assigned to its nearest road point, which is the same as summing the population
+# within the Voronoi polygons of the road points (qgis:voronoipolygons + qgis:joinbylocationsummary in 01 and 02)
+# without building polygons and without the buffer-edge effects of BUFFER: 2 (population_engine = 'kdtree')
+
+import numpy as np
+import geopandas as gpd
+import shapely
+from scipy.spatial import cKDTree
+
+
+# sum of population values per road point (joinbylocationsummary with the Voronoi polygons)
+def population_sum(road_xy, population_xy, population):
+    population = np.nan_to_num(np.asarray(population, dtype=float))
+    _, nearest = cKDTree(road_xy).query(population_xy)
+    return np.bincount(nearest, weights=population, minlength=len(road_xy))
+
+
+# sums below 1 are set to 0 like in the field calculator step
+def assign_population(road_xy, population_xy, population):
+    total = population_sum(road_xy, population_xy, population)
+    total[total < 1] = 0
+    return total
+
+
+def point_xy(gdf):
+    geometry = gdf.geometry.representative_point()
+    return np.column_stack([geometry.x, geometry.y])
+
+
+# --- RASTER ---
+# population raster (Zensus raster, GHS-POP) read block by block within the window of the region buffer:
+# the centres of the cells with population are computed from the geotransform and summed on the nearest road
+# point without creating point features (gdal:cliprasterbymasklayer + regularpoints + rastersampling in 01)
+def iter_raster_cells(raster_path, region_shape, crs, block_rows=1024):
+    import rasterio
+    from rasterio.windows import Window, from_bounds
+    with rasterio.open(raster_path) as src:
+        region_src = gpd.GeoSeries([region_shape], crs=crs).to_crs(src.crs).iloc[0]
+        window = from_bounds(*region_src.bounds, transform=src.transform).round_offsets().round_lengths()
+        window = window.intersection(Window(0, 0, src.width, src.height))
+        for row_off in range(int(window.row_off), int(window.row_off + window.height), block_rows):
+            block = Window(window.col_off, row_off, window.width, min(block_rows, window.row_off + window.height - row_off))
+            values = src.read(1, window=block, masked=True)
+            rows, cols = np.nonzero(~np.ma.getmaskarray(values) & np.isfinite(values.filled(0)) & (values.filled(0) != 0))
+            x, y = src.transform * (cols + block.col_off + 0.5, rows + block.row_off + 0.5)
+            inside = shapely.contains_xy(region_src, x, y)
+            if not inside.any():
+                continue
+            points = gpd.GeoSeries(gpd.points_from_xy(x[inside], y[inside]), crs=src.crs).to_crs(crs)
+            yield shapely.get_coordinates(points.to_numpy()), values.data[rows[inside], cols[inside]].astype(float)
+
+
+# sum of the raster population per road point, like population_sum for census points
+def raster_population_sum(road_xy, raster_path, region_shape, crs, block_rows=1024):
+    tree = cKDTree(road_xy)
+    total = np.zeros(len(road_xy))
+    for xy, values in iter_raster_cells(raster_path, region_shape, crs, block_rows):
+        _, nearest = tree.query(xy)
+        total += np.bincount(nearest, weights=values, minlength=len(road_xy))
+    return total
+
+
+# census points (centroids for polygons, cells with population for a raster) within region_shape as coordinates
+# and population values, e.g. for the adaptive grid of road_points.py before any road point exists
+def census_population(path, region_shape, crs, ew_field, geomtype='Point'):
+    if geomtype == 'Raster':
+        blocks = list(iter_raster_cells(path, region_shape, crs))
+        if not blocks:
+            return np.empty((0, 2)), np.empty(0)
+        return np.concatenate([xy for xy, _ in blocks]), np.concatenate([values for _, values in blocks])
+    points = gpd.read_file(path, mask=gpd.GeoSeries([region_shape], crs=crs)).to_crs(crs)
+    points = points[points.intersects(region_shape)]
+    return point_xy(points), np.nan_to_num(points[ew_field].to_numpy(dtype=float))
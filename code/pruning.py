@@ -0,0 +1,92 @@
+# Distance-bounded pruning of destinations (opt-in truncation of the decay functions)
+# The travel time of a route is at least its straight-line distance divided by a maximum speed and its network
+# distance is at least the straight-line distance. As the decay functions decrease with time and distance, a
+# destination further away than
+#   R = max(max_speed * f_h^-1(epsilon_h), f_km^-1(epsilon_km))
+# has a weight of at most epsilon_h in exp_h_w and at most epsilon_km in exp_km_w and does not need to be routed.
+# Both modes are used by script 03, so both need an epsilon and the larger radius is used; a config that would
+# leave one mode unbounded is refused. The error this introduces into exp_h_w (exp_km_w) of an origin is at most
+# the weight f_h (f_km) at the radius x population of its pruned destinations, reported separately for both modes.
+# With the parameters of the paper (impedance.powerexp_paper) the driving decay is almost flat: it drops to 0.001
+# only after ~81 h (R ~ 10600 km at 130 km/h), so pruning does not remove any destination within a region. It
+# only pays off with driving parameters that decay faster.
+
+import logging
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+# mean of the power exponential functions (b1, b2) at x
+def mean_decay(params, x):
+    return np.mean([np.exp(-b1 * x ** b2) for b1, b2 in params])
+
+
+# x where the mean of the power exponential functions (b1, b2) drops to epsilon
+def decay_radius(params, epsilon):
+    high = 1.0
+    while mean_decay(params, high) > epsilon:
+        high *= 2
+        if high > 1e6:
+            return np.inf
+    low = 0.0
+    for _ in range(60):
+        mid = (low + high) / 2
+        low, high = (mid, high) if mean_decay(params, mid) > epsilon else (low, mid)
+    return high
+
+
+# epsilon per mode: one number for both modes or a dict with both modes, e.g. {'h': 0.001, 'km': 0.001}
+def mode_epsilon(epsilon):
+    if not isinstance(epsilon, dict):
+        epsilon = {'h': epsilon, 'km': epsilon}
+    missing = [mode for mode in ('h', 'km') if not epsilon.get(mode) or epsilon[mode] <= 0]
+    if missing:
+        raise ValueError(f"prune_epsilon needs a positive weight for both 'h' and 'km', missing: {missing}. "
+                         f"Pruning by one mode only would leave the weights of the other mode unbounded.")
+    return {mode: epsilon[mode] for mode in ('h', 'km')}
+
+
+# straight-line radius (m) beyond which a destination weighs at most epsilon in both modes, the larger of the radii
+# variant: decay parameters as in impedance.py, 'h' on driving time (h), 'km' on distance (km)
+def pruning_radius(variant, epsilon, max_speed=130):
+    epsilon = mode_epsilon(epsilon)
+    radius = {
+        'h': decay_radius(variant['h'], epsilon['h']) * max_speed * 1000,
+        'km': decay_radius(variant['km'], epsilon['km']) * 1000,
+    }
+    logging.info("Pruning radius: " + ", ".join(f"{r / 1000:.1f} km for {'driving time' if mode == 'h' else 'distance'}"
+                                                for mode, r in radius.items()))
+    return max(radius.values())
+
+
+# largest weight per mode a destination beyond the radius (m) can have
+def max_weights(variant, radius, max_speed=130):
+    return {'h': mean_decay(variant['h'], radius / 1000 / max_speed), 'km': mean_decay(variant['km'], radius / 1000)}
+
+
+# destination indices within the radius per origin (metric coordinates)
+def candidate_destinations(origin_xy, dest_xy, radius):
+    if np.isinf(radius):
+        return None
+    return [np.sort(np.array(c, dtype='int64')) for c in cKDTree(dest_xy).query_ball_point(origin_xy, radius)]
+
+
+# bound of the truncation error per origin: every pruned destination could have added at most the weight of its
+# mode at the radius (see max_weights) x EW_10
+def error_bound(origin_ids, candidates, dest_population, weights):
+    dest_population = np.nan_to_num(np.asarray(dest_population, dtype=float))
+    kept = np.array([dest_population[c].sum() for c in candidates])
+    pruned = dest_population.sum() - kept
+    report = pd.DataFrame({
+        'FROM_ID': origin_ids,
+        'n_destinations': [len(c) for c in candidates],
+        'pruned_population': pruned,
+        'max_error_exp_h_w': weights['h'] * pruned,
+        'max_error_exp_km_w': weights['km'] * pruned,
+    })
+    pairs = report['n_destinations'].sum() / max(1, len(origin_ids) * len(dest_population))
+    logging.info(f"Pruning keeps {pairs:.1%} of origin-destination pairs, max. error per origin: "
+                 f"exp_h_w {report['max_error_exp_h_w'].max():.3f}, exp_km_w {report['max_error_exp_km_w'].max():.3f} "
+                 f"inhabitants (weights at the radius: {weights['h']:.4f} driving time, {weights['km']:.4f} distance)")
+    return report
@@ -0,0 +1,210 @@
+# Road network points without QGIS (alternative to the processing chain creategrid ... deletecolumn in script 01)
+# The centroids of the hexagon grid of native:creategrid are computed with numpy, every centroid is moved to the
+# closest point of the nearest road within grid_space/2 (native:joinbynearest + make_point(nearest_x, nearest_y)),
+# duplicates are removed and the points are clipped to the region buffer. The output has the same schema as
+# osmpoints_{grid_space}mgrid_{region}.gpkg: one point per row with the grid cell `id`.
+# Can also be run from the command line on an existing highways file (see __main__ below).
+# adaptive_road_points replaces the uniform grid by a quadtree of square cells that are split where the population
+# is dense, from max_space down to min_space, until a budget of road points is used. The points get the side of
+# their cell in `cell_m`, the area a point stands for in the weighted standardisation of the centrality.
+
+import argparse
+import heapq
+import numpy as np
+import geopandas as gpd
+import shapely
+
+
+# centroids of the hexagon grid of native:creategrid (TYPE 4) over extent (xmin, ymin, xmax, ymax)
+# for hexagons QGIS ignores HSPACING: columns are sqrt(3)/2 x grid_space apart and the centre of a column lies
+# grid_space/sqrt(3) right of its left edge. Cells are numbered column by column from the top left starting at 1,
+# odd columns are shifted by half a row
+def grid_centroids(extent, grid_space):
+    xmin, ymin, xmax, ymax = extent
+    col_step = np.sqrt(3) / 2 * grid_space
+    n_cols = int(np.ceil((xmax - xmin) / col_step))
+    n_rows = int(np.ceil((ymax - ymin) / grid_space))
+    col, row = np.divmod(np.arange(n_cols * n_rows), n_rows)
+    x = xmin + col * col_step + grid_space / np.sqrt(3)
+    y = ymax - (row + 0.5 + 0.5 * (col % 2)) * grid_space
+    return np.arange(1, n_cols * n_rows + 1), np.column_stack([x, y])
+
+
+# extent moved outwards onto a lattice shared by all regions (x to multiples of two column steps so that odd
+# columns stay odd), so regions with overlapping buffers get the same centroids and road points in the overlap
+def aligned_extent(extent, grid_space):
+    xmin, ymin, xmax, ymax = extent
+    pair_step = np.sqrt(3) * grid_space
+    return (np.floor(xmin / pair_step) * pair_step, np.floor(ymin / grid_space) * grid_space,
+            xmax, np.ceil(ymax / grid_space) * grid_space)
+
+
+# closest point on the nearest road within max_distance for every point, NaN if there is no road;
+# tree: shapely.STRtree of the roads, for repeated calls with the same roads
+def snap_to_roads(xy, roads, max_distance, tree=None):
+    roads = np.asarray(roads)
+    if tree is None:
+        tree = shapely.STRtree(roads)
+    points = shapely.points(xy)
+    point_idx, road_idx = tree.query_nearest(points, max_distance=max_distance, all_matches=False)
+    snapped = np.full(xy.shape, np.nan)
+    nearest = shapely.get_point(shapely.shortest_line(roads[road_idx], points[point_idx]), 0)
+    snapped[point_idx] = shapely.get_coordinates(nearest)
+    return snapped
+
+
+# road network points of one region
+# highways: road lines in the CRS of the buffer, extent: extent of the grid (bounds of the region in script 01),
+# align: global grid for shared OD pairs between regions (od_store.py)
+def road_points(highways, buffer, grid_space, extent=None, decimals=3, align=False):
+    if extent is None:
+        extent = buffer.total_bounds
+    if align:
+        extent = aligned_extent(extent, grid_space)
+    ids, xy = grid_centroids(extent, grid_space)
+    roads = highways.geometry[~highways.geometry.is_empty & highways.geometry.notna()].to_numpy()
+    snapped = snap_to_roads(xy, roads, grid_space / 2)
+
+    # drop points without road, then duplicates (first id is kept like in native:deleteduplicategeometries)
+    found = ~np.isnan(snapped[:, 0])
+    ids, snapped = ids[found], snapped[found]
+    _, first = np.unique(np.round(snapped, decimals), axis=0, return_index=True)
+    first = np.sort(first)
+    ids, snapped = ids[first], snapped[first]
+
+    points = gpd.GeoDataFrame({'id': ids}, geometry=gpd.points_from_xy(snapped[:, 0], snapped[:, 1]), crs=buffer.crs)
+    region_shape = shapely.union_all(buffer.geometry.to_numpy())
+    shapely.prepare(region_shape)
+    return points[shapely.intersects(region_shape, points.geometry.to_numpy())].reset_index(drop=True)
+
+
+# --- ADAPTIVE GRID ---
+# population of any quadtree cell from a summed-area table of the population on a lattice of min_space
+def population_table(origin, shape, min_space, population_xy, population):
+    col = np.floor((population_xy[:, 0] - origin[0]) / min_space).astype(int)
+    row = np.floor((population_xy[:, 1] - origin[1]) / min_space).astype(int)
+    inside = (col >= 0) & (col < shape[0]) & (row >= 0) & (row < shape[1])
+    counts = np.zeros(shape)
+    np.add.at(counts, (col[inside], row[inside]), np.nan_to_num(np.asarray(population, dtype=float))[inside])
+    table = np.zeros((shape[0] + 1, shape[1] + 1))
+    table[1:, 1:] = counts.cumsum(axis=0).cumsum(axis=1)
+    return table
+
+
+# square cells of a quadtree over extent: root cells of max_space (a power of two times min_space), the cell with
+# the highest population is split into four until the road points of the cells would exceed budget; cells with
+# less than min_population are not split. Returns the centres of the leaf cells, their side and their road points.
+def quadtree_cells(extent, roads, region_shape, population_xy, population, min_space, max_space, budget,
+                   min_population=1, align=False):
+    levels = int(round(np.log2(max_space / min_space)))
+    if levels < 0 or not np.isclose(min_space * 2 ** levels, max_space):
+        raise ValueError(f"max_space ({max_space}) must be min_space ({min_space}) times a power of two")
+    xmin, ymin, xmax, ymax = extent
+    if align:
+        xmin, ymin = np.floor(xmin / max_space) * max_space, np.floor(ymin / max_space) * max_space
+    n_x, n_y = int(np.ceil((xmax - xmin) / max_space)), int(np.ceil((ymax - ymin) / max_space))
+    fine = 2 ** levels
+    table = population_table((xmin, ymin), (n_x * fine, n_y * fine), min_space, population_xy, population)
+    shapely.prepare(region_shape)
+    tree = shapely.STRtree(roads)  # one index for all splits
+
+    # cell (level, i, j): side max_space / 2 ** level, lower left corner at (i, j) cells of that side from the origin
+    def cell_population(level, i, j):
+        step = 2 ** (levels - level)
+        return table[(i + 1) * step, (j + 1) * step] - table[i * step, (j + 1) * step] \
+            - table[(i + 1) * step, j * step] + table[i * step, j * step]
+
+    def centres(cells):
+        side = max_space / 2.0 ** np.array([c[0] for c in cells])
+        i, j = np.array([c[1] for c in cells]), np.array([c[2] for c in cells])
+        return np.column_stack([xmin + (i + 0.5) * side, ymin + (j + 0.5) * side]), side
+
+    # road point of every cell (centre snapped within half the side like the uniform grid), NaN outside the region
+    def cell_points(cells):
+        xy, side = centres(cells)
+        snapped = np.full(xy.shape, np.nan)
+        for s in np.unique(side):
+            same = side == s
+            snapped[same] = snap_to_roads(xy[same], roads, s / 2, tree)
+        found = ~np.isnan(snapped[:, 0])
+        found[found] = shapely.contains_xy(region_shape, snapped[found, 0], snapped[found, 1])
+        snapped[~found] = np.nan
+        return snapped
+
+    roots = [(0, i, j) for i in range(n_x) for j in range(n_y)]
+    leaves = dict(zip(roots, cell_points(roots)))
+    n_points = sum(not np.isnan(xy[0]) for xy in leaves.values())
+    heap = [(-cell_population(*cell), cell) for cell in roots]
+    heapq.heapify(heap)
+    while heap and n_points < budget:
+        population, (level, i, j) = heapq.heappop(heap)
+        if -population < min_population or level == levels:
+            continue
+        children = [(level + 1, 2 * i + di, 2 * j + dj) for di in (0, 1) for dj in (0, 1)]
+        child_points = cell_points(children)
+        added = int((~np.isnan(child_points[:, 0])).sum()) - int(not np.isnan(leaves[(level, i, j)][0]))
+        if n_points + added > budget:
+            continue
+        del leaves[(level, i, j)]
+        leaves.update(zip(children, child_points))
+        n_points += added
+        for child in children:
+            heapq.heappush(heap, (-cell_population(*child), child))
+
+    cells = sorted(leaves)
+    xy, side = centres(cells)
+    return xy, side, np.array([leaves[cell] for cell in cells])
+
+
+# road network points of one region on an adaptive grid (see quadtree_cells), same schema as road_points plus the
+# side of the cell in `cell_m`; population_xy and population are the census points (or raster cells) of the buffer
+def adaptive_road_points(highways, buffer, population_xy, population, min_space, max_space, budget, extent=None,
+                         decimals=3, align=False, min_population=1):
+    if extent is None:
+        extent = buffer.total_bounds
+    roads = highways.geometry[~highways.geometry.is_empty & highways.geometry.notna()].to_numpy()
+    region_shape = shapely.union_all(buffer.geometry.to_numpy())
+    xy, side, snapped = quadtree_cells(extent, roads, region_shape, population_xy, population, min_space, max_space,
+                                       budget, min_population, align)
+    # cells numbered column by column from the top left like native:creategrid, larger cells first
+    order = np.lexsort((-xy[:, 1], xy[:, 0], -side))
+    ids = np.arange(1, len(order) + 1)
+    side, snapped = side[order], snapped[order]
+
+    found = ~np.isnan(snapped[:, 0])
+    ids, side, snapped = ids[found], side[found], snapped[found]
+    _, first = np.unique(np.round(snapped, decimals), axis=0, return_index=True)
+    first = np.sort(first)
+    return gpd.GeoDataFrame({'id': ids[first], 'cell_m': side[first]},
+                            geometry=gpd.points_from_xy(snapped[first, 0], snapped[first, 1]), crs=buffer.crs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Snap a regular grid to the road network of one region")
+    parser.add_argument('highways', help="road lines, e.g. output/highways_Aachen.gpkg")
+    parser.add_argument('buffer', help="region buffer, e.g. output/buffer/buffer_Aachen.gpkg")
+    parser.add_argument('output', help="output points, e.g. output/osmpoints_1000mgrid_Aachen.gpkg")
+    parser.add_argument('--grid-space', type=float, default=1000)
+    parser.add_argument('--extent', type=float, nargs=4, metavar=('XMIN', 'YMIN', 'XMAX', 'YMAX'),
+                        help="extent of the grid in the CRS of the buffer, default: extent of the buffer")
+    parser.add_argument('--align', action='store_true', help="align the grid to a lattice shared by all regions")
+    parser.add_argument('--census', help="census points (or raster): adaptive grid refined where the population is dense")
+    parser.add_argument('--ew-field', default='Einwohner', help="population field of the census points")
+    parser.add_argument('--min-space', type=float, default=250, help="smallest cell of the adaptive grid")
+    parser.add_argument('--max-space', type=float, default=4000, help="largest cell of the adaptive grid")
+    parser.add_argument('--budget', type=int, help="maximum number of adaptive road points, "
+                                                   "default: as many as the uniform grid with --grid-space")
+    args = parser.parse_args()
+    buffer = gpd.read_file(args.buffer)
+    highways = gpd.read_file(args.highways).to_crs(buffer.crs)
+    points = road_points(highways, buffer, args.grid_space, args.extent, align=args.align)
+    if args.census:
+        import population
+        region_shape = shapely.union_all(buffer.geometry.to_numpy())
+        geomtype = 'Raster' if args.census.lower().endswith(('.tif', '.tiff')) else 'Point'
+        population_xy, population_values = population.census_population(args.census, region_shape, buffer.crs,
+                                                                        args.ew_field, geomtype)
+        points = adaptive_road_points(highways, buffer, population_xy, population_values, args.min_space,
+                                      args.max_space, args.budget or len(points), args.extent, align=args.align)
+    points.to_file(args.output, driver="GPKG")
+    print(f"{len(points)} road points written to {args.output}")
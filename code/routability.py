@@ -0,0 +1,207 @@
+# Routability pre-check of the road points before any matrix request (matrix_engine = 'ors' in script 02)
+# Every point is snapped once to the graph of the ORS profile (/v2/snap endpoint). Points ORS can not snap within
+# `radius` and points on a part of the graph that is not connected to the rest (no route from or to a hub point
+# in the middle of the region, e.g. a road only accessible from a private area) are flagged before the matrix
+# starts: they cost one cheap 1 x n request instead of a failed matrix request, its splits and retries.
+# Snapped locations, snap distances and flags are kept in a csv cache shared by all regions and runs, keyed by
+# the global id of the point (od_store.py), so only new points are checked. There is one cache file per graph
+# build of the ORS instance (/v2/status), a rebuilt graph starts a new one. The matrix requests are then sent
+# with the snapped locations.
+
+import os
+import re
+import json
+import asyncio
+import logging
+import urllib.request
+import aiohttp
+import numpy as np
+import pandas as pd
+import ors_matrix
+
+cache_columns = ['gid', 'lon', 'lat', 'snapped_lon', 'snapped_lat', 'snap_dist_m', 'status']
+# status: 'ok', 'not_snapped' (no road of the profile within radius), 'isolated' (not connected to the hub)
+
+
+# build date of the graph of the profile from /v2/status (ORS 8: graph_build_date, ORS 7: creation_date of the
+# profile entry), None if the instance does not report it
+def graph_build(url, profile, timeout=30):
+    try:
+        with urllib.request.urlopen(f'{url}/v2/status', timeout=timeout) as response:
+            status = json.loads(response.read())
+    except (OSError, ValueError) as e:
+        logging.info(f"ORS status not available: {e}")
+        return None
+    for name, entry in (status.get('profiles') or {}).items():
+        if profile in (name, entry.get('profiles'), entry.get('encoder_name')):
+            return entry.get('graph_build_date') or entry.get('creation_date')
+    return None
+
+
+# cache file of the graph build, e.g. snap_cache/driving-car_350m_20250801T120000Z.csv; None without a build
+# date, the points are then checked without cache
+def graph_cache_path(cache_path, url, profile):
+    build = graph_build(url, profile)
+    if not build:
+        return None
+    root, ext = os.path.splitext(cache_path)
+    return f"{root}_{re.sub(r'[^0-9A-Za-z]', '', build)}{ext}"
+
+
+def load_cache(path):
+    if path and os.path.exists(path):
+        return pd.read_csv(path, dtype={'gid': 'int64'}).set_index('gid')
+    return pd.DataFrame(columns=cache_columns).astype({'gid': 'int64'}).set_index('gid')
+
+
+# merge with the cache on disk, so regions checked at the same time in other processes are kept
+def save_cache(path, checked):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    cache = pd.concat([load_cache(path), checked])
+    cache = cache[~cache.index.duplicated(keep='last')]
+    tmp = f'{path}.{os.getpid()}.tmp'
+    cache.reset_index().to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+# request_slots: semaphore shared with other regions, see MatrixScheduler.request
+async def limited(request_slots, make_request):
+    if request_slots is None:
+        return await make_request()
+    await asyncio.get_running_loop().run_in_executor(None, request_slots.acquire)
+    try:
+        return await make_request()
+    finally:
+        request_slots.release()
+
+
+# snapped lon/lat and snap distance (m) per point, NaN where ORS finds no road of the profile within radius;
+# returns None if the ORS instance has no snap endpoint (ORS < 7.1)
+async def snap(session, url, profile, lonlat, radius, batch_size, request_slots=None):
+    snapped = np.full(lonlat.shape, np.nan)
+    distance = np.full(len(lonlat), np.nan)
+    for start in range(0, len(lonlat), batch_size):
+        body = {'locations': np.round(lonlat[start:start + batch_size], 6).tolist(), 'radius': radius}
+
+        async def post():
+            async with session.post(f'{url}/v2/snap/{profile}', json=body) as response:
+                return response.status, await response.text()
+        status, text = await limited(request_slots, post)
+        if status == 404:
+            return None
+        if status != 200:
+            raise ors_matrix.OrsError(status, None, text[:200])
+        result = json.loads(text)
+        for i, location in enumerate(result['locations']):
+            if location:
+                snapped[start + i] = location['location']
+                distance[start + i] = location.get('snapped_distance', 0)
+    return snapped, distance
+
+
+# durations between the hub (lon/lat) and the points (from the hub and to the hub), one request per max_routes
+# points; points ORS can not snap are added to not_snapped, points over the visited nodes limit count as connected
+async def hub_durations(session, url, profile, lonlat, hub, points, max_routes, not_snapped, request_slots=None):
+    from_hub = np.full(len(lonlat), np.nan)
+    to_hub = np.full(len(lonlat), np.nan)
+
+    async def solve(part):
+        part = part[~np.isin(part, list(not_snapped))]
+        if len(part) == 0:
+            return
+        durations_from = None
+        try:
+            durations_from, _ = await limited(request_slots, lambda: ors_matrix.request_matrix(
+                session, url, profile, hub[None], lonlat[part]))
+            durations_to, _ = await limited(request_slots, lambda: ors_matrix.request_matrix(
+                session, url, profile, lonlat[part], hub[None]))
+        except ors_matrix.OrsError as e:
+            index = ors_matrix.coordinate_index(e)
+            if index is not None:
+                # locations are [hub, part] in the request from the hub and [part, hub] in the request to the hub
+                index = index - 1 if durations_from is None else index
+                if not 0 <= index < len(part):
+                    raise
+                not_snapped.add(part[index])
+                return await solve(part)
+            if e.code in (ors_matrix.VISITED_NODES, ors_matrix.PARAMETER_LIMITS) and len(part) > 1:
+                await solve(part[:len(part) // 2])
+                return await solve(part[len(part) // 2:])
+            if e.code == ors_matrix.VISITED_NODES:
+                from_hub[part] = to_hub[part] = 0
+                return
+            raise
+        from_hub[part] = durations_from[0]
+        to_hub[part] = durations_to[:, 0]
+
+    for part in np.array_split(points, max(1, -(-len(points) // max_routes))):
+        await solve(part)
+    return from_hub, to_hub
+
+
+# check points (global ids and lon/lat) that are not in the cache yet, returns the new rows
+async def _check(gids, lonlat, cache, url, profile, radius, max_routes, timeout, request_slots, hubs=3, batch_size=2000):
+    new = ~np.isin(gids, cache.index.to_numpy())
+    known = cache[cache.index.isin(gids) & (cache['status'] == 'ok')][['snapped_lon', 'snapped_lat']].to_numpy(dtype=float)
+    gids, first = np.unique(gids[new], return_index=True)
+    lonlat = lonlat[new][first]
+    checked = pd.DataFrame({'gid': gids, 'lon': lonlat[:, 0], 'lat': lonlat[:, 1]}).set_index('gid')
+    if len(checked) == 0:
+        return checked
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        snapped = await snap(session, url, profile, lonlat, radius, batch_size, request_slots)
+        if snapped is None:
+            logging.info("ORS has no snap endpoint, points are checked with the hub requests only")
+            snapped = lonlat.copy(), np.full(len(lonlat), np.nan)
+        snapped, distance = snapped
+        not_snapped = set(np.flatnonzero(np.isnan(snapped[:, 0])).tolist())
+        located = np.where(np.isnan(snapped), lonlat, snapped)
+
+        # hub: the point closest to the centre of the region (new or checked before), the next one if the hub
+        # itself lies on an isolated part of the graph; points are only flagged isolated by a hub that reaches
+        # at least half of them
+        candidates = np.setdiff1d(np.arange(len(gids)), list(not_snapped))
+        connected = np.ones(len(gids), dtype=bool)
+        pool = np.concatenate([located[candidates], known])
+        if len(candidates) and len(pool) > 1:
+            by_distance = pool[np.argsort(np.hypot(*(pool - np.median(pool, axis=0)).T))]
+            for hub in by_distance[:hubs]:
+                try:
+                    from_hub, to_hub = await hub_durations(session, url, profile, located, hub, candidates,
+                                                           max_routes, not_snapped, request_slots)
+                except ors_matrix.OrsError as e:
+                    logging.info(f"Hub {hub} not usable: {e}")
+                    continue
+                reached = ~np.isnan(from_hub) & ~np.isnan(to_hub)
+                share = reached[np.setdiff1d(candidates, list(not_snapped))].mean()
+                if share >= 0.5:
+                    connected = reached
+                    break
+                logging.info(f"Hub {hub} reaches only {share:.0%} of the points")
+            else:
+                logging.warning(f"No hub reaches half of the points ({hubs} tried), no point is flagged as isolated")
+
+    status = np.where(connected, 'ok', 'isolated').astype(object)
+    status[list(not_snapped)] = 'not_snapped'
+    checked['snapped_lon'], checked['snapped_lat'] = located[:, 0], located[:, 1]
+    checked['snap_dist_m'] = distance
+    checked['status'] = status
+    return checked
+
+
+# snapped locations and status of all points (rows in the order of gids), new points are checked and cached
+# cache_path: base name of the cache, the graph build date of the profile is added (graph_cache_path)
+def check_points(gids, lonlat, cache_path, url, profile, radius=350, max_routes=2500, timeout=600, request_slots=None):
+    cache_path = graph_cache_path(cache_path, url, profile)
+    if cache_path is None:
+        logging.info("No graph build date from ORS, points are checked without snap cache")
+    cache = load_cache(cache_path)
+    checked = asyncio.run(_check(gids, lonlat, cache, url, profile, radius, max_routes, timeout, request_slots))
+    if len(checked):
+        counts = checked['status'].value_counts().to_dict()
+        logging.info(f"> {len(checked)} new points checked for routability: {counts}")
+        if cache_path:
+            save_cache(cache_path, checked)
+        cache = pd.concat([cache, checked])
+    return cache.loc[gids]
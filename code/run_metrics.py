@@ -0,0 +1,302 @@
+# Machine-readable metrics of long runs (scripts 01 and 02, 01_02_regions_parallel.py)
+# Every event is appended as one JSON line to metrics_{region}.jsonl in the metrics folder of the run:
+# - 'stage': duration and peak memory (RSS) of a stage of a region
+# - 'request': one ORS matrix request with latency, routes, bytes sent and received, retries, status and error code
+# - 'split': a request split after an error (6020 visited nodes, 2004 parameter limits, ...)
+# - 'origins': a block of origins finished, with its duration, requests and splits
+# - 'progress': origins done of all origins, origins/s over the last `window` seconds and the ETA
+# With prometheus = True the totals are also written as Prometheus text (metrics_{region}.prom, e.g. for the
+# textfile collector of node_exporter), replaced at every progress update. With live = True a progress summary
+# is logged every `interval` seconds. After the run, report() (or `python run_metrics.py <folder>`) summarises
+# all files of the run and lists the slowest regions and origins.
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+latency_buckets = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+# --- MEMORY ---
+# resident memory (MB) of this process, 'VmRSS' (current) or 'VmHWM' (peak); on Linux the peak is read from
+# /proc and can be reset, elsewhere it is the peak since the start of the process (ru_maxrss or peak_wset)
+def rss_mb(field='VmHWM'):
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith(field)) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        unit = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is in bytes on macOS, in KB elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    except (ImportError, AttributeError):
+        return float('nan')
+
+
+# peak of the finished worker processes (interpolation, local routing), 0 if there were none
+def children_peak_mb():
+    try:
+        import resource
+    except ImportError:
+        return 0
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2 ** 20
+
+
+def reset_peak():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+# --- RECORDER ---
+# metrics of one region; stage() starts a stage and ends the one before, so linear scripts only mark the starts
+class RunMetrics:
+    def __init__(self, folder, region, prometheus=False, live=True, interval=60, window=300):
+        os.makedirs(folder, exist_ok=True)
+        self.region = region
+        self.path = os.path.join(folder, f'metrics_{region}.jsonl')
+        self.prom_path = os.path.join(folder, f'metrics_{region}.prom') if prometheus else None
+        self.file = open(self.path, 'a', encoding='utf-8', buffering=1)
+        self.live = live
+        self.interval = interval
+        self.window = window
+
+        self.current = None  # (stage, start)
+        self.stages = {}  # stage -> (seconds, peak MB)
+        self.requests = {}  # (outcome, code) -> count
+        self.latency_counts = np.zeros(len(latency_buckets) + 1, dtype='int64')
+        self.latency_sum = 0.0
+        self.recent_latency = deque(maxlen=1000)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.splits = {}  # reason -> count
+        self.done = 0
+        self.total = 0
+        self.history = deque()  # (time, origins done) within the window
+        self.last_progress = 0.0
+
+    def event(self, kind, **fields):
+        record = {'time': datetime.now().isoformat(timespec='milliseconds'), 'kind': kind, 'region': self.region, **fields}
+        self.file.write(json.dumps(record, default=_json_value) + '\n')
+
+    # --- stages ---
+    def stage(self, name):
+        self.end_stage()
+        reset_peak()
+        self.current = (name, time.perf_counter())
+
+    def end_stage(self):
+        if self.current is None:
+            return
+        name, start = self.current
+        self.current = None
+        seconds, peak = time.perf_counter() - start, max(rss_mb(), children_peak_mb())
+        self.stages[name] = (seconds, peak)
+        self.event('stage', stage=name, seconds=round(seconds, 3), peak_rss_mb=round(peak, 1))
+        self.write_prometheus()
+
+    # --- requests ---
+    def request(self, seconds, origins, destinations, bytes_sent, bytes_received, attempts, status, code=None):
+        outcome = 'ok' if status == 200 else 'error'
+        self.requests[(outcome, code)] = self.requests.get((outcome, code), 0) + 1
+        self.latency_counts[np.searchsorted(latency_buckets, seconds)] += 1
+        self.latency_sum += seconds
+        self.recent_latency.append(seconds)
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        self.retries += attempts - 1
+        self.event('request', seconds=round(seconds, 4), origins=origins, destinations=destinations,
+                   routes=origins * destinations, bytes_sent=bytes_sent, bytes_received=bytes_received,
+                   retries=attempts - 1, status=status, code=code)
+
+    def split(self, reason, origins, destinations):
+        self.splits[reason] = self.splits.get(reason, 0) + 1
+        self.event('split', reason=reason, origins=origins, destinations=destinations)
+
+    # --- progress ---
+    def origins(self, origin_ids, seconds, requests=None, splits=None, failed=0):
+        self.event('origins', ids=list(origin_ids), seconds=round(seconds, 3), requests=requests, splits=splits,
+                   failed=failed)
+
+    def progress(self, done, total, force=False):
+        now = time.perf_counter()
+        self.done, self.total = done, total
+        self.history.append((now, done))
+        while len(self.history) > 2 and now - self.history[1][0] > self.window:
+            self.history.popleft()
+        if not force and now - self.last_progress < self.interval:
+            return
+        self.last_progress = now
+        rate, eta = self.rate()
+        self.event('progress', done=done, total=total, origins_per_s=round(rate, 3),
+                   eta_s=None if eta is None else round(eta))
+        self.write_prometheus()
+        if self.live:
+            logging.info(self.summary())
+
+    # origins/s within the window and seconds until all origins are done
+    def rate(self):
+        (t0, done0), (t1, done1) = self.history[0], self.history[-1]
+        rate = (done1 - done0) / (t1 - t0) if t1 > t0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else None
+        return rate, eta
+
+    def summary(self):
+        rate, eta = self.rate()
+        text = f"[progress] {self.done}/{self.total} origins, {rate:.2f} origins/s, ETA " + \
+               (str(timedelta(seconds=round(eta))) if eta is not None else '-')
+        if self.recent_latency:
+            p50, p95 = np.percentile(self.recent_latency, [50, 95])
+            errors = sum(n for (outcome, _), n in self.requests.items() if outcome == 'error')
+            text += f", request latency p50 {p50:.2f} s p95 {p95:.2f} s, {errors} errors, " \
+                    f"{sum(self.splits.values())} splits, {self.retries} retries"
+        return text
+
+    # --- Prometheus text ---
+    def write_prometheus(self):
+        if not self.prom_path:
+            return
+        region = _label(self.region)
+        lines = []
+
+        def metric(name, kind, help_text, samples, suffix=''):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join([f'region="{region}"'] + [f'{k}="{_label(v)}"' for k, v in labels.items()])
+                lines.append(f'{name}{suffix}{{{label_text}}} {value}')
+
+        metric('accessibility_stage_seconds', 'gauge', 'Duration of the stages of the region',
+               [({'stage': s}, round(v[0], 3)) for s, v in self.stages.items()])
+        metric('accessibility_stage_peak_rss_bytes', 'gauge', 'Peak resident memory during the stage',
+               [({'stage': s}, int(v[1] * 2 ** 20)) for s, v in self.stages.items() if np.isfinite(v[1])])
+        metric('accessibility_ors_requests_total', 'counter', 'ORS matrix requests by outcome and error code',
+               [({'outcome': outcome, 'code': code or ''}, n) for (outcome, code), n in self.requests.items()])
+        cumulative = np.cumsum(self.latency_counts)
+        metric('accessibility_ors_request_seconds', 'histogram', 'Latency of the ORS matrix requests',
+               [({'le': str(b)}, int(c)) for b, c in zip(latency_buckets + ['+Inf'], cumulative)], suffix='_bucket')
+        lines.append(f'accessibility_ors_request_seconds_sum{{region="{region}"}} {round(self.latency_sum, 3)}')
+        lines.append(f'accessibility_ors_request_seconds_count{{region="{region}"}} {int(cumulative[-1])}')
+        metric('accessibility_ors_request_bytes_total', 'counter', 'Payload of the ORS matrix requests',
+               [({'direction': 'sent'}, self.bytes_sent), ({'direction': 'received'}, self.bytes_received)])
+        metric('accessibility_ors_retries_total', 'counter', 'Retries after gateway or connection errors',
+               [({}, self.retries)])
+        metric('accessibility_ors_splits_total', 'counter', 'Requests split after an error',
+               [({'reason': r}, n) for r, n in self.splits.items()])
+        rate, eta = self.rate() if self.history else (0.0, None)
+        metric('accessibility_origins_done', 'gauge', 'Origins with a finished matrix', [({}, self.done)])
+        metric('accessibility_origins_total', 'gauge', 'Origins of the matrix', [({}, self.total)])
+        metric('accessibility_origins_per_second', 'gauge', 'Origins per second over the last minutes', [({}, round(rate, 3))])
+        if eta is not None:
+            metric('accessibility_eta_seconds', 'gauge', 'Estimated seconds until the matrix is complete', [({}, round(eta))])
+
+        tmp = self.prom_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self.prom_path)
+
+    def close(self):
+        self.end_stage()
+        if self.history:
+            self.progress(self.done, self.total, force=True)
+        self.write_prometheus()
+        self.file.close()
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def _json_value(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+# --- REPORT ---
+def read_events(paths):
+    files = []
+    for path in paths:
+        files += sorted(glob.glob(os.path.join(path, 'metrics_*.jsonl'))) if os.path.isdir(path) else [path]
+    records = []
+    for path in files:
+        with open(path, encoding='utf-8') as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame(records)
+
+
+# tables of a run (folders or files): stages per region, requests per region, slowest regions and slowest origin blocks
+def report(paths, top=10):
+    events = read_events(paths)
+    tables = {}
+    if events.empty:
+        return tables
+    stages = events[events['kind'] == 'stage']
+    if not stages.empty:
+        tables['stage seconds'] = stages.pivot_table(index='region', columns='stage', values='seconds', aggfunc='sum').round(1)
+        tables['stage peak RSS (MB)'] = stages.pivot_table(index='region', columns='stage', values='peak_rss_mb', aggfunc='max').round(0)
+        totals = stages.groupby('region')['seconds'].sum().sort_values(ascending=False)
+        tables['slowest regions'] = totals.head(top).round(1).to_frame('seconds')
+
+    requests = events[events['kind'] == 'request']
+    if not requests.empty:
+        grouped = requests.groupby('region')
+        tables['requests'] = pd.DataFrame({
+            'requests': grouped.size(),
+            'errors': grouped['status'].apply(lambda s: int((s != 200).sum())),
+            'p50_s': grouped['seconds'].quantile(0.5),
+            'p95_s': grouped['seconds'].quantile(0.95),
+            'max_s': grouped['seconds'].max(),
+            'retries': grouped['retries'].sum().astype(int),
+            'MB_sent': grouped['bytes_sent'].sum() / 1e6,
+            'MB_received': grouped['bytes_received'].sum() / 1e6,
+        }).round(2)
+        errors = requests[requests['status'] != 200]
+        if not errors.empty:
+            codes = errors['code'].apply(lambda c: str(int(c)) if isinstance(c, float) else str(c))
+            tables['errors by code'] = errors.groupby(['region', codes]).size().to_frame('requests')
+    splits = events[events['kind'] == 'split']
+    if not splits.empty:
+        tables['splits'] = splits.groupby(['region', 'reason']).size().to_frame('splits')
+
+    origins = events[events['kind'] == 'origins']
+    if not origins.empty:
+        slowest = origins.sort_values('seconds', ascending=False).head(top)
+        ids = slowest['ids'].apply(lambda ids: ', '.join(map(str, ids[:5])) + (' ...' if len(ids) > 5 else ''))
+        tables['slowest origins'] = pd.DataFrame({'region': slowest['region'], 'origins': ids,
+                                                  'seconds': slowest['seconds'],
+                                                  'requests': slowest['requests'].astype('Int64'),
+                                                  'splits': slowest['splits'].astype('Int64')}).reset_index(drop=True)
+    return tables
+
+
+def report_text(paths, top=10):
+    return '\n'.join(f"\n{name}:\n{table.to_string()}" for name, table in report(paths, top).items())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report of the metrics of a run")
+    parser.add_argument('paths', nargs='+', help="metrics folder of the run (output/metrics/<date_time>) or jsonl files")
+    parser.add_argument('--top', type=int, default=10, help="number of slowest regions and origins listed")
+    args = parser.parse_args()
+    print(report_text(args.paths, args.top))
@@ -0,0 +1,92 @@
+# Nearest join of urban structure polygons to the centrality points (alternative to step 6 of script 03)
+# The polygon layer (e.g. vacant lots, ALKIS parcels or building footprints of a whole state) is never loaded as a
+# whole: the extent of the region is cut into tiles, the polygons of each tile are read with a bounding box query
+# on the spatial index of the GeoPackage, joined to the nearest centrality point with one STRtree query and
+# appended to the output file, so memory depends on the tile size and not on the size of the layer.
+# Same result as shapes[region_shape, ] %>% st_join(points, join = st_nearest_feature) in script 03.
+
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyogrio
+import shapely
+from pyproj import Transformer
+
+point_fields = ['CC_mean', 'CC_mean_car', 'CC_mean_shortdist', 'Gem_layer']
+
+
+# tiles of tile_size over bounds (units of the CRS of the layer), as (xmin, ymin, xmax, ymax)
+def tile_bounds(bounds, tile_size):
+    xmin, ymin, xmax, ymax = bounds
+    n_x = max(1, int(np.ceil((xmax - xmin) / tile_size)))
+    n_y = max(1, int(np.ceil((ymax - ymin) / tile_size)))
+    for i in range(n_x):
+        for j in range(n_y):
+            yield (xmin + i * tile_size, ymin + j * tile_size,
+                   min(xmax, xmin + (i + 1) * tile_size), min(ymax, ymin + (j + 1) * tile_size))
+
+
+# polygons of the layer in the region, tile by tile, in crs; a polygon read in several tiles is only returned with
+# the first tile its geometry intersects. The bounding box query may also return polygons whose envelope but not
+# geometry reaches a tile (e.g. L-shaped ones), so the geometry is checked against this tile and the earlier ones.
+def iter_region_shapes(shapes_path, layer, region_shape, crs, columns=None, tile_size=5000):
+    # extent of the region in the CRS of the layer (densified, edges of the extent may bend in another CRS)
+    layer_crs = pyogrio.read_info(shapes_path, layer=layer)['crs'] or crs
+    xmin, ymin, xmax, ymax = Transformer.from_crs(crs, layer_crs, always_xy=True).transform_bounds(
+        *region_shape.bounds, densify_pts=21)
+    shapely.prepare(region_shape)
+    for bbox in tile_bounds((xmin, ymin, xmax, ymax), tile_size):
+        shapes = pyogrio.read_dataframe(shapes_path, layer=layer, bbox=bbox, columns=columns)
+        if len(shapes) == 0:
+            continue
+        # tiles are read column by column: earlier tiles are left of this column or below this tile in the column
+        tile_xmin, tile_ymin, tile_xmax, _ = bbox
+        geometry = shapes.geometry.to_numpy()
+        earlier = (shapely.intersects(geometry, shapely.box(xmin, ymin, tile_xmin, ymax)) & (tile_xmin > xmin)) | \
+                  (shapely.intersects(geometry, shapely.box(tile_xmin, ymin, tile_xmax, tile_ymin)) & (tile_ymin > ymin))
+        first = shapely.intersects(geometry, shapely.box(*bbox)) & ~earlier
+        shapes = shapes[first].to_crs(crs)
+        shapes = shapes[shapely.intersects(region_shape, shapes.geometry.to_numpy())]
+        if len(shapes):
+            yield shapes
+
+
+# values of the nearest point for every polygon; with several points at the same distance (e.g. inside the
+# polygon) the first one is used like in st_nearest_feature
+def nearest_points(shapes, points):
+    tree = shapely.STRtree(points.geometry.to_numpy())
+    shape_idx, point_idx = tree.query_nearest(shapes.geometry.to_numpy(), all_matches=True)
+    order = np.lexsort((point_idx, shape_idx))
+    shape_idx, point_idx = shape_idx[order], point_idx[order]
+    first = np.unique(shape_idx, return_index=True)[1]
+    nearest = np.zeros(len(shapes), dtype=int)
+    nearest[shape_idx[first]] = point_idx[first]
+    return nearest
+
+
+# join the polygons of the region to the nearest centrality point and write them to outname tile by tile
+# (fields OBJECTID, Shape_Area, CC_mean, CC_mean_car, CC_mean_shortdist, Gem_layer as in script 03)
+def join_region(shapes_path, layer, points, region_shape, crs, outname, id_col='id_vl', area_col='area_m2',
+                tile_size=5000):
+    points = points.to_crs(crs)
+    out_layer = os.path.splitext(os.path.basename(outname))[0]
+    tmp = outname + '.tmp.gpkg'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    written = 0
+    for shapes in iter_region_shapes(shapes_path, layer, region_shape, crs, [id_col, area_col], tile_size):
+        nearest = nearest_points(shapes, points)
+        joined = gpd.GeoDataFrame({
+            'OBJECTID': shapes[id_col].to_numpy(),
+            'Shape_Area': shapes[area_col].to_numpy(),
+            **{field: points[field].to_numpy()[nearest] for field in point_fields},
+        }, geometry=shapes.geometry.to_numpy(), crs=crs)
+        pyogrio.write_dataframe(joined, tmp, layer=out_layer, driver='GPKG', append=written > 0, promote_to_multi=True)
+        written += len(joined)
+    if written == 0:
+        empty = gpd.GeoDataFrame(pd.DataFrame(columns=['OBJECTID', 'Shape_Area'] + point_fields),
+                                 geometry=gpd.GeoSeries([], crs=crs), crs=crs)
+        pyogrio.write_dataframe(empty, tmp, layer=out_layer, driver='GPKG', geometry_type='MultiPolygon')
+    os.replace(tmp, outname)
+    return written
@@ -0,0 +1,153 @@
+# Content-hashed cache of the pipeline stages in scripts 01 and 02
+# The key of a stage is a hash of the stage name, its parameters and the content of its input files. The outputs
+# of a stage are copied to output/cache/<stage>/<key>/ and copied back into the output paths of a later run with
+# the same key, e.g. in the new dated output folder of a rerun on another day. A changed input or parameter gives
+# a new key and the stage is computed again.
+# Copies and not hard links: QGIS and OGR open some outputs for update (e.g. native:createspatialindex on the
+# census points of script 01 in script 02), which would change a linked file in the cache as well.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import pandas as pd
+import geopandas as gpd
+
+digest_file = 'digests.json'
+manifest_file = 'manifest.json'
+
+
+# sha256 of a file, or of the relative paths and contents of all files in a folder
+# GeoPackages store the time they were written, so their features are hashed instead of the bytes
+def _hash_file(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    if path.endswith('.gpkg'):
+        gdf = gpd.read_file(path)
+        frame = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+        frame['geometry_wkb'] = gdf.geometry.to_wkb()
+        digest.update(str(gdf.crs).encode())
+        digest.update(','.join(frame.columns).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _iter_files(folder):
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, folder), path
+
+
+class StageCache:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # digests of large inputs (census data, road networks) are computed once per file version (size, mtime)
+        self.digest_path = os.path.join(root, digest_file)
+        self.digests = {}
+        if os.path.exists(self.digest_path):
+            with open(self.digest_path) as f:
+                self.digests = json.load(f)
+
+    def file_digest(self, path):
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for rel, file in _iter_files(path):
+                digest.update(f'{rel}:{self.file_digest(file)}'.encode())
+            return digest.hexdigest()
+        stat = os.stat(path)
+        version = f'{stat.st_size}:{stat.st_mtime_ns}'
+        known = self.digests.get(path)
+        if known and known[0] == version:
+            return known[1]
+        digest = _hash_file(path)
+        self.digests[path] = [version, digest]
+        with open(self.digest_path + '.tmp', 'w') as f:
+            json.dump(self.digests, f)
+        os.replace(self.digest_path + '.tmp', self.digest_path)
+        return digest
+
+    # params: dict of parameter values (json serialisable), inputs: list of files/folders (None entries are skipped)
+    def key(self, stage, params, inputs):
+        content = {
+            'stage': stage,
+            'params': params,
+            'inputs': [self.file_digest(path) for path in inputs if path is not None],
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()[:20]
+
+    def entry(self, stage, key):
+        return os.path.join(self.root, stage, key)
+
+    # copy the cached outputs of a stage to the output paths, returns False if the key is not in the cache
+    def restore(self, stage, key, outputs):
+        entry = self.entry(stage, key)
+        if not os.path.exists(os.path.join(entry, manifest_file)):
+            return False
+        for i, output in enumerate(outputs):
+            cached = os.path.join(entry, str(i))
+            if not os.path.exists(cached):
+                return False
+            if os.path.isdir(cached):
+                for rel, file in _iter_files(cached):
+                    _copy(file, os.path.join(output, rel))
+            else:
+                _copy(cached, output)
+        os.utime(os.path.join(entry, manifest_file))  # last use for evict
+        return True
+
+    # keep the outputs of a stage under its key (outputs as in restore, all of them must exist)
+    def store(self, stage, key, outputs):
+        entry = self.entry(stage, key)
+        if os.path.exists(os.path.join(entry, manifest_file)):
+            return
+        tmp = entry + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for i, output in enumerate(outputs):
+            if os.path.isdir(output):
+                for rel, file in _iter_files(output):
+                    _copy(file, os.path.join(tmp, str(i), rel))
+            else:
+                _copy(output, os.path.join(tmp, str(i)))
+        with open(os.path.join(tmp, manifest_file), 'w') as f:
+            json.dump({'stage': stage, 'outputs': [os.path.abspath(o) for o in outputs], 'created': time.time()}, f)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+
+    # remove the least recently used entries until the cache is smaller than max_bytes; matrices are by far the
+    # largest entries, so these are the ones that go first once they are not used any more
+    def evict(self, max_bytes):
+        entries = []
+        for stage in os.listdir(self.root):
+            if not os.path.isdir(os.path.join(self.root, stage)):
+                continue
+            for key in os.listdir(os.path.join(self.root, stage)):
+                manifest = os.path.join(self.root, stage, key, manifest_file)
+                if os.path.exists(manifest):
+                    size = sum(os.path.getsize(file) for _, file in _iter_files(os.path.dirname(manifest)))
+                    entries.append((os.path.getmtime(manifest), size, os.path.dirname(manifest)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        return total
+
+
+def _copy(source, target):
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    if os.path.exists(target):
+        if os.path.samefile(source, target):
+            return
+        os.remove(target)
+    # copy next to the target and rename, an interrupted copy never looks like a complete output
+    shutil.copy2(source, target + '.part')
+    os.replace(target + '.part', target)
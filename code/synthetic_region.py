@@ -0,0 +1,173 @@
+# Synthetic regions for the benchmarks (benchmark.py)
+# Writes a workspace with the same inputs as the Aachen test data at any size: municipalities with a `region` field,
+# a Zensus csv with 100 m cells (EPSG:3035 centroids, only cells with population like the census), a road network
+# in the schema of the OSM lines layer (lattice with jitter or random Delaunay roads, denser in the towns) and
+# vacant lot polygons along the roads. Population is a sum of towns with Gaussian density on a rural background.
+# All values are drawn from one seed, so a size always gives the same region.
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from pyproj import Transformer
+from scipy.spatial import Delaunay
+
+crs = 'EPSG:25832'
+zensus_crs = 'EPSG:3035'
+centre = (295000, 5630000)  # around Aachen
+
+
+def region_extent(size_km):
+    half = size_km * 500
+    return (centre[0] - half, centre[1] - half, centre[0] + half, centre[1] + half)
+
+
+# towns as (x, y, sigma in m, peak inhabitants per 100 m cell), about one per 100 km²
+def towns(extent, rng):
+    xmin, ymin, xmax, ymax = extent
+    n = max(1, int(round((xmax - xmin) * (ymax - ymin) / 100e6)))
+    xy = rng.uniform((xmin, ymin), (xmax, ymax), size=(n, 2))
+    sigma = rng.lognormal(np.log(1200), 0.5, n)
+    peak = rng.lognormal(np.log(60), 0.6, n)
+    # the first town is the city in the middle
+    xy[0] = (xmin + xmax) / 2, (ymin + ymax) / 2
+    sigma[0], peak[0] = 2500, 80
+    return xy, sigma, peak
+
+
+def density(xy, towns_xy, sigma, peak):
+    d2 = ((xy[:, None, :] - towns_xy[None, :, :]) ** 2).sum(axis=2)
+    return (peak * np.exp(-d2 / (2 * sigma ** 2))).sum(axis=1)
+
+
+# census cells of the extent (plus buffer) with their population, rural cells are populated at random
+def census_cells(extent, buffer, towns_xy, sigma, peak, rng, rural_share=0.08, chunk=200_000):
+    xmin, ymin, xmax, ymax = extent
+    to_3035 = Transformer.from_crs(crs, zensus_crs, always_xy=True)
+    bxmin, bymin, bxmax, bymax = to_3035.transform_bounds(xmin - buffer, ymin - buffer, xmax + buffer, ymax + buffer)
+    x = np.arange(np.floor(bxmin / 100) * 100 + 50, bxmax, 100)
+    y = np.arange(np.floor(bymin / 100) * 100 + 50, bymax, 100)
+    to_crs = Transformer.from_crs(zensus_crs, crs, always_xy=True)
+    cells = []
+    for start in range(0, len(x) * len(y), chunk):
+        index = np.arange(start, min(start + chunk, len(x) * len(y)))
+        cx, cy = x[index // len(y)], y[index % len(y)]
+        mean = density(np.column_stack(to_crs.transform(cx, cy)), towns_xy, sigma, peak)
+        mean += np.where(rng.random(len(index)) < rural_share, rng.exponential(8, len(index)), 0)
+        population = rng.poisson(mean)
+        keep = population > 0
+        cells.append(pd.DataFrame({'x_mp_100m': cx[keep].astype('int32'), 'y_mp_100m': cy[keep].astype('int32'),
+                                   'Einwohner': population[keep]}))
+    cells = pd.concat(cells, ignore_index=True)
+    cells.insert(0, 'GITTER_ID_100m', [f'CRS3035RES100mN{y}E{x}' for x, y in zip(cells['x_mp_100m'] - 50, cells['y_mp_100m'] - 50)])
+    return cells
+
+
+# lattice of straight roads every `spacing` m, moved by a random jitter, with extra streets in the towns
+def lattice_roads(extent, spacing, towns_xy, sigma, rng, jitter=0.3):
+    xmin, ymin, xmax, ymax = extent
+    lines = []
+    for x in np.arange(xmin + spacing / 2, xmax, spacing) + rng.uniform(-jitter, jitter) * spacing:
+        lines.append(shapely.linestrings([(x, ymin), (x, ymax)]))
+    for y in np.arange(ymin + spacing / 2, ymax, spacing) + rng.uniform(-jitter, jitter) * spacing:
+        lines.append(shapely.linestrings([(xmin, y), (xmax, y)]))
+    for (tx, ty), s in zip(towns_xy, sigma):
+        local = max(spacing / 4, 100)
+        for offset in np.arange(-2 * s, 2 * s, local):
+            lines.append(shapely.linestrings([(tx + offset, ty - 2 * s), (tx + offset, ty + 2 * s)]))
+            lines.append(shapely.linestrings([(tx - 2 * s, ty + offset), (tx + 2 * s, ty + offset)]))
+    return shapely.clip_by_rect(np.array(lines), xmin, ymin, xmax, ymax)
+
+
+# edges of a Delaunay triangulation of random junctions, junctions drawn in proportion to the population
+def random_roads(extent, spacing, towns_xy, sigma, peak, rng):
+    xmin, ymin, xmax, ymax = extent
+    n = int((xmax - xmin) * (ymax - ymin) / spacing ** 2)
+    candidates = rng.uniform((xmin, ymin), (xmax, ymax), size=(4 * n, 2))
+    weight = density(candidates, towns_xy, sigma, peak) + peak.mean() * 0.05
+    junctions = candidates[rng.choice(len(candidates), n, replace=False, p=weight / weight.sum())]
+    triangles = Delaunay(junctions).simplices
+    edges = np.unique(np.sort(np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [0, 2]]]), axis=1), axis=0)
+    lines = shapely.linestrings(junctions[edges])
+    # no long edges across the hull
+    return lines[shapely.length(lines) < 4 * spacing]
+
+
+def highway_layer(lines, rng):
+    kinds = np.array(['primary', 'secondary', 'tertiary', 'residential', 'unclassified'])
+    highway = kinds[rng.choice(len(kinds), len(lines), p=[0.05, 0.1, 0.15, 0.5, 0.2])]
+    lines = gpd.GeoDataFrame({'osm_id': np.arange(1, len(lines) + 1).astype(str), 'name': None,
+                              'highway': highway, 'other_tags': None}, geometry=lines, crs=crs)
+    return lines[~lines.geometry.is_empty].reset_index(drop=True)
+
+
+# municipalities: Voronoi cells of random seeds in the extent, all in one region
+def municipalities(extent, region_name, rng, n=None):
+    xmin, ymin, xmax, ymax = extent
+    n = n or max(2, int((xmax - xmin) * (ymax - ymin) / 50e6))
+    seeds = shapely.multipoints(rng.uniform((xmin, ymin), (xmax, ymax), size=(n, 2)))
+    cells = shapely.get_parts(shapely.voronoi_polygons(seeds, extend_to=shapely.box(*extent)))
+    cells = shapely.clip_by_rect(cells, *extent)
+    return gpd.GeoDataFrame({'GEN': [f'Gemeinde {i + 1}' for i in range(len(cells))], 'region': region_name},
+                            geometry=cells, crs=crs)
+
+
+# rectangular lots next to random points of the roads
+def vacant_lots(lines, n, rng):
+    lines = lines.geometry.to_numpy()
+    lines = lines[rng.choice(len(lines), n, p=shapely.length(lines) / shapely.length(lines).sum())]
+    xy = shapely.get_coordinates(shapely.line_interpolate_point(lines, rng.random(n), normalized=True))
+    xy += rng.normal(0, 30, size=xy.shape)
+    width, height = rng.lognormal(np.log(25), 0.5, n), rng.lognormal(np.log(30), 0.5, n)
+    lots = shapely.box(xy[:, 0] - width / 2, xy[:, 1] - height / 2, xy[:, 0] + width / 2, xy[:, 1] + height / 2)
+    return gpd.GeoDataFrame({'id_vl': np.arange(1, n + 1), 'area_m2': shapely.area(lots)}, geometry=lots, crs=crs)
+
+
+# write the inputs of a synthetic region of size_km x size_km into worksp/input, returns the file paths
+def make_region(worksp, size_km, network='lattice', road_spacing=250, buffer=10000, lots_per_km2=20,
+                region_name='Synth', seed=0):
+    rng = np.random.default_rng(seed)
+    extent = region_extent(size_km)
+    # roads and towns also cover the buffer, like the highways of the buffer in script 01
+    outer = (extent[0] - buffer, extent[1] - buffer, extent[2] + buffer, extent[3] + buffer)
+    towns_xy, sigma, peak = towns(outer, rng)
+    if network == 'lattice':
+        lines = lattice_roads(outer, road_spacing, towns_xy, sigma, rng)
+    elif network == 'random':
+        lines = random_roads(outer, road_spacing, towns_xy, sigma, peak, rng)
+    else:
+        raise ValueError(f"Unknown network {network!r}, use 'lattice' or 'random'")
+    highways = highway_layer(lines, rng)
+
+    input_folder = os.path.join(worksp, 'input')
+    os.makedirs(input_folder, exist_ok=True)
+    paths = {
+        'municipalities': os.path.join(input_folder, 'municipalites.gpkg'),
+        'zensus_csv': os.path.join(input_folder, 'Zensus2022_Bevoelkerungszahl_100m-Gitter.csv'),
+        'highways': os.path.join(input_folder, f'highways_{region_name}.gpkg'),
+        'vacant_lots': os.path.join(input_folder, 'vacant_lots.gpkg'),
+    }
+    municipalities(extent, region_name, rng).to_file(paths['municipalities'], driver="GPKG")
+    census_cells(extent, buffer, towns_xy, sigma, peak, rng).to_csv(paths['zensus_csv'], sep=';', index=False)
+    highways.to_file(paths['highways'], driver="GPKG")
+    inner = highways[highways.intersects(shapely.box(*extent))]
+    vacant_lots(inner, int(lots_per_km2 * size_km ** 2), rng).to_file(paths['vacant_lots'], driver="GPKG")
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write the inputs of a synthetic region")
+    parser.add_argument('worksp', help="workspace, the files are written to <worksp>/input")
+    parser.add_argument('--size-km', type=float, default=20, help="side of the square region")
+    parser.add_argument('--network', choices=['lattice', 'random'], default='lattice')
+    parser.add_argument('--road-spacing', type=float, default=250, help="mean distance between roads in m")
+    parser.add_argument('--buffer', type=float, default=10000, help="census and roads around the region (umkreis)")
+    parser.add_argument('--lots-per-km2', type=float, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    paths = make_region(args.worksp, args.size_km, args.network, args.road_spacing, args.buffer, args.lots_per_km2,
+                        seed=args.seed)
+    for name, path in paths.items():
+        print(f"{name}: {path}")
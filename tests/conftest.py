@@ -0,0 +1,45 @@
+# the helper modules are plain files in code/ (imported by the scripts via sys.path), the tests import them the same way
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# local ORS stand-in (code/mock_ors.py) in its own process for the duration of a test module
+def mock_ors_server(**settings):
+    import mock_ors
+    process, url = mock_ors.start(free_port(), **settings)
+    return process, url
+
+
+# matrix writer (see matrix_store.py) that keeps the written rows in memory: id -> (to_ids, duration_h, dist_km)
+class MemoryWriter:
+    def __init__(self):
+        self.rows = {}
+
+    def exists(self, point_id):
+        return point_id in self.rows
+
+    def write(self, from_ids, to_ids, duration_h, dist_km):
+        for i, point_id in enumerate(from_ids.tolist()):
+            self.rows[point_id] = (np.asarray(to_ids), np.asarray(duration_h[i]), np.asarray(dist_km[i]))
+
+    def close(self):
+        pass
+
+
+# points with ids 1..n at metric coordinates (EPSG:25832) as GeoPackage, like the road points of script 01
+def write_points(path, xy):
+    import geopandas as gpd
+    gpd.GeoDataFrame({'id': np.arange(1, len(xy) + 1)}, geometry=gpd.points_from_xy(xy[:, 0], xy[:, 1]),
+                     crs=25832).to_file(path, driver='GPKG')
+    return str(path)
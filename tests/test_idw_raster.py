@@ -0,0 +1,66 @@
+import numpy as np
+import rasterio
+import shapely
+from rasterio.windows import Window
+
+import idw_raster
+
+BOUNDS = (0, 0, 10000, 8000)
+RESOLUTION = 500
+# region with a notch, cells with the centre in the notch are NA
+REGION = shapely.difference(shapely.box(*BOUNDS), shapely.box(6000, 0, 10000, 3000))
+
+
+def sample_points():
+    rng = np.random.default_rng(4)
+    xy = rng.uniform(0, 10000, (60, 2)) * [1, 0.8]
+    xy[0] = (2250, 3750)  # on a cell centre
+    values = np.column_stack([rng.uniform(0, 1, 60), rng.uniform(0, 100, 60)])
+    return xy, values
+
+
+# gstat(nmax = 7, idp = 4) on every cell centre, one point at a time
+def brute_force(xy, values, centres, nmax=7, idp=4):
+    result = np.empty((len(centres), values.shape[1]))
+    for i, centre in enumerate(centres):
+        distance = np.hypot(*(xy - centre).T)
+        nearest = np.argsort(distance, kind='stable')[:nmax]
+        if distance[nearest[0]] == 0:
+            result[i] = values[nearest[0]]
+            continue
+        weight = 1 / distance[nearest] ** idp
+        result[i] = weight @ values[nearest] / weight.sum()
+    return result
+
+
+def test_idw_window_matches_brute_force():
+    xy, values = sample_points()
+    transform, width, height = idw_raster.raster_grid(BOUNDS, RESOLUTION)
+    assert (width, height) == (20, 16)
+    idw_raster._init_worker(xy, values, [REGION])
+    _, result = idw_raster.idw_window(Window(0, 0, width, height), transform, nmax=7, idp=4)
+
+    rows, cols = np.mgrid[0:height, 0:width]
+    x, y = (cols + 0.5) * RESOLUTION, BOUNDS[3] - (rows + 0.5) * RESOLUTION
+    inside = shapely.contains_xy(REGION, x, y)
+    expected = brute_force(xy, values, np.column_stack([x[inside], y[inside]]))
+    assert np.allclose(result[:, inside].T, expected, rtol=1e-5)
+    assert np.isnan(result[:, ~inside]).all()
+    # the cell with a point on its centre has the value of the point
+    assert np.allclose(result[:, 8, 4], values[0])
+
+
+def test_tiles_give_the_same_raster_as_one_tile(tmp_path):
+    xy, values = sample_points()
+    rasters = {}
+    for tile_size in (7, 512):
+        outpaths = [str(tmp_path / f'{field}_{tile_size}.tif') for field in ('a', 'b')]
+        idw_raster.interpolate(xy, values, [REGION], BOUNDS, 'EPSG:25832', outpaths, resolution=RESOLUTION,
+                               tile_size=tile_size, processes=2)
+        rasters[tile_size] = []
+        for path in outpaths:
+            with rasterio.open(path) as src:
+                rasters[tile_size].append(src.read(1))
+    for tiled, single in zip(rasters[7], rasters[512]):
+        assert np.array_equal(tiled, single, equal_nan=True)
+        assert not np.isnan(single).all()
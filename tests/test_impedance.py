@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+import impedance
+
+
+# steps 2 and 3 of script 03 on a matrix data frame (left_join of the destinations, weights, group_by sum)
+def r_centrality(matrix, destins, variant):
+    df = matrix[matrix['DURATION_H'] != 0].dropna(subset=['DURATION_H'])  # dplyr::filter drops NA conditions
+    joined = df.merge(destins, how='left', left_on='TO_ID', right_on='id')
+    decay_h = np.mean([impedance.powerexp(b1, b2, joined['DURATION_H']) for b1, b2 in variant['h']], axis=0)
+    decay_km = np.mean([impedance.powerexp(b1, b2, joined['DIST_KM']) for b1, b2 in variant['km']], axis=0)
+    joined['weight_exp_h'] = decay_h * joined['EW_10']
+    joined['weight_exp_km'] = decay_km * joined['EW_10']
+    # sum(na.rm = TRUE)
+    return joined.groupby('FROM_ID')[['weight_exp_h', 'weight_exp_km']].sum(min_count=0)
+
+
+def test_accessibility_sweep_matches_script_03():
+    rng = np.random.default_rng(3)
+    origin_ids = np.arange(1, 31)
+    dest_ids = np.arange(5, 26)
+    destins = pd.DataFrame({'id': dest_ids, 'EW_10': rng.integers(5, 400, len(dest_ids)).astype(float)})
+    from_id, to_id = (a.ravel() for a in np.meshgrid(origin_ids[:28], dest_ids, indexing='ij'))
+    dist_km = rng.uniform(0.5, 40, len(from_id))
+    matrix = pd.DataFrame({'FROM_ID': from_id, 'TO_ID': to_id, 'DURATION_H': dist_km / 60, 'DIST_KM': dist_km})
+    matrix.loc[matrix['FROM_ID'] == matrix['TO_ID'], ['DURATION_H', 'DIST_KM']] = 0  # origin itself
+    matrix.loc[rng.choice(len(matrix), 20, replace=False), ['DURATION_H', 'DIST_KM']] = np.nan  # no route
+    matrix.loc[len(matrix)] = [3, 99, 0.2, 10.0]  # destination without population (EW_10 < 5)
+    matrix = matrix.astype({'FROM_ID': 'int32', 'TO_ID': 'int32'})
+
+    variants = [impedance.powerexp_paper, impedance.negexp_paper]
+    # the matrix in two chunks like several part files
+    chunks = [{name: matrix[name].to_numpy()[part] for name in matrix}
+              for part in np.array_split(np.arange(len(matrix)), 2)]
+    exp_h_w, exp_km_w = impedance.accessibility_sweep(chunks, origin_ids, dest_ids, destins['EW_10'], variants)
+
+    for k, variant in enumerate(variants):
+        expected = r_centrality(matrix, destins, variant).reindex(origin_ids)
+        assert np.allclose(exp_h_w[k], expected['weight_exp_h'], equal_nan=True)
+        assert np.allclose(exp_km_w[k], expected['weight_exp_km'], equal_nan=True)
+    # origins 29 and 30 have no matrix rows and get no value
+    assert np.isnan(exp_h_w[:, -2:]).all()
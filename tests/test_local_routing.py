@@ -0,0 +1,97 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import local_routing
+from conftest import MemoryWriter, write_points
+
+NODES = {'A': (0, 0), 'B': (1000, 0), 'C': (2000, 0), 'D': (1000, 1000), 'E': (3000, 0)}
+# ways: node names, highway, other_tags; B -> D and C -> E are oneway, E is a dead end that can not be left
+WAYS = [
+    ('ABC', 'residential', None),  # 30 km/h
+    ('BD', 'primary', '"oneway"=>"yes"'),  # 65 km/h
+    ('DA', 'residential', None),
+    ('DC', 'secondary', '"maxspeed"=>"80"'),
+    ('CE', 'residential', '"oneway"=>"yes"'),
+]
+
+
+def highways():
+    return gpd.GeoDataFrame({
+        'highway': [w[1] for w in WAYS],
+        'other_tags': [w[2] for w in WAYS],
+    }, geometry=[shapely.LineString([NODES[n] for n in w[0]]) for w in WAYS], crs=25832)
+
+
+# fastest path between all nodes by trying every simple path: duration (h) and length (km), NaN if unreachable
+def brute_force():
+    edges = {}
+    for names, highway, other_tags in WAYS:
+        speed = local_routing.parse_speed(highway, local_routing.get_tag(other_tags, 'maxspeed'))
+        oneway = local_routing.parse_oneway(highway, other_tags)
+        for a, b in zip(names[:-1], names[1:]):
+            km = np.hypot(*np.subtract(NODES[b], NODES[a])) / 1000
+            if oneway >= 0:
+                edges.setdefault(a, []).append((b, km / speed, km))
+            if oneway <= 0:
+                edges.setdefault(b, []).append((a, km / speed, km))
+
+    best = {}
+
+    def walk(node, visited, hours, km):
+        start = visited[0]
+        if (start, node) not in best or hours < best[start, node][0]:
+            best[start, node] = (hours, km)
+        for nxt, h, k in edges.get(node, []):
+            if nxt not in visited:
+                walk(nxt, visited + [nxt], hours + h, km + k)
+
+    for n in NODES:
+        walk(n, [n], 0.0, 0.0)
+    names = list(NODES)
+    duration = pd.DataFrame(np.nan, index=names, columns=names)
+    distance = duration.copy()
+    for (a, b), (hours, km) in best.items():
+        if a != b:
+            duration.loc[a, b], distance.loc[a, b] = hours, km
+    return duration, distance
+
+
+def test_fastest_paths_match_brute_force():
+    graph = local_routing.build_graph(highways())
+    node = {tuple(xy): i for i, xy in enumerate(graph.node_xy.tolist())}
+    index = np.array([node[tuple(map(float, NODES[n]))] for n in NODES])
+    assert graph.n_nodes == 5
+
+    local_routing._init_worker(graph, index)
+    duration_h, dist_km = local_routing._route_chunk(index)
+    np.fill_diagonal(duration_h, np.nan)
+    np.fill_diagonal(dist_km, np.nan)
+    expected_h, expected_km = brute_force()
+    assert np.allclose(duration_h, expected_h, equal_nan=True)
+    assert np.allclose(dist_km, expected_km, equal_nan=True)
+    # B -> C is faster via the oneway and D than on the direct residential street
+    assert np.isclose(expected_km.loc['B', 'C'], 1 + np.sqrt(2))
+    # the dead end E can not be left: no route from E to any node
+    assert expected_h.loc['E'].isna().all() and np.isnan(duration_h[4, :4]).all()
+
+
+def test_run_matrix_snaps_to_the_strongly_connected_part(tmp_path):
+    highways_path = str(tmp_path / 'highways.gpkg')
+    highways().to_file(highways_path, driver='GPKG')
+    # near A and C, on D, next to the dead end E (snapped to C, not to E) and far from any road
+    points = write_points(tmp_path / 'points.gpkg', np.array([[0, 50], [2000, -30], [1000, 1000], [2900, 0],
+                                                              [5000, 5000]], dtype=float))
+    writer = MemoryWriter()
+    err = local_routing.run_matrix(highways_path, points, points, writer, max_snap=350, processes=1)
+    assert err == [4, 5]  # more than max_snap from the strongly connected part
+
+    expected_h, expected_km = brute_force()
+    to_ids, duration_h, dist_km = writer.rows[1]
+    assert to_ids.tolist() == [1, 2, 3, 4, 5]
+    assert np.allclose(duration_h[1:3], expected_h.loc['A', ['C', 'D']])
+    assert np.allclose(dist_km[1:3], expected_km.loc['A', ['C', 'D']])
+    # destinations beyond max_snap stay empty
+    assert np.isnan(duration_h[3:]).all() and np.isnan(dist_km[3:]).all()
+    assert set(writer.rows) == {1, 2, 3}
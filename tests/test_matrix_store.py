@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+import matrix_store
+
+TO_IDS = np.array([1, 2, 3])
+
+
+def write_region(store, region_name, from_ids, batch_rows=4):
+    writer = matrix_store.ArrowMatrixWriter(store, region_name, batch_rows=batch_rows)
+    duration_h = np.arange(len(from_ids) * 3, dtype=float).reshape(-1, 3) / 10
+    duration_h[0, 1] = np.nan  # unreachable pair
+    for i, from_id in enumerate(from_ids):
+        writer.write(np.array([from_id]), TO_IDS, duration_h[[i]], duration_h[[i]] * 50)
+    writer.close()
+    return duration_h
+
+
+def test_two_regions_round_trip(tmp_path):
+    store = str(tmp_path / 'matrix')
+    duration_h = write_region(store, 'Aachen', [10, 11, 12])
+    write_region(store, 'Bonn', [20, 21])
+
+    # one partition folder per region, a part file once batch_rows rows are buffered and one on close
+    assert sorted(os.listdir(store)) == ['region=Aachen', 'region=Bonn']
+    assert [os.path.basename(p) for p in matrix_store.part_files(store, 'Aachen')] == ['part-00000.arrow',
+                                                                                     'part-00001.arrow']
+
+    table = matrix_store.read_matrix(store, 'Aachen')
+    assert table.schema == matrix_store.matrix_schema
+    assert table.num_rows == 9
+    assert table['FROM_ID'].to_pylist() == [10] * 3 + [11] * 3 + [12] * 3
+    # NaN is written as null (NA in R), not as a float NaN
+    assert table['DURATION_H'].null_count == 1 and table['DIST_KM'].null_count == 1
+    assert table['DURATION_H'][1].as_py() is None
+    assert np.allclose(table['DURATION_H'].to_numpy(zero_copy_only=False), duration_h.ravel(), equal_nan=True)
+
+    # like arrow::open_dataset(...) %>% filter(region == !!region, DURATION_H != 0) in script 03
+    dataset = ds.dataset(store, format='arrow', partitioning='hive')
+    bonn = dataset.to_table(filter=(pc.field('region') == 'Bonn') & (pc.field('DURATION_H') != 0))
+    assert sorted(set(bonn['FROM_ID'].to_pylist())) == [20, 21]
+    assert bonn.num_rows == 6 - 2  # without the null and the zero duration
+
+
+def test_exists_resumes_from_written_parts(tmp_path):
+    store = str(tmp_path / 'matrix')
+    write_region(store, 'Aachen', [10, 11])
+    writer = matrix_store.ArrowMatrixWriter(store, 'Aachen')
+    assert writer.exists(10) and writer.exists(11) and not writer.exists(12)
+    writer.write(np.array([12]), TO_IDS, np.ones((1, 3)), np.ones((1, 3)))
+    assert not writer.exists(12)  # only origins in written part files count
+    writer.close()
+    assert writer.exists(12)
+    # the new part file does not overwrite the existing ones
+    assert matrix_store.read_matrix(store, 'Aachen').num_rows == 9
+
+
+def test_cli_converts_a_csv_folder(tmp_path):
+    matrix_folder = tmp_path / 'Aachen_50perc_25_08_04' / 'Matrizen'
+    matrix_folder.mkdir(parents=True)
+    csv_writer = matrix_store.CsvMatrixWriter(str(matrix_folder), 'Aachen', 1000)
+    duration_h = np.array([[0.0, 0.2, np.nan], [0.3, 0.0, 0.4]])
+    csv_writer.write(np.array([10, 11]), TO_IDS, duration_h, duration_h * 50)
+
+    script = os.path.join(os.path.dirname(matrix_store.__file__), 'matrix_store.py')
+    subprocess.run([sys.executable, script, str(matrix_folder), 'Aachen'], check=True, capture_output=True)
+    store = str(tmp_path / 'Aachen_50perc_25_08_04' / 'matrix')
+    table = matrix_store.read_matrix(store, 'Aachen').to_pandas().sort_values(['FROM_ID', 'TO_ID'])
+    assert table['FROM_ID'].tolist() == [10, 10, 10, 11, 11, 11]
+    assert np.allclose(table['DIST_KM'], (duration_h * 50).ravel(), equal_nan=True)
+    assert table['DURATION_H'].isna().sum() == 1
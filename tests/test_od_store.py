@@ -0,0 +1,123 @@
+import numpy as np
+
+import od_store
+from conftest import MemoryWriter, mock_ors_server, write_points
+
+
+def test_lookup_filters_by_global_ids(tmp_path):
+    store = od_store.OdStore(str(tmp_path))
+    store.append([1, 1, 2, 3], [10, 11, 10, 12], [0.1, 0.2, 0.3, 0.4], [1, 2, 3, 4])
+    store.close()
+    found = store.lookup([1, 3], [10, 12])
+    assert sorted(zip(found['FROM_GID'], found['TO_GID'])) == [(1, 10), (3, 12)]
+    assert len(store.lookup([4], [10])) == 0
+
+
+def test_pairs_without_route_are_not_stored(tmp_path):
+    store = od_store.OdStore(str(tmp_path))
+    store.append([1, 1, 1], [10, 11, 12], [0.1, np.nan, 0.3], [1, np.nan, np.nan])
+    store.close()
+    found = store.lookup([1], [10, 11, 12])
+    assert found['TO_GID'].tolist() == [10]
+
+
+def test_writer_routes_only_missing_pairs_and_fills_known_ones(tmp_path):
+    store = od_store.OdStore(str(tmp_path))
+    store.append([100], [201], [0.5], [5.0])
+    store.close()
+
+    writer = MemoryWriter()
+    shared = od_store.SharedWriter(writer, store, np.array([1, 2]), np.array([100, 101]),
+                                   np.array([1, 2]), np.array([200, 201]))
+    assert not shared.complete.any()
+    # destination 2 is known for origin 1 only, so both destinations are still routed for the block
+    assert shared.pending(np.array([1, 2]), np.array([0, 1])).tolist() == [0, 1]
+    assert shared.pending(np.array([1]), np.array([0, 1])).tolist() == [0]
+
+    shared.write(np.array([1]), np.array([1]), np.array([[0.1]]), np.array([[1.0]]))
+    shared.close()
+    to_ids, duration_h, dist_km = writer.rows[1]
+    assert to_ids.tolist() == [1, 2]
+    assert np.allclose(duration_h, [0.1, 0.5]) and np.allclose(dist_km, [1.0, 5.0])
+    assert len(store.lookup([100], [200, 201])) == 2  # the known pair is not stored twice
+
+
+def test_regions_running_at_the_same_time_share_pairs(tmp_path):
+    # both regions are started before either has routed a pair
+    store_a = od_store.OdStore(str(tmp_path), flush_seconds=0)
+    store_b = od_store.OdStore(str(tmp_path), flush_seconds=0)
+    writer_a = od_store.SharedWriter(MemoryWriter(), store_a, np.array([1]), np.array([100]),
+                                     np.array([1, 2]), np.array([200, 201]))
+    writer_b = od_store.SharedWriter(MemoryWriter(), store_b, np.array([7]), np.array([100]),
+                                     np.array([8, 9, 10]), np.array([200, 201, 202]))
+    writer_a.write(np.array([1]), np.array([1, 2]), np.array([[0.1, 0.2]]), np.array([[1.0, 2.0]]))
+
+    # region b finds the pairs of region a before its next block
+    assert writer_b.pending(np.array([7]), np.array([0, 1, 2])).tolist() == [2]
+    writer_b.write(np.array([7]), np.array([10]), np.array([[0.3]]), np.array([[3.0]]))
+    writer_a.close()
+    writer_b.close()
+    assert np.allclose(writer_b.writer.rows[7][1], [0.1, 0.2, 0.3])
+    assert len(store_a.lookup([100], [200, 201, 202])) == 3
+
+
+def test_own_pairs_are_not_kept_in_memory(tmp_path):
+    store = od_store.OdStore(str(tmp_path), flush_seconds=0)
+    other = od_store.OdStore(str(tmp_path), flush_seconds=0)
+    other.append([101], [200], [0.4], [4.0])  # another region routed one pair of origin 2 meanwhile
+    shared = od_store.SharedWriter(MemoryWriter(), store, np.array([1, 2]), np.array([100, 101]),
+                                   np.array([1, 2]), np.array([200, 201]))
+    assert list(shared.known) == [1]
+
+    # the part file of origin 1 is skipped, the known pairs of origin 2 are dropped once it is written
+    shared.write(np.array([1]), np.array([1, 2]), np.array([[0.1, 0.2]]), np.array([[1.0, 2.0]]))
+    assert len(store.part_files()) == 2
+    assert shared.pending(np.array([2]), np.array([0, 1])).tolist() == [1]
+    shared.write(np.array([2]), np.array([2]), np.array([[0.3]]), np.array([[3.0]]))
+    other.append([100, 101], [201, 201], [0.5, 0.5], [5.0, 5.0])  # late pairs of written origins
+    shared.pending(np.array([2]), np.array([0, 1]))
+    shared.close()
+    assert shared.known == {}
+    assert np.allclose(shared.writer.rows[2][1], [0.4, 0.3])
+
+
+def test_compact_merges_part_files(tmp_path):
+    store = od_store.OdStore(str(tmp_path))
+    for i in range(3):
+        store.append([i], [10], [0.1 * i], [float(i)])
+        store.flush()
+    assert len(store.part_files()) == 3
+    store.compact()
+    assert len(store.part_files()) == 1
+    found = store.lookup([0, 1, 2], [10]).sort_values('FROM_GID')
+    assert found['FROM_GID'].tolist() == [0, 1, 2]
+    assert np.allclose(found['DIST_KM'], [0, 1, 2])
+
+
+def test_second_region_routes_only_new_pairs(tmp_path):
+    import mock_ors
+    import ors_matrix
+
+    grid = np.array([(290000 + 1000 * i, 5625000 + 1000 * j) for i in range(4) for j in range(3)], dtype=float)
+    write_points(tmp_path / 'a.gpkg', grid[:8])
+    write_points(tmp_path / 'b.gpkg', grid[4:])  # 4 points in both regions
+    process, url = mock_ors_server(latency_ms=1)
+    try:
+        store = od_store.OdStore(str(tmp_path / 'store'))
+        writer_a = MemoryWriter()
+        assert ors_matrix.run_matrix(str(tmp_path / 'a.gpkg'), str(tmp_path / 'a.gpkg'), writer_a, url,
+                                     max_routes=8, shared_store=store) == []
+        routes = mock_ors.stats(url)['routes']
+        assert routes == 64
+
+        writer_b = MemoryWriter()
+        assert ors_matrix.run_matrix(str(tmp_path / 'b.gpkg'), str(tmp_path / 'b.gpkg'), writer_b, url,
+                                     max_routes=8, shared_store=store) == []
+        # one origin per block: 16 of the 64 pairs were routed for region a, the blocks of the 4 shared
+        # origins only route the 4 new destinations, the other 4 origins all 8
+        assert mock_ors.stats(url)['routes'] - routes == 4 * 4 + 4 * 8
+        # ids 1-4 of region b are ids 5-8 of region a
+        for b_id, a_id in zip(range(1, 5), range(5, 9)):
+            assert np.allclose(writer_b.rows[b_id][1][:4], writer_a.rows[a_id][1][4:], equal_nan=True)
+    finally:
+        process.terminate()
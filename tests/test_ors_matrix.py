@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+import mock_ors
+import ors_matrix
+from conftest import MemoryWriter, mock_ors_server, write_points
+
+# 6 x 5 road points 1 km apart, origins and destinations of one region
+GRID = np.array([(290000 + 1000 * i, 5625000 + 1000 * j) for i in range(6) for j in range(5)], dtype=float)
+
+
+@pytest.fixture
+def points(tmp_path):
+    path = write_points(tmp_path / 'points.gpkg', GRID)
+    ids, lonlat, _ = ors_matrix.read_points(path)
+    return path, ids, np.round(lonlat, 6)
+
+
+def run(path, max_routes=100, **settings):
+    process, url = mock_ors_server(latency_ms=1, **settings)
+    try:
+        writer = MemoryWriter()
+        failed = ors_matrix.run_matrix(path, path, writer, url, max_routes=max_routes, concurrency=2)
+        return writer, failed, mock_ors.stats(url)
+    finally:
+        process.terminate()
+
+
+# every routed pair has the values of the mock (straight line x detour at a fixed speed), pairs with a bad
+# destination are empty; all origins that are not bad are written
+def check_matrix(writer, ids, lonlat, bad):
+    for i in np.flatnonzero(~bad):
+        to_ids, duration_h, dist_km = writer.rows[ids[i]]
+        assert to_ids.tolist() == ids.tolist()
+        expected_km = mock_ors.distance_m(lonlat[[i]], lonlat)[0] * mock_ors.options['detour'] / 1000
+        assert np.allclose(dist_km[~bad], expected_km[~bad], rtol=1e-3, atol=1e-4)
+        assert np.allclose(duration_h[~bad], expected_km[~bad] / mock_ors.options['speed_kmh'], rtol=1e-3, atol=1e-4)
+        assert np.isnan(dist_km[bad]).all()
+
+
+def test_visited_nodes_errors_and_unroutable_points(points):
+    path, ids, lonlat = points
+    bad = mock_ors.unroutable(lonlat, 0.2)
+    assert 0 < bad.sum() < len(ids)
+    writer, failed, stats = run(path, fail_rate=0.3, unroutable_share=0.2)
+
+    # requests failing with 6020 are split until they work, points ORS cannot snap are left out:
+    # origins as failed, destinations as empty columns
+    assert stats['errors_6020'] > 0 and stats['errors_2010'] > 0
+    assert sorted(failed) == sorted(ids[bad].tolist())
+    assert set(writer.rows) == set(ids[~bad].tolist())
+    check_matrix(writer, ids, lonlat, bad)
+
+
+def test_requests_above_the_server_limit_are_split(points):
+    path, ids, lonlat = points
+    writer, failed, stats = run(path, maximum_routes=20)
+    assert stats['errors_2004'] > 0
+    assert failed == []
+    check_matrix(writer, ids, lonlat, np.zeros(len(ids), dtype=bool))
+
+
+def test_sporadic_failures_do_not_cap_the_request_size(tmp_path):
+    # 10 x 10 points 500 m apart, one origin x 100 destinations per block: 100 requests without failures
+    grid = np.array([(290000 + 500 * i, 5625000 + 500 * j) for i in range(10) for j in range(10)], dtype=float)
+    path = write_points(tmp_path / 'points.gpkg', grid)
+    writer, failed, stats = run(path, fail_rate=0.1)
+    assert stats['errors_6020'] > 0 and failed == []
+    assert len(writer.rows) == 100
+    # every failure costs its split parts and caps the following requests of the neighbourhood for a while, but
+    # not for the rest of the run (at one route per request the run would take up to 10000 requests)
+    assert stats['requests'] <= 2 * 100 + 4 * stats['errors_6020']
+
+
+def test_plan_blocks_respect_max_routes():
+    blocks = ors_matrix.plan_blocks(10, 30, 100)
+    assert all(len(o) * len(d) <= 100 for o, d in blocks)
+    assert np.concatenate([o for o, _ in blocks]).tolist() == list(range(10))
+    # more destinations than routes: one origin per block, the scheduler splits the destinations
+    assert [len(o) for o, _ in ors_matrix.plan_blocks(3, 200, 100)] == [1, 1, 1]
+
+
+def test_dropped_connections_fail_their_origins_only(points, monkeypatch):
+    import functools
+    path, ids, lonlat = points
+    dropped = mock_ors.dropped(lonlat, 0.2)
+    assert 0 < dropped.sum() < len(ids)
+    # retries without waiting
+    monkeypatch.setattr(ors_matrix, 'request_matrix',
+                        functools.partial(ors_matrix.request_matrix, retries=2, backoff=0))
+    # one origin per block, the requests of the dropped origins fail after their retries
+    writer, failed, stats = run(path, max_routes=30, drop_share=0.2)
+    assert stats['dropped'] == 2 * dropped.sum()
+    assert sorted(failed) == sorted(ids[dropped].tolist())
+    assert set(writer.rows) == set(ids[~dropped].tolist())
+    for i in np.flatnonzero(~dropped):
+        expected_km = mock_ors.distance_m(lonlat[[i]], lonlat)[0] * mock_ors.options['detour'] / 1000
+        assert np.allclose(writer.rows[ids[i]][2], expected_km, rtol=1e-3, atol=1e-4)
@@ -0,0 +1,32 @@
+import os
+import shutil
+
+import osm_extract
+from conftest import DATA
+
+# small_extract.osm: residential street 101 and service road 106 (not private) near Aachen, primary road 105 about
+# 30 km further east, footway 102, private service road 103 and stream 104
+EXTRACT = os.path.join(DATA, 'small_extract.osm')
+
+
+def test_store_keeps_the_road_types_of_script_01(tmp_path):
+    extract = str(tmp_path / 'small_extract.osm')
+    shutil.copy(EXTRACT, extract)
+    store = osm_extract.build_store(extract)
+    assert store == str(tmp_path / 'small_extract_highways.gpkg')
+    roads = osm_extract.read_region(store, (6.0, 50.7, 6.6, 50.8), 'EPSG:4326')
+    assert sorted(roads['osm_id'].astype(int)) == [101, 105, 106]
+    assert set(roads['highway']) <= set(osm_extract.road_types)
+
+    # the store is reused while the extract is not newer
+    mtime = os.path.getmtime(store)
+    assert osm_extract.build_store(extract) == store
+    assert os.path.getmtime(store) == mtime
+
+
+def test_read_region_returns_the_roads_of_the_extent(tmp_path):
+    store = osm_extract.build_store(EXTRACT, str(tmp_path / 'highways.gpkg'))
+    # extent around Aachen in metric coordinates, the primary road in the east is left out
+    roads = osm_extract.read_region(store, (290000, 5625000, 296000, 5631000), 'EPSG:25832')
+    assert sorted(roads['osm_id'].astype(int)) == [101, 106]
+    assert roads.crs.to_epsg() == 4326
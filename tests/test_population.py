@@ -0,0 +1,29 @@
+import numpy as np
+import shapely
+
+import population
+
+
+def test_population_sum_matches_voronoi_join():
+    # qgis:voronoipolygons of the road points + qgis:joinbylocationsummary (sum) of the census points
+    rng = np.random.default_rng(2)
+    road_xy = rng.uniform(0, 5000, (40, 2))
+    census_xy = rng.uniform(0, 5000, (2000, 2))
+    census = rng.integers(0, 20, 2000).astype(float)
+    census[::50] = np.nan  # cells without value count as 0
+
+    cells = shapely.voronoi_polygons(shapely.multipoints(road_xy), extend_to=shapely.box(-1e4, -1e4, 2e4, 2e4))
+    cells = shapely.get_parts(cells)
+    expected = np.zeros(len(road_xy))
+    for cell in cells:
+        road = np.flatnonzero(shapely.contains_xy(cell, road_xy[:, 0], road_xy[:, 1]))[0]
+        expected[road] = np.nansum(census[shapely.contains_xy(cell, census_xy[:, 0], census_xy[:, 1])])
+
+    assert np.allclose(population.population_sum(road_xy, census_xy, census), expected)
+    assert np.isclose(expected.sum(), np.nansum(census))
+
+
+def test_assign_population_sets_sums_below_one_to_zero():
+    road_xy = np.array([[0, 0], [1000, 0]], dtype=float)
+    census_xy = np.array([[10, 0], [990, 0], [1010, 0]], dtype=float)
+    assert population.assign_population(road_xy, census_xy, [0.5, 0.4, 3]).tolist() == [0, 3.4]
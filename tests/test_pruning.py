@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import impedance
+import pruning
+
+
+def test_radius_bounds_both_modes_with_the_paper_parameters():
+    # the driving decay of the paper hardly drops, so the driving radius is far beyond any region
+    radius = pruning.pruning_radius(impedance.powerexp_paper, {'h': 0.001, 'km': 0.001})
+    assert radius > 10_000_000
+    assert pruning.pruning_radius(impedance.powerexp_paper, 0.001) == radius
+    # the larger radius is used: a destination beyond it weighs at most epsilon in both modes
+    weights = pruning.max_weights(impedance.powerexp_paper, radius)
+    assert weights['h'] <= 0.001 and weights['km'] <= 0.001
+
+
+@pytest.mark.parametrize('epsilon', [{'km': 0.001}, {'h': 0.001}, {'h': 0.001, 'km': None}, {'h': 0.001, 'km': 0},
+                                     -0.001])
+def test_epsilon_that_leaves_a_mode_unbounded_is_refused(epsilon):
+    with pytest.raises(ValueError):
+        pruning.pruning_radius(impedance.powerexp_paper, epsilon)
+
+
+def test_error_bounds_per_mode_cover_the_truncation_error():
+    # driving decay much faster than in the paper, otherwise nothing is pruned
+    variant, max_speed = {'name': 'fast', 'h': [(20.0, 1.0)], 'km': impedance.powerexp_paper['km']}, 130
+    rng = np.random.default_rng(1)
+    origin_xy = rng.uniform(0, 60_000, (20, 2))
+    dest_xy = rng.uniform(0, 60_000, (200, 2))
+    population = rng.integers(5, 500, 200).astype(float)
+
+    radius = pruning.pruning_radius(variant, 0.001, max_speed)
+    candidates = pruning.candidate_destinations(origin_xy, dest_xy, radius)
+    assert sum(len(c) for c in candidates) < 20 * 200
+    report = pruning.error_bound(np.arange(20), candidates, population, pruning.max_weights(variant, radius, max_speed))
+    assert (report['pruned_population'] > 0).any()
+
+    # exact error with straight-line routes at max_speed, the fastest and shortest possible ones
+    km = np.hypot(*(origin_xy[:, None, :] - dest_xy[None, :, :]).transpose(2, 0, 1)) / 1000
+    pruned = np.ones(km.shape, dtype=bool)
+    for o, c in enumerate(candidates):
+        pruned[o, c] = False
+    b1, b2, average = impedance.stack_functions([variant], 'h')
+    error_h = [(average @ impedance.powerexp(b1, b2, km[o, pruned[o]][None, :] / max_speed)
+                * population[pruned[o]]).sum() for o in range(20)]
+    b1, b2, average = impedance.stack_functions([variant], 'km')
+    error_km = [(average @ impedance.powerexp(b1, b2, km[o, pruned[o]][None, :]) * population[pruned[o]]).sum()
+                for o in range(20)]
+    assert (np.array(error_h) <= report['max_error_exp_h_w'] + 1e-9).all()
+    assert (np.array(error_km) <= report['max_error_exp_km_w'] + 1e-9).all()
+    assert report['max_error_exp_h_w'].max() <= 0.001 * population.sum()
+    assert report['max_error_exp_km_w'].max() <= 0.001 * population.sum()
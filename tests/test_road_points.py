@@ -0,0 +1,62 @@
+import os
+import numpy as np
+import geopandas as gpd
+import shapely
+
+import road_points
+from conftest import DATA
+
+# creategrid_hexagon_1000m.geojson: hexagon grid over 290000,293700,5625000,5628300 [EPSG:25832] with
+# HSPACING = VSPACING = 1000 and no overlay, as written by
+#   processing.run("native:creategrid", {'TYPE': 4, 'EXTENT': '290000,293700,5625000,5628300 [EPSG:25832]',
+#                  'HSPACING': 1000, 'VSPACING': 1000, 'HOVERLAY': 0, 'VOVERLAY': 0, 'CRS': 'EPSG:25832', 'OUTPUT': ...})
+# (vertices of QgsGridAlgorithm::createHexagonGrid, regenerate with the call above to check against a QGIS release)
+EXTENT = (290000, 5625000, 293700, 5628300)
+STRtree = shapely.STRtree
+
+
+def creategrid_centroids():
+    grid = gpd.read_file(os.path.join(DATA, 'creategrid_hexagon_1000m.geojson'))
+    return grid['id'].to_numpy(), shapely.get_coordinates(grid.geometry.centroid.to_numpy())
+
+
+def test_grid_centroids_match_creategrid():
+    expected_ids, expected_xy = creategrid_centroids()
+    ids, xy = road_points.grid_centroids(EXTENT, 1000)
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(xy, expected_xy, atol=1e-6)
+
+
+def test_aligned_extent_keeps_the_lattice():
+    # two extents aligned to the same lattice give the same centroids where they overlap
+    _, a = road_points.grid_centroids(road_points.aligned_extent((290300, 5625000, 296000, 5629000), 1000), 1000)
+    _, b = road_points.grid_centroids(road_points.aligned_extent((292100, 5624500, 298000, 5629000), 1000), 1000)
+    a = {tuple(p) for p in np.round(a, 6)}
+    b = {tuple(p) for p in np.round(b, 6)}
+    overlap = [p for p in a if 293000 < p[0] < 295500]
+    assert overlap and all(p in b for p in overlap)
+
+
+def test_road_points_snap_and_deduplicate():
+    buffer = gpd.GeoDataFrame(geometry=[shapely.box(*EXTENT)], crs='EPSG:25832')
+    roads = gpd.GeoDataFrame(geometry=[shapely.LineString([(290000, 5626700), (293700, 5626700)])], crs='EPSG:25832')
+    points = road_points.road_points(roads, buffer, 1000)
+    # only centroids within grid_space/2 of the road, all moved onto it, one point per location
+    assert len(points) > 0
+    np.testing.assert_allclose(points.geometry.y, 5626700)
+    assert not points.geometry.to_wkb().duplicated().any()
+
+
+def test_quadtree_builds_one_road_index(monkeypatch):
+    # population in the lower left corner, roads every 250 m in both directions
+    roads = np.array([shapely.LineString([(0, y), (8000, y)]) for y in range(0, 8001, 250)]
+                     + [shapely.LineString([(x, 0), (x, 8000)]) for x in range(0, 8001, 250)])
+    population_xy = np.random.default_rng(0).uniform(0, 2000, (500, 2))
+    trees = []
+    monkeypatch.setattr(shapely, 'STRtree', lambda geoms: trees.append(1) or STRtree(geoms))
+    xy, side, snapped = road_points.quadtree_cells((0, 0, 8000, 8000), roads, shapely.box(0, 0, 8000, 8000),
+                                                   population_xy, np.ones(500), 500, 4000, budget=16)
+    assert len(trees) == 1
+    assert (~np.isnan(snapped[:, 0])).sum() <= 16
+    assert side.min() < 4000 and side[xy[:, 0] > 4000].min() == 4000  # only the populated corner is refined
+
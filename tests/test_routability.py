@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import os
+import numpy as np
+import pytest
+
+import mock_ors
+import ors_matrix
+import routability
+from conftest import mock_ors_server
+
+
+@pytest.fixture(scope='module')
+def ors_url():
+    process, url = mock_ors_server(unroutable_share=0.05, latency_ms=1)
+    yield url
+    process.terminate()
+
+
+def lonlat_grid(n=20):
+    lon, lat = np.meshgrid(np.linspace(6.0, 6.2, n), np.linspace(50.7, 50.85, n))
+    return np.column_stack([lon.ravel(), lat.ravel()])
+
+
+def test_not_snapped_points_and_cache_per_graph_build(tmp_path, ors_url):
+    lonlat = lonlat_grid()
+    gids = np.arange(len(lonlat), dtype='int64')
+    cache_path = str(tmp_path / 'driving-car_350m.csv')
+    checked = routability.check_points(gids, lonlat, cache_path, ors_url, 'driving-car')
+
+    unroutable = mock_ors.unroutable(np.round(lonlat, 6), 0.05)
+    assert unroutable.any()
+    np.testing.assert_array_equal(checked['status'].to_numpy() == 'not_snapped', unroutable)
+    assert (checked['status'][~unroutable] == 'ok').all()
+    # one cache file per graph build, the base name is never written
+    assert os.listdir(tmp_path) == ['driving-car_350m_20250801T120000Z.csv']
+    assert routability.graph_cache_path(cache_path, ors_url, 'cycling-regular').endswith('_20250801T120000Z.csv')
+    assert routability.graph_cache_path(cache_path, ors_url, 'wheelchair') is None
+
+
+def run_check(lonlat, hub_durations, monkeypatch):
+    monkeypatch.setattr(routability, 'snap', lambda *args, **kwargs: asyncio.sleep(0, (lonlat.copy(), np.zeros(len(lonlat)))))
+    monkeypatch.setattr(routability, 'hub_durations', hub_durations)
+    cache = routability.load_cache(None)
+    return asyncio.run(routability._check(np.arange(len(lonlat), dtype='int64'), lonlat, cache, 'http://unused',
+                                          'driving-car', 350, 2500, 10, None))
+
+
+def test_hub_on_isolated_component_flags_nothing(monkeypatch, caplog):
+    # every hub reaches only 10 % of the points, e.g. all hubs on a small separate part of the graph
+    async def hub_durations(session, url, profile, lonlat, hub, points, max_routes, not_snapped, request_slots=None):
+        durations = np.full(len(lonlat), np.nan)
+        durations[points[:len(points) // 10]] = 60
+        return durations, durations
+    lonlat = lonlat_grid(10)
+    with caplog.at_level(logging.WARNING):
+        checked = run_check(lonlat, hub_durations, monkeypatch)
+    assert (checked['status'] == 'ok').all()
+    assert 'No hub reaches half of the points' in caplog.text
+
+
+def test_failing_hubs_flag_nothing_and_warn(monkeypatch, caplog):
+    async def hub_durations(*args, **kwargs):
+        raise ors_matrix.OrsError(500, 2099, 'internal error')
+    with caplog.at_level(logging.WARNING):
+        checked = run_check(lonlat_grid(10), hub_durations, monkeypatch)
+    assert (checked['status'] == 'ok').all()
+    assert 'No hub reaches half of the points' in caplog.text
+
+
+def test_first_hub_above_threshold_is_used(monkeypatch):
+    calls = []
+
+    async def hub_durations(session, url, profile, lonlat, hub, points, max_routes, not_snapped, request_slots=None):
+        calls.append(hub)
+        durations = np.full(len(lonlat), np.nan)
+        # first hub isolated, second reaches all but the last five points
+        durations[points[:5] if len(calls) == 1 else points[:-5]] = 60
+        return durations, durations
+    checked = run_check(lonlat_grid(10), hub_durations, monkeypatch)
+    assert len(calls) == 2
+    assert (checked['status'] == 'isolated').sum() == 5
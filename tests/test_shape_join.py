@@ -0,0 +1,58 @@
+import geopandas as gpd
+import numpy as np
+import pyogrio
+import pytest
+import shapely
+
+import shape_join
+
+REGION = shapely.box(0, 0, 4000, 4000)
+# L-shaped lot: its envelope reaches the first tile (0, 0, 2000, 2000), its geometry does not
+L_SHAPE = shapely.union(shapely.box(3000, 0, 4000, 4000), shapely.box(500, 3000, 4000, 4000))
+
+
+@pytest.fixture
+def layers(tmp_path):
+    shapes = gpd.GeoDataFrame({
+        'id_vl': [1, 2, 3, 4],
+        'area_m2': [1.0, 2.0, 3.0, 4.0],
+    }, geometry=[shapely.box(100, 100, 300, 300),  # one tile
+                 shapely.box(1900, 1900, 2100, 2100),  # four tiles
+                 L_SHAPE,
+                 shapely.box(5000, 5000, 5100, 5100)],  # outside the region
+        crs=25832)
+    shapes_path = str(tmp_path / 'lots.gpkg')
+    shapes.to_file(shapes_path, layer='lots', driver='GPKG')
+    points = gpd.GeoDataFrame({
+        'CC_mean': [0.1, 0.9], 'CC_mean_car': [0.2, 0.8], 'CC_mean_shortdist': [0.3, 0.7], 'Gem_layer': ['A', 'A'],
+    }, geometry=shapely.points([(0, 0), (4000, 4000)]), crs=25832)
+    return shapes_path, points
+
+
+read_dataframe = pyogrio.read_dataframe
+
+
+# bounding box query by envelope only, like a spatial index without a check of the geometry
+def read_by_envelope(path, layer=None, bbox=None, columns=None, **kwargs):
+    shapes = read_dataframe(path, layer=layer, columns=columns, **kwargs)
+    if bbox is None:
+        return shapes
+    return shapes[shapely.intersects(shapely.envelope(shapes.geometry.to_numpy()), shapely.box(*bbox))]
+
+
+@pytest.mark.parametrize('envelope_query', [False, True])
+def test_every_polygon_is_joined_once(layers, tmp_path, monkeypatch, envelope_query):
+    shapes_path, points = layers
+    if envelope_query:
+        monkeypatch.setattr(pyogrio, 'read_dataframe', read_by_envelope)
+    ids = [i for shapes in shape_join.iter_region_shapes(shapes_path, 'lots', REGION, 25832, ['id_vl'], tile_size=2000)
+           for i in shapes['id_vl']]
+    assert sorted(ids) == [1, 2, 3]
+
+    outname = str(tmp_path / 'joined.gpkg')
+    assert shape_join.join_region(shapes_path, 'lots', points, REGION, 25832, outname, tile_size=2000) == 3
+    joined = gpd.read_file(outname).set_index('OBJECTID').sort_index()
+    assert joined.index.tolist() == [1, 2, 3]
+    # nearest point like st_nearest_feature, the first one at equal distance
+    assert joined['CC_mean'].tolist() == [0.1, 0.1, 0.9]
+    assert np.allclose(joined['Shape_Area'], [1, 2, 3])
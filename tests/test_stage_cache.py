@@ -0,0 +1,56 @@
+import os
+
+import stage_cache
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_key_changes_with_input_content_and_params(tmp_path):
+    cache = stage_cache.StageCache(str(tmp_path / 'cache'))
+    source = tmp_path / 'input.csv'
+    write(source, 'a;b\n1;2\n')
+    key = cache.key('grid', {'grid_space': 1000}, [str(source)])
+    assert cache.key('grid', {'grid_space': 1000}, [str(source)]) == key
+    assert cache.key('grid', {'grid_space': 500}, [str(source)]) != key
+    write(source, 'a;b\n1;3\n')
+    os.utime(source, ns=(0, 1))  # other mtime, the digest is computed again
+    assert cache.key('grid', {'grid_space': 1000}, [str(source)]) != key
+
+
+def test_outputs_changed_in_place_do_not_change_the_cache(tmp_path):
+    # e.g. native:createspatialindex on an output of script 01 in script 02
+    cache = stage_cache.StageCache(str(tmp_path / 'cache'))
+    output = tmp_path / 'run1' / 'points.csv'
+    output.parent.mkdir()
+    write(output, 'stored')
+    cache.store('population', 'k1', [str(output)])
+    write(output, 'changed after store')
+
+    restored = tmp_path / 'run2' / 'points.csv'
+    assert cache.restore('population', 'k1', [str(restored)])
+    assert read(restored) == 'stored'
+    write(restored, 'changed after restore')
+    assert cache.restore('population', 'k1', [str(tmp_path / 'run3' / 'points.csv')])
+    assert read(tmp_path / 'run3' / 'points.csv') == 'stored'
+    assert not cache.restore('population', 'other', [str(restored)])
+
+
+def test_folders_are_restored_file_by_file(tmp_path):
+    cache = stage_cache.StageCache(str(tmp_path / 'cache'))
+    folder = tmp_path / 'run1' / 'Matrizen'
+    folder.mkdir(parents=True)
+    write(folder / 'Matrix_1.csv', '1')
+    write(folder / 'Matrix_2.csv', '2')
+    cache.store('matrix', 'k', [str(folder)])
+    target = tmp_path / 'run2' / 'Matrizen'
+    assert cache.restore('matrix', 'k', [str(target)])
+    assert sorted(os.listdir(target)) == ['Matrix_1.csv', 'Matrix_2.csv']
+    assert read(target / 'Matrix_2.csv') == '2'